@@ -1,7 +1,7 @@
 import logging
 import warnings
 
-from . import extractor, caller
+from . import extractor, caller, warmup, config_reload
 from .connectors import webchat
 from .database import resolver, broker
 from .settings import LOG_DIR_PATH_AND_SEP, IS_DEBUG
@@ -41,6 +41,10 @@ if __name__ == '__main__':
     broker.load_db_schema()
     broker.load_db_view()
     broker.test_connection()
+    # before serving, so that the first users find the caches warm
+    warmup.run()
+    resolver.start_category_stats()
+    config_reload.start()
     extractor.load_model()
 
     logging.info('Bot successfully started!')
@@ -1,15 +1,15 @@
 import copy
-import datetime
+import functools
 import logging
 import pathlib
 import random
 import re
 from typing import Optional, Any
 
-import matplotlib.pyplot as plt
 from pydantic import parse_obj_as
 
-from chatidea import commons, extractor
+from chatidea import charts, commons, executors, extractor
+from chatidea.chart_cache import chart_cache, chart_name
 from chatidea import nltrasnslator, autocompleter
 from chatidea.actions import meta
 from chatidea.actions.common import action, ActionReturn
@@ -18,7 +18,7 @@ from chatidea.database import resolver
 from chatidea.extractor import Entity
 from chatidea.patterns import btn, msg, nlu
 from chatidea.settings import ELEMENT_VISU_LIMIT, CONTEXT_VISU_LIMIT, \
-    ELEMENT_SIMILARITY_DISTANCE_THRESHOLD
+    CATEGORY_VISU_LIMIT, ELEMENT_SIMILARITY_DISTANCE_THRESHOLD
 
 logger = logging.getLogger(__name__)
 
@@ -67,8 +67,7 @@ def compute_ordered_entity_list(entities: list[extractor.Entity]):
                 else:
                     maybe_op = None
                 maybe_op = commons.extract_similar_value(maybe_op,
-                                                         ['less than',
-                                                          'more than'], 6)
+                                                         NUMBER_OPERATORS, 6)
                 if maybe_op:
                     if maybe_op == 'less than':
                         op = '<'
@@ -113,12 +112,8 @@ def get_attributes_from_ordered_entities(element_name, ordered_entities) -> list
 
         # if the entity has an attribute, i.e. if it not implied
         if oe.get('attribute'):
-            order_by_alias = ['order by', 'ordered by', 'sort by', 'sorted by']
-            keyword_list = [a.keyword for a in
-                            resolver.extract_attributes_with_keyword(
-                                element_name)]
-            for alias in order_by_alias:
-                keyword_list.append(alias)
+            order_by_alias = ORDER_BY_ALIASES
+            keyword_list = get_order_by_keywords(element_name)
             attribute_name = commons.extract_similar_value(oe['attribute'],
                                                            keyword_list,
                                                            ELEMENT_SIMILARITY_DISTANCE_THRESHOLD)
@@ -176,6 +171,37 @@ def get_attributes_string(attributes: list[tuple[Any, str, Attribute]]):
 
 # SIMILARITY HANDLERS
 
+NUMBER_OPERATORS = ['less than', 'more than']
+ORDER_BY_ALIASES = ['order by', 'ordered by', 'sort by', 'sorted by']
+
+
+def get_order_by_keywords(element_name):
+    return [a.keyword for a in
+            resolver.extract_attributes_with_keyword(element_name)] \
+        + ORDER_BY_ALIASES
+
+
+def get_relation_keywords(element_name):
+    return [r['keyword'] for r in resolver.extract_relations(element_name)]
+
+
+def get_column_names(element_name_alias):
+    displayable_attributes = resolver.simulate_view(element_name_alias)
+    attribute_names = [i.attribute for i in displayable_attributes]
+    displayed_names = [i.display for i in displayable_attributes]
+    return attribute_names, displayed_names
+
+
+def get_similarity_keyword_lists(element_name):
+    """The lists of keywords the entities about the element are matched to."""
+    keyword_lists = [NUMBER_OPERATORS, get_order_by_keywords(element_name),
+                     get_relation_keywords(element_name),
+                     resolver.get_all_primary_element_names_and_aliases()]
+    if resolver.has_view(element_name):
+        keyword_lists.extend(get_column_names(element_name))
+    return keyword_lists
+
+
 def handle_element_name_similarity(element_name_received: str):
     all_elements_names = resolver.get_all_primary_element_names_and_aliases()
     similar = commons.extract_similar_value(element_name_received,
@@ -187,19 +213,14 @@ def handle_element_name_similarity(element_name_received: str):
 
 
 def handle_element_relations_similarity(element_name, relation_name_received):
-    relations = resolver.extract_relations(element_name)
-    all_relations_names = [r['keyword'] for r in relations]
+    all_relations_names = get_relation_keywords(element_name)
     return commons.extract_similar_value(relation_name_received,
                                          all_relations_names,
                                          ELEMENT_SIMILARITY_DISTANCE_THRESHOLD)
 
 
 def handle_columns_name_similarity(element_name_alias, columns_name_received):
-    displayable_attributes = resolver.simulate_view(element_name_alias)
-    attribute_names = [i['attribute'] for i in displayable_attributes if
-                       'attribute' in i]
-    displayed_names = [i['display'] for i in displayable_attributes if
-                       'display' in i]
+    attribute_names, displayed_names = get_column_names(element_name_alias)
     similar = commons.extract_similar_value(columns_name_received,
                                             attribute_names,
                                             ELEMENT_SIMILARITY_DISTANCE_THRESHOLD)
@@ -210,9 +231,7 @@ def handle_columns_name_similarity(element_name_alias, columns_name_received):
                                                 displayed_names,
                                                 ELEMENT_SIMILARITY_DISTANCE_THRESHOLD)
         if similar:
-            for i in displayable_attributes:
-                if i['display'] is similar:
-                    return i['attribute']
+            return attribute_names[displayed_names.index(similar)]
         else:
             return None
 
@@ -264,7 +283,7 @@ def add_selected_element_to_context(element, position, context):
     selected_element = dict(element)
 
     # I must save it as a list
-    selected_element['value'] = [element['value'][position - 1]]
+    selected_element['value'] = element['value'][position - 1:position]
     selected_element['query'] = None
     selected_element['real_value_length'] = 1
     selected_element['action_name'] = '...selected from:'
@@ -274,12 +293,8 @@ def add_selected_element_to_context(element, position, context):
 
 
 def is_value_in_selection_valid(element, position, title):
-    # copying the dictionary
-    selected_element = dict(element)
-    # I must save it as a list
-    selected_element['value'] = [element['value'][position - 1]]
-    match = resolver.get_element_show_string(selected_element['element_name'],
-                                             selected_element['value'][0])
+    match = resolver.get_element_show_string(element['element_name'],
+                                             element['value'][position - 1])
     match = clean_title_for_selection(match)
     if match[:29] == title:  # 29 chars is max title payload
         return True
@@ -658,6 +673,7 @@ def action_show_more_elements(entities, context) -> ActionReturn:
     element['show']['from'] = element['show']['from'] + ELEMENT_VISU_LIMIT
     element['show']['to'] = min(element['real_value_length'],
                                 element['show']['to'] + ELEMENT_VISU_LIMIT)
+    resolver.load_rows(element, element['show']['to'])
     context.reset_show_last_element = False
     return action_view_context_element(entities, context).get_components()
 
@@ -696,10 +712,9 @@ def action_order_by(entities, context) -> ActionReturn:
 def action_order_by_attribute(entities, context) -> ActionReturn:
     attribute_to_order_by = extract_single_entity_value(entities, nlu.ENTITY_POSITION)
     element = context.get_last_element()
-    value = element['value']
-    # All None element are put in the end
-    value = sorted(value, key=lambda k: (k[attribute_to_order_by] is None, k[attribute_to_order_by]))
-    element['value'] = value
+    # Sorted by the database when paginated, otherwise the None values are put
+    # at the end
+    resolver.sort_rows(element, attribute_to_order_by)
     context.reset_show_last_element = False
     return action_view_context_element(entities, context).get_components()
 
@@ -869,8 +884,9 @@ def action_show_table_categories(entities: list[Entity], context, add=True) -> A
     if not category:
         return [f"I cannot find more info about {element_name}s."], base_buttons
 
-    element = resolver.query_category(element_name, category)
-    plot_file = create_plot(element, (category.alias or category.column).upper(), session=context.session)
+    element = resolver.query_category(element_name, category,
+                                      top=CATEGORY_VISU_LIMIT)
+    plot_file = create_plot(element, (category.alias or category.column).upper())
 
     if add:
         context.append_element({
@@ -886,48 +902,24 @@ def action_show_table_categories(entities: list[Entity], context, add=True) -> A
     ], btn.get_buttons_select_category(element_name, category.alias, element['value']) + base_buttons
 
 
-def create_plot(categories, legend_title, session: Optional[str] = None) -> pathlib.Path:
-    plt.switch_backend('Agg')
-
-    total = 0
-    labels = []
-    sizes = []
-    perc = []
+def create_plot(categories, legend_title) -> pathlib.Path:
     items = categories['value']
-    displayed_items = 5 if len(items) > 5 else len(items)
-
-    for i in items:
-        total += i['count']
-
-    for i in range(displayed_items):
-        labels.append(items[i]['category'])
-        sizes.append(items[i]['count'])
-        perc.append(sizes[i] * 100 / total)
-
-    if displayed_items < len(items):
-        other_count = 0
-        for i in range(displayed_items, len(items)):
-            other_count += items[i]['count']
+    shown = items[:CATEGORY_VISU_LIMIT]
+    labels = [i['category'] for i in shown]
+    sizes = [i['count'] for i in shown]
+    # the categories left out by the query, and the ones not shown
+    other_count = categories.get('other', 0) + \
+        sum(i['count'] for i in items[CATEGORY_VISU_LIMIT:])
+    if other_count:
         labels.append('Other')
         sizes.append(other_count)
-        perc.append(sizes[displayed_items] * 100 / total)
-
-    colors = ['tomato', 'mediumseagreen', 'pink', 'darkturquoise', 'gold',
-              'dimgrey']
-    patches, texts = plt.pie(sizes, colors=colors, autopct=None, startangle=90,
-                             labeldistance=None, textprops={'fontsize': 14},
-                             wedgeprops={'linewidth': 0.5,
-                                         'edgecolor': 'black'})
-    plt.legend(patches,
-               labels=['%s, %1.1f %%' % (l, p) for l, p in zip(labels, perc)],
-               title=legend_title, title_fontsize='large', loc='lower center',
-               bbox_to_anchor=(0.5, 1))
-
-    timestamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    filename = f"pie-{timestamp}.png" if not session else f"pie-{session}-{timestamp}.png"
-    base = pathlib.Path("static")
-    base.mkdir(exist_ok=True, parents=True)
-    plt.axis('equal')
-    plt.savefig(base / filename, bbox_inches="tight")
-    plt.close()
-    return base / filename
+    total = sum(sizes)
+    perc = [size * 100 / total for size in sizes]
+
+    labels = [str(l) for l in labels]
+    # Rendering is CPU-bound: it is moved to a worker process (if configured),
+    # and only done if the same chart is not in the cache already
+    return chart_cache.get_or_render(
+        chart_name('pie', legend_title, labels, sizes),
+        functools.partial(executors.run_cpu_bound, charts.render_pie_chart,
+                          labels, sizes, perc, legend_title))
@@ -0,0 +1,152 @@
+import collections
+import dataclasses
+import threading
+import time
+from typing import Generic, TypeVar, Hashable, Optional, Callable, Iterable, Any
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+@dataclasses.dataclass(frozen=True)
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+@dataclasses.dataclass
+class _Entry(Generic[V]):
+    value: V
+    expires_at: Optional[float]
+    size: int
+    tags: frozenset
+
+
+class LRUCache(Generic[K, V]):
+    """
+    A thread-safe least-recently-used cache.
+
+    Entries expire after ``ttl`` seconds (if given) and the least recently
+    used ones are evicted when there are more than ``max_entries`` entries or
+    when the sum of their sizes, as computed by ``sizeof``, exceeds
+    ``max_size``. Entries can be tagged when they are stored, so that all the
+    entries sharing a tag can be invalidated at once.
+    """
+
+    def __init__(self, max_entries: int = 1024,
+                 ttl: Optional[float] = None,
+                 max_size: Optional[int] = None,
+                 sizeof: Optional[Callable[[V], int]] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self._entries: collections.OrderedDict[K, _Entry[V]] = \
+            collections.OrderedDict()
+        self._tags: dict[Hashable, set[K]] = collections.defaultdict(set)
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.RLock()
+
+    def get(self, key: K, default: Any = None) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None \
+                    and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry.value
+
+    def put(self, key: K, value: V, tags: Iterable[Hashable] = ()):
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.max_size is not None and size > self.max_size:
+            # It would evict everything else and still not fit
+            self.invalidate(key)
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            entry = _Entry(value, expires_at, size, frozenset(tags))
+            self._entries[key] = entry
+            self._size += size
+            for tag in entry.tags:
+                self._tags[tag].add(key)
+            self._evict()
+
+    def get_or_compute(self, key: K, compute: Callable[[], V],
+                       tags: Iterable[Hashable] = ()) -> V:
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value, tags)
+        return value
+
+    def invalidate(self, key: K) -> bool:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._size = 0
+
+    @property
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions,
+                              len(self._entries), self._size)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry.expires_at is None
+                                          or entry.expires_at > time.monotonic())
+
+    def _remove(self, key: K):
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _evict(self):
+        while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_size is not None and self._size > self.max_size)):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self._evictions += 1
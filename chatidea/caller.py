@@ -1,16 +1,25 @@
-import datetime
+import atexit
 import re
-import threading
 from pprint import pformat
 
 from chatidea import actions
-from chatidea import conversation, extractor
+from chatidea import context_store, conversation, extractor
+from chatidea.sessions import SessionStore
 from chatidea.settings import INTENT_CONFIDENCE_THRESHOLD, \
-    CONTEXT_PERSISTENCE_SECONDS
-
-context_dict = {}
-
-lock = threading.Lock()
+    CONTEXT_PERSISTENCE_SECONDS, CONTEXT_MAX_SESSIONS, \
+    CONTEXT_SWEEP_SECONDS, CONTEXT_STORE, CONTEXT_STORE_PATH, \
+    CONTEXT_STORE_JOURNAL_MODE
+
+store = context_store.create_store(CONTEXT_STORE, CONTEXT_STORE_PATH,
+                                   CONTEXT_STORE_JOURNAL_MODE)
+sessions = SessionStore(CONTEXT_PERSISTENCE_SECONDS, CONTEXT_MAX_SESSIONS,
+                        CONTEXT_SWEEP_SECONDS,
+                        factory=lambda chat_id: conversation.Context(chat_id,
+                                                                     store),
+                        on_sweep=lambda: store.purge(
+                            CONTEXT_PERSISTENCE_SECONDS))
+atexit.register(store.close)
+atexit.register(sessions.close)
 
 
 def run_action_from_parsed_message(parsed_message: extractor.ParsedMessage,
@@ -24,52 +33,24 @@ def run_action_from_parsed_message(parsed_message: extractor.ParsedMessage,
     if intent_confidence < INTENT_CONFIDENCE_THRESHOLD:
         intent_name = None
 
-    context = get_context(chat_id)
-
-    context.log('New message received!\n'
-                'Original message: {}\n'
-                'Intent matched: {}\n'
-                'Entities:\n'
-                '{}'.format(parsed_message.original_message,
-                            intent_name,
-                            pformat(entities)))
-
-    return actions.execute_action_from_intent_name(intent_name, entities,
-                                                   context)
+    # the context is locked until the action is over, so that the messages
+    # of the same chat cannot modify it concurrently
+    with sessions.hold(chat_id) as context:
+        context.sync()
+        context.log('New message received!\n'
+                    'Original message: {}\n'
+                    'Intent matched: {}\n'
+                    'Entities:\n'
+                    '{}'.format(parsed_message.original_message,
+                                intent_name,
+                                pformat(entities)))
+
+        try:
+            return actions.execute_action_from_intent_name(intent_name,
+                                                           entities, context)
+        finally:
+            context.flush()
 
 
 def get_context(chat_id):
-    lock.acquire()
-
-    # check_timestamps()
-
-    # conversation was already defined
-    if context_dict.get(chat_id):
-
-        update_timestamp(chat_id)
-        context = context_dict[chat_id]['context']
-
-    else:
-
-        context = conversation.Context(chat_id)
-        context_dict[chat_id] = {'context': context}
-        update_timestamp(chat_id)
-
-        # schedule_delete_event(chat_id)
-
-    lock.release()
-
-    return context
-
-
-def check_timestamps():
-    max_age = datetime.datetime.now() - datetime.timedelta(
-        seconds=CONTEXT_PERSISTENCE_SECONDS)
-
-    for k, v in list(context_dict.items()):
-        if v['timestamp'] < max_age:
-            del context_dict[k]
-
-
-def update_timestamp(chat_id):
-    context_dict[chat_id]['timestamp'] = datetime.datetime.now()
+    return sessions.get(chat_id)
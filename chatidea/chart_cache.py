@@ -0,0 +1,117 @@
+"""
+The rendered charts, named after a hash of what they show: the same chart is
+rendered once and then shared by all the sessions.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import uuid
+from typing import Any, Callable, Optional
+
+from chatidea.cache import LRUCache
+from chatidea.settings import STATIC_DIR, CHART_CACHE_MAX_BYTES, \
+    CHART_CACHE_MEMORY_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+def chart_name(kind: str, *content: Any) -> str:
+    """The file name of the chart of the given kind showing ``content``."""
+    data = json.dumps(content, default=str, separators=(',', ':'))
+    return f'{kind}-{hashlib.sha256(data.encode()).hexdigest()[:32]}.png'
+
+
+class ChartCache:
+    """
+    The PNG files of the charts in ``directory``, served by the web chat at
+    ``url_prefix``. When they take more than ``max_bytes``, the least
+    recently used ones are deleted; the most recent ones are also kept in
+    memory, up to ``memory_bytes``.
+    """
+
+    def __init__(self, directory: pathlib.Path, url_prefix: str,
+                 max_bytes: int, memory_bytes: int):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.max_bytes = max_bytes
+        self._memory: LRUCache[str, bytes] = LRUCache(
+            max_entries=1024, max_size=memory_bytes, sizeof=len)
+        self._files: Optional[collections.OrderedDict[str, int]] = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _index(self) -> collections.OrderedDict[str, int]:
+        # Must be called while holding the lock. The charts rendered by the
+        # previous runs are reused, the oldest first to be deleted.
+        if self._files is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            files = sorted((p.stat().st_mtime, p.name, p.stat().st_size)
+                           for p in self.directory.glob('*.png')
+                           if not p.name.startswith('.'))
+            self._files = collections.OrderedDict(
+                (name, size) for _, name, size in files)
+            self._size = sum(self._files.values())
+        return self._files
+
+    def get_or_render(self, name: str,
+                      render: Callable[[str], Any]) -> pathlib.Path:
+        """
+        The path of the chart, which is rendered to the given path by
+        ``render`` if it is not in the cache.
+        """
+        path = self.directory / name
+        with self._lock:
+            files = self._index()
+            if name in files:
+                files.move_to_end(name)
+                return path
+        # Rendered to a hidden file, so that the chart is never served while
+        # being written
+        temporary = path.with_name(f'.{uuid.uuid4().hex}.png')
+        try:
+            render(str(temporary))
+            os.replace(temporary, path)
+        finally:
+            temporary.unlink(missing_ok=True)
+        data = path.read_bytes()
+        self._memory.put(name, data)
+        with self._lock:
+            files = self._index()
+            self._size += len(data) - files.pop(name, 0)
+            files[name] = len(data)
+            self._evict()
+        return path
+
+    def read(self, name: str) -> Optional[bytes]:
+        """The content of the chart, None if it is not in the cache."""
+        data = self._memory.get(name)
+        if data is not None:
+            return data
+        with self._lock:
+            if name not in self._index():
+                return None
+        try:
+            data = (self.directory / name).read_bytes()
+        except FileNotFoundError:
+            return None
+        self._memory.put(name, data)
+        return data
+
+    def url(self, path: str) -> str:
+        return f'{self.url_prefix}/{pathlib.Path(path).name}'
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self._size -= size
+            self._memory.invalidate(name)
+            (self.directory / name).unlink(missing_ok=True)
+            logger.debug('Deleted the chart %s', name)
+
+
+chart_cache = ChartCache(STATIC_DIR / 'charts', '/static/charts',
+                         CHART_CACHE_MAX_BYTES, CHART_CACHE_MEMORY_BYTES)
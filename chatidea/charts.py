@@ -0,0 +1,42 @@
+"""
+Chart rendering. The functions of this module only depend on matplotlib, so
+that they can be cheaply executed in worker processes. matplotlib is only
+imported when the first chart is rendered, as importing it takes most of the
+startup time of the bot.
+"""
+import functools
+
+
+PIE_COLORS = ['tomato', 'mediumseagreen', 'pink', 'darkturquoise', 'gold',
+              'dimgrey']
+
+
+@functools.lru_cache(maxsize=None)
+def get_pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def render_pie_chart(labels: list[str], sizes: list[float],
+                     percentages: list[float], legend_title: str,
+                     path: str) -> str:
+    plt = get_pyplot()
+    figure = plt.figure()
+    try:
+        patches, texts = plt.pie(sizes, colors=PIE_COLORS, autopct=None,
+                                 startangle=90, labeldistance=None,
+                                 textprops={'fontsize': 14},
+                                 wedgeprops={'linewidth': 0.5,
+                                             'edgecolor': 'black'})
+        plt.legend(patches,
+                   ['%s, %1.1f %%' % (l, p)
+                    for l, p in zip(labels, percentages)],
+                   title=legend_title, title_fontsize='large',
+                   loc='lower center', bbox_to_anchor=(0.5, 1))
+        plt.axis('equal')
+        plt.savefig(path, bbox_inches="tight")
+    finally:
+        plt.close(figure)
+    return path
@@ -1,9 +1,13 @@
+import functools
+import itertools
 import logging
-
-from nltk import edit_distance
+import random
+from typing import Iterable, Optional, TypeVar
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
 
 def get_dict(*variables):
     return {var_name(s=s): s for s in variables}
@@ -22,22 +26,89 @@ KEY_BY_VALUE = 'by_value'
 KEY_REAL_VALUE_LENGTH = 'real_value_length'
 
 
+def bounded_edit_distance(a: str, b: str, bound: int) -> int:
+    """
+    Levenshtein distance between ``a`` and ``b``, computed only as long as it
+    can be lower than ``bound``: any distance that is not is returned as
+    ``bound``.
+    """
+    if abs(len(a) - len(b)) >= bound:
+        return bound
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if min(current) >= bound:
+            return bound
+        previous = current
+    return min(previous[-1], bound)
+
+
+class SimilarityIndex:
+    """
+    The candidates of a similarity search, with their lengths precomputed so
+    that the candidates that cannot be close enough are skipped without
+    computing their distance.
+    """
+
+    def __init__(self, candidates: Iterable[str]):
+        self.candidates = tuple(candidates)
+        self.lengths = tuple(len(c) for c in self.candidates)
+        self.exact = frozenset(self.candidates)
+
+    def closest(self, keyword: str,
+                threshold: int) -> tuple[Optional[str], int]:
+        """
+        Returns the first candidate with the lowest distance from
+        ``keyword``, if lower than ``threshold``, and its distance.
+        """
+        winner = None
+        sim = min(threshold, 100)
+        length = len(keyword)
+        for candidate, candidate_length in zip(self.candidates, self.lengths):
+            if abs(candidate_length - length) >= sim:
+                continue
+            cur = bounded_edit_distance(candidate, keyword, sim)
+            if cur < sim:
+                sim = cur
+                winner = candidate
+        return winner, (sim if winner else 100)
+
+
+@functools.lru_cache(maxsize=256)
+def get_similarity_index(candidates: tuple[str, ...]) -> SimilarityIndex:
+    return SimilarityIndex(candidates)
+
+
 def extract_similar_value(keyword, keyword_list, threshold=5):
     winner = None
     if keyword:
-        if keyword in keyword_list:
+        index = get_similarity_index(tuple(keyword_list))
+        if keyword in index.exact:
             winner = keyword
         else:
             logger.info('I will compute some similarity distance '
                         'for the received element "{}"...'.format(keyword))
-            sim = 100  # very high number
-            for el_name in keyword_list:
-                received = keyword
-                cur = edit_distance(el_name, received)
-                if cur < sim and cur < threshold:
-                    sim = cur
-                    winner = el_name
+            winner, sim = index.closest(keyword, threshold)
             logger.info(
                 '...I decided on: {}, with similarity distance: {}'.format(
                     winner, sim))
     return winner
+
+
+def reservoir_sample(items: Iterable[T], k: int,
+                     rng: Optional[random.Random] = None) -> list[T]:
+    """
+    ``k`` items chosen uniformly at random (all of them if fewer), reading
+    the items only once.
+    """
+    rng = rng or random.Random()
+    items = iter(items)
+    sample = list(itertools.islice(items, k))
+    for i, item in enumerate(items, start=k):
+        j = rng.randrange(i + 1)
+        if j < k:
+            sample[j] = item
+    return sample
@@ -16,4 +16,5 @@
 from .concept import DatabaseConcepts
 from .schema import DatabaseSchema
 from .view import DatabaseView
-from .extras import ExtraConfiguration
\ No newline at end of file
+from .extras import ExtraConfiguration
+from .index import ConceptIndex
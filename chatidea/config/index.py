@@ -0,0 +1,96 @@
+#  Copyright (C) 2023 andrea
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation, either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Optional
+
+from .concept import DatabaseConcepts, Concept, Attribute, Category
+
+
+class ConceptIndex:
+    """
+    Lookup tables compiled once from the concepts, so that resolving an
+    element, an alias, a table, an attribute or a category is a dictionary
+    access instead of a scan of the whole list.
+
+    When a key matches more than one entry, the first one in the concepts
+    list wins, as it did with the scans. The index must not be modified after
+    it has been built.
+    """
+
+    def __init__(self, concepts: DatabaseConcepts, similars: list = ()):
+        self.concepts: tuple[Concept, ...] = tuple(concepts)
+        self.elements: dict[str, Concept] = {}
+        self.aliases: dict[str, str] = {}
+        self.tables: dict[str, str] = {}
+        self.attributes: dict[tuple[str, str], Attribute] = {}
+        self.attributes_by_type: dict[tuple[str, str], Attribute] = {}
+        self.keyword_attributes: dict[str, tuple[Attribute, ...]] = {}
+        self.categories: dict[tuple[str, str], Category] = {}
+        self.similars: dict[str, list[str]] = {}
+
+        for e in self.concepts:
+            name = e.element_name
+            self.elements.setdefault(name, e)
+            for alias in [name] + (e.aliases or []):
+                self.aliases.setdefault(alias, name)
+            self.tables.setdefault(e.table_name, name)
+            self.keyword_attributes.setdefault(
+                name, tuple(a for a in e.attributes if a.keyword))
+            for a in e.attributes:
+                if a.keyword:
+                    self.attributes.setdefault((name, a.keyword), a)
+                else:
+                    self.attributes_by_type.setdefault((name, a.type), a)
+            for c in e.category:
+                self.categories.setdefault((name, c.column), c)
+                self.categories.setdefault((name, c.alias), c)
+
+        self.primary_element_names = tuple(e.element_name
+                                           for e in self.concepts
+                                           if e.type == 'primary')
+        self.primary_element_names_and_aliases = tuple(
+            n for e in self.concepts if e.type == 'primary'
+            for n in [e.element_name] + (e.aliases or []))
+
+        for e in similars:
+            for s in e.get('similars', []):
+                for word in s:
+                    # the last group containing the word wins
+                    self.similars[word] = s
+
+    def element(self, element_name: str) -> Optional[Concept]:
+        return self.elements.get(element_name)
+
+    def element_name_from_alias(self, alias: str) -> Optional[str]:
+        return self.aliases.get(alias)
+
+    def element_name_from_table(self, table_name: str) -> Optional[str]:
+        return self.tables.get(table_name)
+
+    def attribute(self, element_name: str, keyword: str) -> Optional[Attribute]:
+        return self.attributes.get((element_name, keyword))
+
+    def attribute_without_keyword(self, element_name: str,
+                                  attribute_type: Optional[str] = None
+                                  ) -> Optional[Attribute]:
+        if attribute_type is not None:
+            return self.attributes_by_type.get((element_name, attribute_type))
+        e = self.elements.get(element_name)
+        return next((a for a in e.attributes if not a.keyword),
+                    None) if e else None
+
+    def category(self, element_name: str,
+                 column_or_alias: str) -> Optional[Category]:
+        return self.categories.get((element_name, column_or_alias))
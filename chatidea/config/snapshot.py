@@ -0,0 +1,180 @@
+#  Copyright (C) 2023 andrea
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation, either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+The database configuration files, validated once and saved as a pickle
+snapshot that is loaded instead of parsing them again at every start.
+
+The snapshot is keyed by a hash of the configuration files and of the models
+validating them, so it is compiled again as soon as any of them changes. It
+can also be compiled ahead of time with ``python -m chatidea.config.snapshot``.
+"""
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import pickle
+import sys
+import time
+import uuid
+from typing import Any, Optional, Union
+
+import pydantic
+import yaml
+from pydantic import parse_obj_as
+
+from .concept import DatabaseConcepts
+from .index import ConceptIndex
+from .schema import DatabaseSchema
+from .view import DatabaseView
+
+logger = logging.getLogger(__name__)
+
+# To be increased when the content of the snapshot changes
+SNAPSHOT_VERSION = 1
+
+# The modules whose changes make the snapshots stale
+_MODEL_SOURCES = [pathlib.Path(__file__).with_name(name) for name in
+                  ('concept.py', 'schema.py', 'view.py', 'index.py',
+                   'snapshot.py')]
+
+
+@dataclasses.dataclass(frozen=True)
+class ConfigSnapshot:
+    key: str
+    concept: DatabaseConcepts
+    concept_s: Union[dict[str, Any], list[dict[str, Any]]]
+    schema: DatabaseSchema
+    view: DatabaseView
+    # the lookup tables of the concepts, so that they are not built again
+    concept_index: ConceptIndex
+
+
+def read_config(path: pathlib.Path) -> Union[dict[str, Any],
+                                             list[dict[str, Any]]]:
+    with path.open("r") as f:
+        return json.load(f) if path.suffix == ".json" else yaml.safe_load(f)
+
+
+def snapshot_key(paths: dict[str, pathlib.Path]) -> str:
+    """
+    The hash of the configuration files (by type), of the models and of the
+    versions of the snapshot, Python and pydantic.
+    """
+    digest = hashlib.sha256(f'{SNAPSHOT_VERSION} {sys.version_info[:2]} '
+                            f'{pydantic.VERSION}'.encode())
+    for config_type, path in sorted(paths.items()):
+        digest.update(f'\0{config_type}\0'.encode())
+        digest.update(path.read_bytes())
+    for path in _MODEL_SOURCES:
+        digest.update(b'\0')
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def compile_snapshot(paths: dict[str, pathlib.Path],
+                     key: Optional[str] = None) -> ConfigSnapshot:
+    """
+    Validates the configuration files of the ``concept``, ``concept_s``,
+    ``schema`` and ``view`` types.
+    """
+    concept = parse_obj_as(DatabaseConcepts, read_config(paths['concept']))
+    concept_s = read_config(paths['concept_s'])
+    return ConfigSnapshot(
+        key=key or snapshot_key(paths),
+        concept=concept,
+        concept_s=concept_s,
+        schema=parse_obj_as(DatabaseSchema, read_config(paths['schema'])),
+        view=parse_obj_as(DatabaseView, read_config(paths['view'])),
+        concept_index=ConceptIndex(concept, concept_s))
+
+
+def save_snapshot(snapshot: ConfigSnapshot, path: pathlib.Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # written aside and then renamed, so that no process reads half of it
+    temporary = path.with_name(f'.{path.name}.{uuid.uuid4().hex}')
+    try:
+        with temporary.open('wb') as f:
+            # the key first, so that a stale snapshot is not loaded at all
+            pickle.dump(snapshot.key, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    finally:
+        temporary.unlink(missing_ok=True)
+
+
+def load_snapshot(path: pathlib.Path, key: str) -> Optional[ConfigSnapshot]:
+    """The snapshot saved in the file, None if missing or stale."""
+    try:
+        with path.open('rb') as f:
+            if pickle.load(f) != key:
+                return None
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning('Cannot read the configuration snapshot %s', path,
+                       exc_info=True)
+        return None
+
+
+def get_snapshot(paths: dict[str, pathlib.Path],
+                 path: Optional[pathlib.Path]) -> ConfigSnapshot:
+    """
+    The snapshot of the configuration files, loaded from ``path`` if up to
+    date, otherwise compiled and saved there. Without a path, it is compiled
+    at every call.
+    """
+    started = time.monotonic()
+    key = snapshot_key(paths)
+    snapshot = load_snapshot(path, key) if path else None
+    if snapshot is not None:
+        logger.info('Loaded the configuration snapshot %s in %.3f seconds',
+                    path, time.monotonic() - started)
+        return snapshot
+
+    snapshot = compile_snapshot(paths, key)
+    logger.info('Compiled the configuration files in %.3f seconds',
+                time.monotonic() - started)
+    if path:
+        try:
+            save_snapshot(snapshot, path)
+        except OSError:
+            logger.warning('Cannot save the configuration snapshot %s', path,
+                           exc_info=True)
+    return snapshot
+
+
+def main():
+    from chatidea import settings
+
+    logging.basicConfig(level=logging.INFO)
+    path = settings.get_config_snapshot_path()
+    if not path:
+        sys.exit('CONFIG_SNAPSHOT_PATH is empty: snapshots are disabled')
+    paths = settings.get_db_config_paths()
+    snapshot = compile_snapshot(paths)
+    save_snapshot(snapshot, path)
+    print(f'Saved {path} ({snapshot.key[:12]}) '
+          f'from {", ".join(str(p) for p in paths.values())}')
+
+
+if __name__ == '__main__':
+    # through the imported module, so that the pickled classes are not the
+    # ones of __main__
+    from chatidea.config import snapshot as _snapshot
+    _snapshot.main()
@@ -0,0 +1,162 @@
+"""
+The hot reload of the database configuration. The configuration files are
+watched, and when they change they are validated again in the background and
+swapped in as a new generation, without restarting and so without dropping
+the conversations. Only the caches depending on what changed are dropped.
+"""
+import dataclasses
+import logging
+import pathlib
+import threading
+from typing import Any, Callable, Optional
+
+from chatidea import settings, warmup
+from chatidea.config.snapshot import ConfigSnapshot, get_snapshot, \
+    snapshot_key
+from chatidea.database import broker, resolver
+from chatidea.settings import CONFIG_RELOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class ConfigChanges:
+    tables: frozenset[str]  # the tables whose schema changed
+    # the elements whose concept changed, or whose table did
+    elements: frozenset[str]
+    view: bool
+    # the tables of the changed elements, before and after the change
+    element_tables: frozenset[str] = frozenset()
+
+
+def diff(old: ConfigSnapshot, new: ConfigSnapshot) -> ConfigChanges:
+    tables = frozenset(t for t in set(old.schema) | set(new.schema)
+                       if old.schema.get(t) != new.schema.get(t))
+    old_concepts = {c.element_name: c for c in old.concept}
+    new_concepts = {c.element_name: c for c in new.concept}
+    elements = frozenset(
+        name for name in old_concepts.keys() | new_concepts.keys()
+        if old_concepts.get(name) != new_concepts.get(name)
+        or any(c.table_name in tables
+               for c in (old_concepts.get(name), new_concepts.get(name)) if c))
+    element_tables = frozenset(
+        c.table_name for name in elements
+        for c in (old_concepts.get(name), new_concepts.get(name)) if c)
+    return ConfigChanges(tables, elements, old.view != new.view,
+                         element_tables)
+
+
+def invalidate(changes: ConfigChanges):
+    """
+    Drops the cached artifacts computed from what changed. The join plans
+    and the SQL templates are keyed by the generation of the configuration,
+    so those of the previous one are only dropped to free the memory.
+    """
+    broker.get_join_plan.cache_clear()
+    broker.sql_templates.clear()
+    for table_name in changes.tables | changes.element_tables:
+        broker.invalidate_table(table_name)
+    for element_name in changes.elements:
+        resolver.example_reservoir.invalidate(element_name)
+        resolver.category_stats.invalidate(element_name)
+
+
+_reload_lock = threading.Lock()
+
+
+def reload() -> Optional[ConfigChanges]:
+    """
+    Validates again the configuration files and, if they changed, swaps them
+    in and computes again the artifacts of the changed elements. Returns what
+    changed, None if nothing did. If the files are not valid, the error is
+    raised and the current configuration is kept.
+    """
+    with _reload_lock:
+        current = settings.get_config_snapshot()
+        paths = settings.get_db_config_paths()
+        if snapshot_key(paths) == current.key:
+            return None
+        # built before the swap, so that no request waits for it
+        snapshot = get_snapshot(paths, settings.get_config_snapshot_path())
+        changes = diff(current, snapshot)
+        settings.set_config_snapshot(snapshot)
+        invalidate(changes)
+    logger.info('Reloaded the configuration: %d table(s) and %d element(s) '
+                'changed%s', len(changes.tables), len(changes.elements),
+                ', and the view' if changes.view else '')
+    if changes.elements or changes.tables:
+        # the artifacts that were not dropped are still cached, so only the
+        # dropped ones are computed again
+        warmup.run()
+    return changes
+
+
+class ConfigWatcher:
+    """
+    Calls ``on_change`` when any of the files listed by ``paths`` is changed
+    (in modification time or size), checking them every ``interval`` seconds
+    in a background thread.
+    """
+
+    def __init__(self, paths: Callable[[], list[pathlib.Path]],
+                 on_change: Callable[[], Any], interval: float):
+        self.paths = paths
+        self.on_change = on_change
+        self.interval = interval
+        self._stamp: Optional[tuple] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def stamp(self) -> tuple:
+        stamps = []
+        for path in self.paths():
+            try:
+                stat = path.stat()
+                stamps.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamps.append((path, None, None))
+        return tuple(stamps)
+
+    def check(self) -> bool:
+        """Calls ``on_change`` if the files changed since the last check."""
+        stamp = self.stamp()
+        changed = self._stamp is not None and stamp != self._stamp
+        # not checked again until the next change, even if on_change fails
+        self._stamp = stamp
+        if changed:
+            self.on_change()
+        return changed
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stamp = self.stamp()
+        self._thread = threading.Thread(target=self._watch,
+                                        name='chatidea-config-watcher',
+                                        daemon=True)
+        self._thread.start()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Cannot reload the configuration, keeping '
+                                 'the current one')
+
+    def close(self):
+        self._stop.set()
+
+
+watcher: Optional[ConfigWatcher] = None
+
+
+def start():
+    """Reloads the configuration when its files change."""
+    global watcher
+    if watcher is not None or not CONFIG_RELOAD_SECONDS:
+        return
+    watcher = ConfigWatcher(
+        lambda: list(settings.get_db_config_paths().values()), reload,
+        CONFIG_RELOAD_SECONDS)
+    watcher.start()
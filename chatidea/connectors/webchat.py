@@ -1,4 +1,6 @@
-import base64
+import dataclasses
+import functools
+import hmac
 import logging
 import uuid
 from pathlib import Path
@@ -6,7 +8,11 @@ from pathlib import Path
 import socketio
 from aiohttp import web
 
-from chatidea import extractor, caller
+from chatidea import extractor, caller, executors, session_log, warmup, \
+    config_reload
+from chatidea.database import broker, resolver
+from chatidea.chart_cache import chart_cache
+from chatidea.settings import ADMIN_TOKEN, STATIC_DIR, WEBCHAT_PUBLIC_URL
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +21,23 @@ sio = socketio.AsyncServer(
 # sio = socketio.AsyncServer()
 app = web.Application()
 sio.attach(app)
+sessions = executors.SessionSerializer()
+
+
+def require_admin(handler):
+    """
+    Only lets the requests with the ``ADMIN_TOKEN`` bearer token through to
+    the handler, and none of them if the token is not set.
+    """
+    @functools.wraps(handler)
+    async def wrapper(request):
+        authorization = request.headers.get('Authorization', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(
+                authorization.encode(), f'Bearer {ADMIN_TOKEN}'.encode()):
+            raise web.HTTPForbidden()
+        return await handler(request)
+
+    return wrapper
 
 
 async def index(request):
@@ -23,6 +46,98 @@ async def index(request):
         return web.Response(text=f.read(), content_type='text/html')
 
 
+@require_admin
+async def invalidate_result_cache(request):
+    """
+    Drop the cached query results of the table given in the ``table`` query
+    parameter (or all of them). Only enabled when ``ADMIN_TOKEN`` is set.
+    """
+    table = request.query.get('table')
+    dropped = broker.invalidate_table(table) if table \
+        else broker.clear_result_cache()
+    return web.json_response({'dropped': dropped})
+
+
+@require_admin
+async def session_stats(request):
+    """Number and size of the conversation contexts kept in memory."""
+    return web.json_response(dataclasses.asdict(caller.sessions.stats))
+
+
+@require_admin
+async def database_stats(request):
+    """
+    Connections of the pool, and hit rate of their prepared statements when
+    ``DB_PREPARED_STATEMENTS`` is enabled.
+    """
+    pool = broker.get_pool()
+    statements = pool.statement_stats
+    return web.json_response({
+        'connections': pool.size,
+        'idle': pool.idle,
+        'statements': {**dataclasses.asdict(statements),
+                       'hit_rate': statements.hit_rate}})
+
+
+@require_admin
+async def category_stats(request):
+    """When the distributions of the categories have been computed."""
+    return web.json_response(resolver.category_stats.info())
+
+
+@require_admin
+async def refresh_category_stats(request):
+    """
+    Compute again the distributions of the categories of the ``element``
+    query parameter (or all of them), even if they are not stale.
+    """
+    element = request.query.get('element')
+    refreshed = await executors.run_blocking(
+        resolver.category_stats.refresh_stale, 0, element)
+    return web.json_response({'refreshed': refreshed})
+
+
+@require_admin
+async def warmup_report(request):
+    """How many artifacts the warm-up computed, and how long they took."""
+    report = warmup.last_report
+    return web.json_response(report and dataclasses.asdict(report))
+
+
+@require_admin
+async def reload_config(request):
+    """
+    Reload the database configuration files, if they changed, without
+    waiting for them to be checked.
+    """
+    try:
+        changes = await executors.run_blocking(config_reload.reload)
+    except Exception as e:
+        logger.exception('Cannot reload the configuration')
+        raise web.HTTPBadRequest(text=f'Invalid configuration: {e}')
+    if changes is None:
+        return web.json_response({'reloaded': False})
+    return web.json_response({'reloaded': True,
+                              'tables': sorted(changes.tables),
+                              'elements': sorted(changes.elements),
+                              'view': changes.view})
+
+
+@require_admin
+async def set_session_log_level(request):
+    """
+    Change the log verbosity of a session to the ``level`` query parameter,
+    or back to the default one if missing.
+    """
+    level = request.query.get('level')
+    if level and not isinstance(logging.getLevelName(level.upper()), int):
+        raise web.HTTPBadRequest(text=f'Unknown level: {level}')
+    session_log.set_level(request.match_info['session'],
+                          level.upper() if level else None)
+    return web.json_response({'level': logging.getLevelName(
+        session_log.get_level(request.match_info['session']))})
+
+
 # START SOCKET CONNECTION
 @sio.event
 def connect(sid, environ):
@@ -47,28 +162,47 @@ async def session_request(sid, data):
 # END SOCKET CONNECTION
 
 
+async def serve_chart(request):
+    """The charts, from the memory of the chart cache when possible."""
+    data = await executors.run_blocking(chart_cache.read,
+                                        request.match_info['name'])
+    if data is None:
+        raise web.HTTPNotFound()
+    # The name of a chart is the hash of its content, so it never changes
+    return web.Response(body=data, content_type='image/png', headers={
+        'Cache-Control': 'public, max-age=31536000, immutable'})
+
+
 @sio.on('user_uttered')  # ON USER MESSAGE
 async def handle_message(sid: str, message_dict: dict):
+    # The messages of a session are handled one at a time, so that replies
+    # never overtake each other, while the blocking work (database and
+    # plotting) runs in the worker pools instead of the event loop.
+    async with sessions.hold(sid):
+        await handle_session_message(sid, message_dict)
+
+
+async def handle_session_message(sid: str, message_dict: dict):
     all_quick_replies = []
     message = message_dict['message']
-    parsed_message = extractor.parse(message)
-    response = caller.run_action_from_parsed_message(parsed_message,
-                                                     "WEBCHAT_" + str(sid))
-    print(response.get_printable_string())
+    parsed_message = await extractor.parse_async(message)
+    response = await executors.run_blocking(
+        caller.run_action_from_parsed_message, parsed_message,
+        "WEBCHAT_" + str(sid))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s', response.get_printable_string())
     for x in response.get_telegram_or_webchat_format():
         text: str = x['message']
         if text.startswith('/'):
             command, params = text.split(' ')[0], text.split(' ')[1].split(';')
             if command == '/pie-chart':
-                with open(params[0], "rb") as img:
-                    encoded_string = base64.b64encode(img.read())
-                Path(params[0]).unlink(missing_ok=True)
                 send_message = {
                     "attachment": {
                         "type": "image",
                         "payload": {
                             "title": "Category table",
-                            "src": f"data:image/png;base64,{encoded_string.decode('utf-8')}"
+                            "src": WEBCHAT_PUBLIC_URL +
+                                   chart_cache.url(params[0])
                         }
                     }
                 }
@@ -82,9 +216,25 @@ async def handle_message(sid: str, message_dict: dict):
             await sio.emit('bot_uttered', send_message, room=sid)
 
 
-(Path(__file__).absolute().parent / '../static').mkdir(parents=True, exist_ok=True)
-app.router.add_static('/static', Path(__file__).absolute().parent / '../static')
+STATIC_DIR.mkdir(parents=True, exist_ok=True)
+app.router.add_get(chart_cache.url_prefix + '/{name}', serve_chart)
+app.router.add_static('/static', STATIC_DIR)
 app.router.add_get('/', index)
+app.router.add_post('/admin/cache/invalidate', invalidate_result_cache)
+app.router.add_get('/admin/sessions', session_stats)
+app.router.add_get('/admin/database', database_stats)
+app.router.add_get('/admin/categories', category_stats)
+app.router.add_post('/admin/categories/refresh', refresh_category_stats)
+app.router.add_get('/admin/warmup', warmup_report)
+app.router.add_post('/admin/config/reload', reload_config)
+app.router.add_post('/admin/sessions/{session}/log', set_session_log_level)
+
+
+async def close_nlu_client(_app):
+    await extractor.client.close()
+
+
+app.on_cleanup.append(close_nlu_client)
 
 
 def start():
@@ -0,0 +1,386 @@
+import abc
+import contextlib
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, ContextManager, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+Element = dict[str, Any]
+
+
+def dump_element(element: Element) -> bytes:
+    return zlib.compress(pickle.dumps(element, pickle.HIGHEST_PROTOCOL))
+
+
+def load_element(data: bytes) -> Element:
+    return pickle.loads(zlib.decompress(data))
+
+
+class ContextStore(abc.ABC):
+    """
+    Where the elements of the conversation contexts are kept between
+    messages, serialized with :func:`dump_element`. Every change increases
+    the version of the context, so that a process can tell whether another
+    one changed it in the meantime.
+    """
+    persistent = True
+
+    @abc.abstractmethod
+    def load(self, chat_id: Hashable) -> Optional[tuple[int, list[bytes]]]:
+        """The version and the elements of the context, None if unknown."""
+
+    @abc.abstractmethod
+    def version(self, chat_id: Hashable) -> int:
+        """The version of the context, 0 if unknown."""
+
+    @abc.abstractmethod
+    def append(self, chat_id: Hashable, data: bytes) -> int:
+        """Appends the element to the context, returning the new version."""
+
+    @abc.abstractmethod
+    def replace_last(self, chat_id: Hashable, data: bytes) -> int:
+        """Overwrites the last element of the context."""
+
+    @abc.abstractmethod
+    def keep_first(self, chat_id: Hashable, length: int) -> int:
+        """Deletes all the elements after the first ``length`` ones."""
+
+    @abc.abstractmethod
+    def keep_last(self, chat_id: Hashable, length: int) -> int:
+        """Deletes all the elements before the last ``length`` ones."""
+
+    def purge(self, max_age: float) -> int:
+        """Deletes the contexts not changed in the last ``max_age`` seconds."""
+        return 0
+
+    def close(self):
+        pass
+
+
+class MemoryContextStore(ContextStore):
+    """
+    Keeps nothing outside of the contexts themselves: a context lives as long
+    as its process keeps it.
+    """
+    persistent = False
+
+    def load(self, chat_id):
+        return None
+
+    def version(self, chat_id):
+        return 0
+
+    def append(self, chat_id, data):
+        return 0
+
+    def replace_last(self, chat_id, data):
+        return 0
+
+    def keep_first(self, chat_id, length):
+        return 0
+
+    def keep_last(self, chat_id, length):
+        return 0
+
+
+class SQLiteContextStore(ContextStore):
+    """
+    Keeps the contexts in a SQLite database, one compressed pickle per
+    element, so that they survive restarts and can be shared by the
+    processes of the same host.
+
+    The file must be on a local disk: the WAL ``journal_mode`` needs shared
+    memory, and the locks of SQLite are not reliable on network filesystems.
+    The replicas on different hosts share the contexts through a
+    :class:`DatabaseContextStore` instead. On the same host, the writers
+    are serialized by the lock of the file (waiting up to ``timeout``
+    seconds for it), and the version of a context tells the other processes
+    that their copy is stale.
+    """
+
+    JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL')
+
+    def __init__(self, path: str, timeout: float = 10,
+                 journal_mode: str = 'WAL'):
+        if journal_mode.upper() not in self.JOURNAL_MODES:
+            raise ValueError(f'Unrecognized journal mode: {journal_mode}')
+        self.path = path
+        self.timeout = timeout
+        self.journal_mode = journal_mode.upper()
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        with self._connect() as connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS context_version (
+                    chat_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS context_element (
+                    chat_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (chat_id, seq)
+                );
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute(f'PRAGMA journal_mode={self.journal_mode}')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _bump(self, connection: sqlite3.Connection, chat_id: str) -> int:
+        connection.execute(
+            'INSERT INTO context_version VALUES (?, 1, ?) '
+            'ON CONFLICT (chat_id) DO UPDATE '
+            'SET version = version + 1, updated_at = excluded.updated_at',
+            (chat_id, time.time()))
+        return connection.execute(
+            'SELECT version FROM context_version WHERE chat_id = ?',
+            (chat_id,)).fetchone()[0]
+
+    def load(self, chat_id):
+        chat_id = str(chat_id)
+        connection = self._connect()
+        with connection:
+            row = connection.execute(
+                'SELECT version FROM context_version WHERE chat_id = ?',
+                (chat_id,)).fetchone()
+            if row is None:
+                return None
+            data = connection.execute(
+                'SELECT data FROM context_element WHERE chat_id = ? '
+                'ORDER BY seq', (chat_id,)).fetchall()
+        return row[0], [d for d, in data]
+
+    def version(self, chat_id):
+        row = self._connect().execute(
+            'SELECT version FROM context_version WHERE chat_id = ?',
+            (str(chat_id),)).fetchone()
+        return row[0] if row else 0
+
+    def append(self, chat_id, data):
+        chat_id = str(chat_id)
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO context_element '
+                'SELECT ?, COALESCE(MAX(seq), 0) + 1, ? FROM context_element '
+                'WHERE chat_id = ?', (chat_id, data, chat_id))
+            return self._bump(connection, chat_id)
+
+    def replace_last(self, chat_id, data):
+        chat_id = str(chat_id)
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE context_element SET data = ? WHERE chat_id = ? AND '
+                'seq = (SELECT MAX(seq) FROM context_element WHERE chat_id = ?)',
+                (data, chat_id, chat_id))
+            return self._bump(connection, chat_id)
+
+    def keep_first(self, chat_id, length):
+        chat_id = str(chat_id)
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM context_element WHERE chat_id = ? AND seq NOT IN '
+                '(SELECT seq FROM context_element WHERE chat_id = ? '
+                'ORDER BY seq LIMIT ?)', (chat_id, chat_id, length))
+            return self._bump(connection, chat_id)
+
+    def keep_last(self, chat_id, length):
+        chat_id = str(chat_id)
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM context_element WHERE chat_id = ? AND seq NOT IN '
+                '(SELECT seq FROM context_element WHERE chat_id = ? '
+                'ORDER BY seq DESC LIMIT ?)', (chat_id, chat_id, length))
+            return self._bump(connection, chat_id)
+
+    def purge(self, max_age):
+        deadline = time.time() - max_age
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM context_element WHERE chat_id IN '
+                '(SELECT chat_id FROM context_version WHERE updated_at < ?)',
+                (deadline,))
+            purged = connection.execute(
+                'DELETE FROM context_version WHERE updated_at < ?',
+                (deadline,)).rowcount
+        if purged:
+            logger.info('Purged %d stored context(s)', purged)
+        return purged
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class DatabaseContextStore(ContextStore):
+    """
+    Keeps the contexts in two tables of a database reached through
+    ``connect`` (e.g. the connection pool of the broker), so that they are
+    shared by the replicas on any host: a chat can move to another replica
+    and find its context there.
+
+    Only portable SQL is used, and the tables are created if missing with
+    ``binary_type`` as the type of the serialized elements. The statements
+    of a change are not run in a transaction: the messages of a chat are
+    handled one at a time by the replica holding it, and the version of the
+    context tells the other replicas that their copy is stale.
+    """
+
+    VERSION_TABLE = 'chatidea_context_version'
+    ELEMENT_TABLE = 'chatidea_context_element'
+
+    def __init__(self,
+                 connect: Callable[[], ContextManager[Any]],
+                 binary_type: str = 'BLOB'):
+        self.connect = connect
+        with self._cursor() as cursor:
+            for table, columns in (
+                    (self.VERSION_TABLE,
+                     'chat_id VARCHAR(255) NOT NULL PRIMARY KEY, '
+                     'version INTEGER NOT NULL, '
+                     'updated_at DOUBLE PRECISION NOT NULL'),
+                    (self.ELEMENT_TABLE,
+                     'chat_id VARCHAR(255) NOT NULL, '
+                     'seq INTEGER NOT NULL, '
+                     f'data {binary_type} NOT NULL, '
+                     'PRIMARY KEY (chat_id, seq)')):
+                try:
+                    cursor.execute(f'SELECT 1 FROM {table} WHERE 1 = 0')
+                    cursor.fetchall()
+                except Exception:
+                    logger.info('Creating the table %s', table)
+                    cursor.execute(f'CREATE TABLE {table} ({columns})')
+
+    @contextlib.contextmanager
+    def _cursor(self):
+        with self.connect() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            finally:
+                cursor.close()
+
+    def _bump(self, cursor, chat_id: str) -> int:
+        cursor.execute(
+            f'UPDATE {self.VERSION_TABLE} SET version = version + 1, '
+            f'updated_at = ? WHERE chat_id = ?', (time.time(), chat_id))
+        if cursor.rowcount == 0:
+            cursor.execute(f'INSERT INTO {self.VERSION_TABLE} VALUES (?, 1, ?)',
+                           (chat_id, time.time()))
+        return self._version(cursor, chat_id)
+
+    def _version(self, cursor, chat_id: str) -> int:
+        cursor.execute(f'SELECT version FROM {self.VERSION_TABLE} '
+                       f'WHERE chat_id = ?', (chat_id,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _sequence(self, cursor, chat_id: str) -> list[int]:
+        cursor.execute(f'SELECT seq FROM {self.ELEMENT_TABLE} '
+                       f'WHERE chat_id = ? ORDER BY seq', (chat_id,))
+        return [seq for seq, in cursor.fetchall()]
+
+    def load(self, chat_id):
+        chat_id = str(chat_id)
+        with self._cursor() as cursor:
+            version = self._version(cursor, chat_id)
+            if not version:
+                return None
+            cursor.execute(f'SELECT data FROM {self.ELEMENT_TABLE} '
+                           f'WHERE chat_id = ? ORDER BY seq', (chat_id,))
+            return version, [bytes(d) for d, in cursor.fetchall()]
+
+    def version(self, chat_id):
+        with self._cursor() as cursor:
+            return self._version(cursor, str(chat_id))
+
+    def append(self, chat_id, data):
+        chat_id = str(chat_id)
+        with self._cursor() as cursor:
+            sequence = self._sequence(cursor, chat_id)
+            cursor.execute(f'INSERT INTO {self.ELEMENT_TABLE} VALUES (?, ?, ?)',
+                           (chat_id, sequence[-1] + 1 if sequence else 1,
+                            data))
+            return self._bump(cursor, chat_id)
+
+    def replace_last(self, chat_id, data):
+        chat_id = str(chat_id)
+        with self._cursor() as cursor:
+            sequence = self._sequence(cursor, chat_id)
+            if sequence:
+                cursor.execute(f'UPDATE {self.ELEMENT_TABLE} SET data = ? '
+                               f'WHERE chat_id = ? AND seq = ?',
+                               (data, chat_id, sequence[-1]))
+            return self._bump(cursor, chat_id)
+
+    def keep_first(self, chat_id, length):
+        chat_id = str(chat_id)
+        with self._cursor() as cursor:
+            sequence = self._sequence(cursor, chat_id)
+            if len(sequence) > length:
+                cursor.execute(f'DELETE FROM {self.ELEMENT_TABLE} '
+                               f'WHERE chat_id = ? AND seq >= ?',
+                               (chat_id, sequence[length]))
+            return self._bump(cursor, chat_id)
+
+    def keep_last(self, chat_id, length):
+        chat_id = str(chat_id)
+        with self._cursor() as cursor:
+            sequence = self._sequence(cursor, chat_id)
+            if len(sequence) > length:
+                cursor.execute(f'DELETE FROM {self.ELEMENT_TABLE} '
+                               f'WHERE chat_id = ? AND seq < ?',
+                               (chat_id, sequence[len(sequence) - length]))
+            return self._bump(cursor, chat_id)
+
+    def purge(self, max_age):
+        deadline = time.time() - max_age
+        with self._cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.ELEMENT_TABLE} WHERE chat_id IN '
+                f'(SELECT chat_id FROM {self.VERSION_TABLE} '
+                f'WHERE updated_at < ?)', (deadline,))
+            cursor.execute(f'DELETE FROM {self.VERSION_TABLE} '
+                           f'WHERE updated_at < ?', (deadline,))
+            purged = cursor.rowcount
+        if purged:
+            logger.info('Purged %d stored context(s)', purged)
+        return purged
+
+
+# The type of the serialized elements in the tables of DatabaseContextStore
+BINARY_TYPES = {'mssql': 'VARBINARY(MAX)', 'mysql': 'LONGBLOB',
+                'postgresql': 'BYTEA', 'redshift': 'VARBYTE'}
+
+
+def create_store(kind: str, path: str,
+                 journal_mode: str = 'WAL') -> ContextStore:
+    if kind == 'memory':
+        return MemoryContextStore()
+    if kind == 'sqlite':
+        return SQLiteContextStore(path, journal_mode=journal_mode)
+    if kind == 'database':
+        # imported here, so that the other stores do not need pyodbc
+        from chatidea.database import broker
+        return DatabaseContextStore(
+            broker.connect, BINARY_TYPES.get(broker.DIALECT.value, 'BLOB'))
+    raise ValueError(f'Unrecognized context store: {kind}')
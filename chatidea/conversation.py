@@ -1,11 +1,15 @@
 import copy
 import logging
 import pprint
-from logging import handlers
+from typing import Optional
 
+from chatidea import session_log
+from chatidea.context_store import ContextStore, MemoryContextStore, \
+    dump_element, load_element
+from chatidea.database import resolver
 from chatidea.patterns import btn
-from chatidea.settings import LOG_DIR_PATH_AND_SEP, ELEMENT_VISU_LIMIT, \
-    CONTEXT_VISU_LIMIT, CONTEXT_MAX_LENGTH
+from chatidea.settings import ELEMENT_VISU_LIMIT, CONTEXT_VISU_LIMIT, \
+    CONTEXT_MAX_LENGTH, CONTEXT_RESIDENT_RESULTS
 
 """
 {'action_name': '...found with attribute(s) "located in Spain".',
@@ -119,26 +123,73 @@ from chatidea.settings import LOG_DIR_PATH_AND_SEP, ELEMENT_VISU_LIMIT, \
 """
 
 
+def copy_element(element):
+    """
+    Deep copies the element, except for its rows: result sets are never
+    modified, so they can be shared.
+    """
+    return {k: v if k == 'value' else copy.deepcopy(v)
+            for k, v in element.items()}
+
+
 class Context:
 
-    def __init__(self, chat_id):
-        self.context_list = []
+    def __init__(self, chat_id, store: Optional[ContextStore] = None):
+        self.store = store or MemoryContextStore()
+        self._context_list = None  # loaded from the store when needed
+        self._version = 0
+        self._last_saved = None
         self.reset_show_context_list = True
         self.context_list_indices = {'up': 0, 'down': 0}
         self.reset_show_last_element = True
-        self.logger = logging.Logger(__name__, logging.INFO)
-        self.log_path = LOG_DIR_PATH_AND_SEP / f'context_{chat_id}.log'
+        self.logger = session_log.get_logger(chat_id)
         self.session = chat_id
-        log_handler = handlers.RotatingFileHandler(self.log_path, maxBytes=500)
-        log_handler.setLevel(logging.INFO)
-        log_handler.setFormatter(logging.Formatter('--> %(asctime)s:\n'
-                                                   '%(message)s\n'))
-        self.logger.addHandler(log_handler)
-        self.log(' ********* NEW INITIALIZATION OF LOG FILE ********* ')
+        self.log(' ********* NEW INITIALIZATION OF THE CONTEXT ********* ')
+
+    @property
+    def context_list(self) -> list:
+        if self._context_list is None:
+            stored = self.store.load(self.session)
+            if stored:
+                self._version, elements = stored
+                self._context_list = [load_element(e) for e in elements]
+                self._last_saved = elements[-1] if elements else None
+                self.log('Context loaded from the store, version {}'.format(
+                    self._version))
+            else:
+                self._context_list = []
+        return self._context_list
+
+    def sync(self):
+        """
+        Forgets the elements if the stored context has been changed by another
+        process, so that they are loaded again.
+        """
+        if self.store.persistent and self._context_list is not None \
+                and self.store.version(self.session) != self._version:
+            self._context_list = None
+
+    def flush(self):
+        """
+        Stores the last element again if it has been changed in place (e.g.,
+        by showing more of its values).
+        """
+        if not self.store.persistent or not self._context_list:
+            return
+        data = dump_element(self._context_list[-1])
+        if data != self._last_saved:
+            self._version = self.store.replace_last(self.session, data)
+            self._last_saved = data
+
+    def close(self):
+        """Forgets the log verbosity of the context."""
+        session_log.set_level(self.session, None)
 
     def reset_context_list(self):
         self.logger.info('The context has been reset')
         del self.context_list[:]
+        self._version = self.store.keep_first(self.session, 0)
+        self._last_saved = None
 
     def get_element_by_name(self, element_name):
         """
@@ -188,19 +239,36 @@ class Context:
                 self.context_list.pop(0)
         """
 
-        self.context_list.append(copy.deepcopy(element))  # deep copying here
+        self.context_list.append(copy_element(element))
         self.show_last_element_from_start()
+        if self.store.persistent:
+            self._last_saved = dump_element(self.context_list[-1])
+            self._version = self.store.append(self.session, self._last_saved)
         self.log('Element {} has been added to the context'.format(
             element['element_name']))
         # max length context
         if len(self.context_list) > CONTEXT_MAX_LENGTH:
             del self.context_list[
                 : len(self.context_list) - CONTEXT_MAX_LENGTH]
+            self._version = self.store.keep_last(self.session,
+                                                 CONTEXT_MAX_LENGTH)
             self.log('Context length is exceeding maximum of {},'
                      ' I remove old concepts.'.format(CONTEXT_MAX_LENGTH))
+        self.release_old_results()
 
         # self.log_context()
 
+    def release_old_results(self):
+        """
+        Releases the rows of the results older than the last
+        CONTEXT_RESIDENT_RESULTS elements: they are fetched again from their
+        query if the user goes back to them.
+        """
+        for element in self.context_list[:-max(CONTEXT_RESIDENT_RESULTS, 1)]:
+            if element.get('value') is not None and element.get('columns') \
+                    and element.get('real_value_length', 0) > 1:
+                element['value'] = None
+
     def show_last_element_from_start(self):
         element = self.context_list[-1]
         if element['real_value_length'] > 1:
@@ -218,9 +286,15 @@ class Context:
 
     def go_back_to_position(self, position):
         del self.context_list[position:]
+        self._version = self.store.keep_first(self.session, position)
+        self._last_saved = None
         self.log('Going back to position {} in the context'.format(position))
         # self.log_context()
-        self.show_last_element_from_start()
+        if self.context_list:
+            self.show_last_element_from_start()
+            element = self.context_list[-1]
+            if element.get('show'):
+                resolver.reload_rows(element, element['show']['to'])
 
     def get_context_list(self):
         return self.context_list
@@ -240,21 +314,23 @@ class Context:
         """
         Logs the context_list in a human-readable way
         """
+        if not session_log.is_enabled(self.session):
+            return
         string_log = 'The context of the conversation at this moment' \
                      ' is {} element(s) long:\n'.format(len(self.context_list))
         for i, el in enumerate(self.context_list):
             string_log += 'POSITION {}:'.format(i + 1)
             if i == len(self.context_list) - 1:
-                el_mod = copy.deepcopy(el)
-                if el_mod.get('real_value_length', 0) > 1:
-                    el_mod['show']['to'] = el_mod['real_value_length']
+                el_mod = dict(el)
+                if el_mod.get('real_value_length', 0) > 1 and el['value']:
+                    # paginated results only hold the rows loaded so far
+                    el_mod['show'] = {'from': 0, 'to': len(el['value'])}
                     el_mod['value'] = [b['title'] for b in
                                        btn.get_buttons_select_element(el_mod)]
             else:
-                el_mod = {'action_name': copy.deepcopy(el['action_name']),
-                          'element_name': copy.deepcopy(el['element_name']),
-                          'real_value_length': copy.deepcopy(
-                              el['real_value_length'])}
+                el_mod = {'action_name': el['action_name'],
+                          'element_name': el['element_name'],
+                          'real_value_length': el['real_value_length']}
             string_log += '\n' \
                           '{}\n'.format(pprint.pformat(el_mod))
 
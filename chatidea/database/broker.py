@@ -1,14 +1,20 @@
+import atexit
+import collections
 import contextlib
 import copy
 import dataclasses
+import functools
 import itertools
 import logging
-import re
+import math
+import random
 import string
+import sys
+import threading
 import typing
 import warnings
 from collections import namedtuple
-from typing import Optional, Any
+from typing import Optional, Any, Callable, Iterator, Union
 
 import pyodbc
 from pypika import Table, Criterion, Field, functions, Order
@@ -16,29 +22,73 @@ from pypika.dialects import Dialects
 from pypika.queries import QueryBuilder
 from pypika.terms import Parameter
 
-from chatidea.config import DatabaseSchema, DatabaseView
+from chatidea import commons
 from chatidea.config.concept import Category
 from chatidea.config.schema import TableSchema, Reference
 from chatidea.config.view import TableView, ColumnView
+from chatidea.cache import LRUCache
 from chatidea.database import resolver
-from chatidea.settings import DB_NAME, DB_SCHEMA, DB_VIEW, \
+from chatidea.database.pool import ConnectionPool, StatementCache
+from chatidea.database.results import ResultSet
+from chatidea import settings
+from chatidea.settings import DB_NAME, \
     DB_USER, DB_PASSWORD, DB_HOST, QUERY_LIMIT, DB_DRIVER, DB_CHARSET, DB_TRUST_CERTIFICATE, \
-    DialectQuery as Query
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_IDLE_SECONDS, \
+    DB_POOL_TIMEOUT_SECONDS, DB_POOL_PING_SECONDS, RESULT_CACHE_SIZE, \
+    RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_BYTES, QUERY_PAGINATED, \
+    ELEMENT_VISU_LIMIT, SQL_TEMPLATE_CACHE_SIZE, DB_PREPARED_STATEMENTS, \
+    DB_STATEMENT_CACHE_SIZE, FETCH_BATCH_SIZE, EXAMPLES_SAMPLE_SIZE, \
+    SAMPLE_MAX_SCAN_ROWS, DialectQuery as Query
 
 logger = logging.getLogger(__name__)
 
-db_schema: Optional[DatabaseSchema] = DB_SCHEMA
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
 
-db_view: Optional[DatabaseView] = DB_VIEW
+# Errors after which a connection cannot be trusted anymore, and the query is
+# retried once on a fresh connection
+RECONNECT_ERRORS = (pyodbc.OperationalError, pyodbc.InterfaceError)
+
+
+def _rows_size(rows: tuple[tuple, ...]) -> int:
+    return sys.getsizeof(rows) + sum(
+        sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r) for r in rows)
+
+
+# Rows returned by the queries, keyed on the SQL string and its parameters
+# and tagged with the tables they were read from
+result_cache: LRUCache[tuple[str, tuple], tuple[tuple, ...]] = LRUCache(
+    max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL_SECONDS,
+    max_size=RESULT_CACHE_MAX_BYTES, sizeof=_rows_size)
+
+DIALECT: Dialects = Query.from_('t').dialect
+QUOTE_CHAR: str = Query.from_('t').QUOTE_CHAR
+
+# The SQL of a query, and of the count of its rows when paginated, along with
+# the tables it reads from and, if it can be sorted again by the database, its
+# SortableSql
+SqlTemplate = namedtuple('SqlTemplate', ['sql', 'count_sql', 'tables',
+                                         'sortable'], defaults=(None,))
+
+# The SQL of a query without its ORDER BY, the SQL of its selected columns (in
+# the order of the result columns) and of the columns making the order unique
+SortableSql = namedtuple('SortableSql', ['sql', 'columns', 'key'])
+
+# The values of the attributes are always parameters, so the SQL of a query
+# only depends on its shape: the tables, the columns and the operators
+sql_templates: LRUCache[tuple, SqlTemplate] = LRUCache(
+    max_entries=SQL_TEMPLATE_CACHE_SIZE)
 
 
 def test_connection():
     logger.info('Database: %s', DB_NAME)
     logger.info('Testing connection with the database...')
-    connection = _connect()
-    logger.info('Connection succeeded! Closing connection...')
-    connection.close()
-    logger.info('Connection closed.')
+    pool = get_pool()
+    pool.open()
+    with pool.connection():
+        pass
+    logger.info('Connection succeeded! %d connection(s) kept in the pool.',
+                pool.size)
 
 
 class ConnectionStringBuilder:
@@ -91,7 +141,9 @@ def _connect() -> pyodbc.Connection:
                       .authentication("SqlPassword")
                       .certificate(DB_TRUST_CERTIFICATE))
     logger.debug("Connection string: %s", connection_str)
-    connection = pyodbc.connect(connection_str.get_str())
+    # Connections are long-lived and only used to read: with autocommit
+    # disabled they would keep a transaction (and its snapshot) open forever
+    connection = pyodbc.connect(connection_str.get_str(), autocommit=True)
 
     # MySQL-specific options for encoding issues
     connection.setdecoding(pyodbc.SQL_CHAR, encoding='utf-8')
@@ -100,58 +152,217 @@ def _connect() -> pyodbc.Connection:
     return connection
 
 
+# The cheapest query checking that a connection works, when not "SELECT 1"
+HEALTH_CHECK_QUERIES = {Dialects.ORACLE: 'SELECT 1 FROM DUAL'}
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(_connect,
+                                   min_size=DB_POOL_MIN_SIZE,
+                                   max_size=DB_POOL_MAX_SIZE,
+                                   idle_timeout=DB_POOL_IDLE_SECONDS,
+                                   checkout_timeout=DB_POOL_TIMEOUT_SECONDS,
+                                   ping_interval=DB_POOL_PING_SECONDS,
+                                   health_check_query=HEALTH_CHECK_QUERIES.get(
+                                       DIALECT, 'SELECT 1'),
+                                   statement_cache_size=DB_STATEMENT_CACHE_SIZE
+                                   if DB_PREPARED_STATEMENTS else 0)
+            atexit.register(_pool.close)
+        return _pool
+
+
 @contextlib.contextmanager
 def connect() -> pyodbc.Connection:
-    connection = _connect()
-    yield connection
-    connection.close()
+    with get_pool().connection() as connection:
+        yield connection
+
+
+def _fetch_all(connection: pyodbc.Connection, sql: str,
+               parameters: Optional[tuple] = None,
+               statements: Optional[StatementCache] = None) -> list[pyodbc.Row]:
+    if statements is not None:
+        # The cursor stays open, keeping the statement prepared
+        cursor = statements.cursor(sql)
+        try:
+            if parameters:
+                cursor.execute(sql, parameters)
+            else:
+                cursor.execute(sql)
+            return cursor.fetchall()
+        except pyodbc.Error:
+            # the state of the cursor is unknown, so it is not reused
+            statements.discard(sql)
+            raise
+    cursor = connection.cursor()
+    try:
+        if parameters:
+            cursor.execute(sql, parameters)
+        else:
+            cursor.execute(sql)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _execute_pooled(sql: str,
+                    parameters: Optional[tuple] = None) -> list[pyodbc.Row]:
+    pool = get_pool()
+    try:
+        with pool.connection() as connection:
+            return _fetch_all(connection, sql, parameters,
+                              pool.statements(connection))
+    except RECONNECT_ERRORS:
+        logger.warning('The database connection failed, retrying the query '
+                       'on a new connection...', exc_info=True)
+    with pool.connection() as connection:
+        return _fetch_all(connection, sql, parameters,
+                          pool.statements(connection))
+
+
+def _ensure_order(query: QueryBuilder) -> QueryBuilder:
+    if query.dialect == Dialects.MSSQL and not query._orderbys:
+        # When on MS SQL Server, the limit operation requires an ORDER BY
+        # statement, so if the query does not have one, we add it using all
+        # the columns specified in the SELECT clause (in the same order).
+        query = query.orderby(*query._selects)
+    return query
+
+
+def _apply_limit(query: QueryBuilder, limit: bool = True) -> QueryBuilder:
+    # HERE FORCING THE LIMIT OF THE QUERY, unless it counts the rows
+    if limit and QUERY_LIMIT \
+            and not any(s.is_aggregate for s in query._selects):
+        query = _ensure_order(query).limit(QUERY_LIMIT)
+    return query
+
+
+def paginate_sql(sql: str, offset: int, limit: int) -> str:
+    """
+    Adds the clauses selecting ``limit`` rows starting from ``offset`` to an
+    ordered SELECT statement.
+    """
+    if DIALECT in (Dialects.MSSQL, Dialects.ORACLE):
+        return f'{sql} OFFSET {offset} ROWS FETCH NEXT {limit} ROWS ONLY'
+    return f'{sql} LIMIT {limit} OFFSET {offset}'
 
 
 def execute_query(query: QueryBuilder,
                   parameters: Optional[tuple] = None,
                   connection: pyodbc.Connection = None,
                   limit: bool = True) -> list[pyodbc.Row]:
-    # HERE FORCING THE LIMIT OF THE QUERY
-    if limit and QUERY_LIMIT and not "COUNT" in str(query):
-        if query.dialect == Dialects.MSSQL and 'ORDER BY' not in str(query):
-            # When on MS SQL Server, the limit operation requires an ORDER BY
-            # statement, so if the SQL does not contain one, we add it using
-            # all the columns specified in the SELECT clause (in the same
-            # order).
-            cols = re.findall(r"SELECT (?:DISTINCT)? (.*?) FROM", str(query))
-            cols = [x.split(query.QUOTE_CHAR)[1] for x in cols]
-            query = query.orderby(*cols)
-        query = query.limit(100)
-    logger.info('Executing query: %s', query)
+    sql = _apply_limit(query, limit).get_sql()
+    logger.info('Executing query: %s', sql)
     if parameters:
         logger.info('Parameters tuple: {}'.format(parameters))
-    if not connection:
-        connection = _connect()
-    cursor = connection.cursor()
+    if connection:
+        return _fetch_all(connection, sql, parameters)
+    return _execute_pooled(sql, parameters)
+
+
+def iter_query(query: Union[QueryBuilder, str],
+               parameters: Optional[tuple] = None,
+               limit: bool = True,
+               batch_size: int = FETCH_BATCH_SIZE) -> Iterator[tuple]:
+    """
+    Like :func:`execute_query`, but streams the rows fetching ``batch_size``
+    of them at a time. The connection is held until the iterator is
+    exhausted or closed, so the callers stopping early should close it.
+    """
+    sql = query if isinstance(query, str) \
+        else _apply_limit(query, limit).get_sql()
+    logger.info('Streaming query: %s', sql)
     if parameters:
-        cursor.execute(query.get_sql(), parameters)
+        logger.info('Parameters tuple: {}'.format(parameters))
+    pool = get_pool()
+    connection = pool.acquire()
+    discard = False
+    try:
+        cursor = connection.cursor()
+        try:
+            if parameters:
+                cursor.execute(sql, parameters)
+            else:
+                cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield tuple(row)
+        finally:
+            cursor.close()
+    except Exception:
+        discard = True
+        raise
+    finally:
+        # closing the iterator early does not break the connection
+        pool.release(connection, discard)
+
+
+def execute_cached_query(query: QueryBuilder,
+                         parameters: Optional[tuple],
+                         tables: typing.Iterable[str],
+                         limit: bool = True) -> tuple[tuple, ...]:
+    """
+    Like :func:`execute_query`, but the rows are served from (and stored
+    in) the result cache. ``tables`` are the tables the query reads from, and
+    are used to invalidate the cached rows.
+    """
+    return execute_cached_sql(_apply_limit(query, limit).get_sql(),
+                              parameters, tables)
+
+
+def execute_cached_sql(sql: str, parameters: Optional[tuple],
+                       tables: typing.Iterable[str],
+                       fetch: Optional[Callable[[], typing.Iterable]] = None
+                       ) -> tuple[tuple, ...]:
+    """
+    Executes the SQL, or calls ``fetch`` to get its rows if given, unless
+    they are in the result cache.
+    """
+    key = (sql, tuple(parameters or ()))
+    rows = result_cache.get(key)
+    if rows is not None:
+        logger.info('Cached result for query: %s', sql)
+        return rows
+    if fetch is None:
+        logger.info('Executing query: %s', sql)
+        if parameters:
+            logger.info('Parameters tuple: {}'.format(parameters))
+        rows = _execute_pooled(sql, parameters)
     else:
-        cursor.execute(query.get_sql())
-    rows = cursor.fetchall()
-    cursor.close()
-    # FIXME: the function opens and closes a connection for each query. This
-    #  feels like it's expensive: maybe we should have only a single connection
-    #  that is opened when the server starts and is closed when the server is
-    #  stopped
-    if not connection:
-        connection.close()
+        rows = fetch()
+    rows = tuple(tuple(r) for r in rows)
+    result_cache.put(key, rows, tags=set(tables))
     return rows
 
 
+def invalidate_table(table_name: str) -> int:
+    """
+    Drops the cached results read from the given table, e.g. after the table
+    has been updated. Returns the number of dropped results.
+    """
+    dropped = result_cache.invalidate_tag(table_name)
+    logger.info('Dropped %d cached result(s) of table %s', dropped, table_name)
+    return dropped
+
+
+def clear_result_cache() -> int:
+    dropped = len(result_cache)
+    result_cache.clear()
+    logger.info('Dropped all the %d cached result(s)', dropped)
+    return dropped
+
+
 def load_db_schema():
-    # TODO: Remove global variable
-    global db_schema
-    db_schema = DB_SCHEMA
+    settings.get_config_snapshot()
 
 
 def load_db_view():
-    global db_view
-    db_view = DB_VIEW
+    settings.get_config_snapshot()
 
 
 def execute_query_select(query: str, params=None, limit=True) -> list[
@@ -159,21 +370,11 @@ def execute_query_select(query: str, params=None, limit=True) -> list[
     warnings.warn('This function is deprecated', DeprecationWarning)
     # HERE FORCING THE LIMIT OF THE QUERY
     if limit and QUERY_LIMIT:
-        query += ' LIMIT 100'
+        query += f' LIMIT {QUERY_LIMIT}'
     logger.info('Executing query: %s', query)
     if params:
         logger.info('Tuple: {}'.format(params))
-
-    connection = _connect()
-    cursor = connection.cursor()
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
-    rows = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return rows
+    return _execute_pooled(query, params)
 
 
 class QueryDict(typing.TypedDict):
@@ -183,45 +384,287 @@ class QueryDict(typing.TypedDict):
 
 class Result(typing.TypedDict):
     query: QueryDict
-    value: list[dict[str, Any]]
+    # None when the rows have been released, see reload_rows
+    value: Optional[ResultSet]
     real_value_length: int
     attributes: list[dict]
-
-
-def get_dictionary_result(q_string, q_tuple, rows, cols, attributes) -> Result:
+    # In paginated results "value" only holds the rows loaded so far
+    paginated: bool
+    columns: list[str]
+    tables: list[str]
+    # The column the rows have been sorted by, if any
+    sorted_by: str
+    # To sort the rows of a paginated result in the database
+    sortable: Optional[SortableSql]
+
+
+def get_dictionary_result(q_string, q_tuple, rows, cols, attributes,
+                          tables: typing.Iterable[str] = ()) -> Result:
     query = {'q_string': q_string, 'q_tuple': q_tuple}
 
-    value = list(map(lambda r: dict(zip(cols, r)), rows))
+    value = ResultSet(cols, rows)
 
     return {'query': query,
             'value': value,
             'real_value_length': len(value),
-            'attributes': attributes}
+            'attributes': attributes,
+            'columns': list(cols),
+            'tables': sorted(tables)}
+
+
+def get_paginated_result(template: SqlTemplate, q_tuple: tuple, cols,
+                         attributes) -> Result:
+    """
+    Counts the rows of the query and only fetches its first page. The other
+    pages are loaded by :func:`fetch_rows` when they are needed.
+    """
+    total = execute_cached_sql(template.count_sql, q_tuple,
+                               template.tables)[0][0]
+    rows = execute_cached_sql(paginate_sql(template.sql, 0, ELEMENT_VISU_LIMIT),
+                              q_tuple, template.tables) if total else ()
+    result = get_dictionary_result(template.sql, q_tuple, rows, cols,
+                                   attributes, template.tables)
+    result.update({'real_value_length': total, 'paginated': True,
+                   'sortable': template.sortable})
+    return result
+
+
+def fetch_rows(result: Result, stop: int):
+    """
+    Makes sure that the first ``stop`` rows of a paginated result are loaded,
+    fetching the missing pages with a single query.
+    """
+    stop = min(stop, result['real_value_length'])
+    loaded = len(result['value'])
+    if not result.get('paginated') or loaded >= stop:
+        return
+    limit = math.ceil((stop - loaded) / ELEMENT_VISU_LIMIT) * ELEMENT_VISU_LIMIT
+    rows = execute_cached_sql(
+        paginate_sql(result['query']['q_string'], loaded, limit),
+        result['query']['q_tuple'], result['tables'])
+    # a new result set, the old one may be shared with other elements
+    result['value'] = result['value'].extend(rows)
+
+
+def reload_rows(result: Result, stop: int):
+    """
+    Fetches again the rows of a result whose rows have been released, up to
+    position ``stop`` if paginated.
+    """
+    if result.get('value') is not None:
+        return
+    if result.get('paginated'):
+        result['value'] = ResultSet(result['columns'])
+        fetch_rows(result, stop)
+    else:
+        result['value'] = ResultSet(result['columns'], execute_cached_sql(
+            result['query']['q_string'], result['query']['q_tuple'],
+            result['tables']))
+    # the SQL of the results sorted by the database is already sorted
+    if result.get('sorted_by') and not _sorted_in_database(result):
+        sort_rows(result, result['sorted_by'])
+
+
+def _sorted_in_database(result: Result) -> bool:
+    return bool(result.get('paginated') and result.get('sortable'))
+
+
+def sort_rows(result: Result, column: str):
+    """
+    Sorts the rows of the result by the column. A paginated result is sorted
+    by the database, and only the pages loaded so far are fetched again;
+    otherwise all the rows are sorted here, putting the None values last.
+    """
+    if not _sorted_in_database(result):
+        fetch_rows(result, result['real_value_length'])
+        result['value'] = result['value'].sorted_by(
+            column, key=lambda v: (v is None, v))
+        result['sorted_by'] = column
+        return
+    sortable: SortableSql = result['sortable']
+    first = sortable.columns[result['columns'].index(column)]
+    order = [first] + [k for k in sortable.key if k != first]
+    result['query'] = {'q_string': f'{sortable.sql} ORDER BY {", ".join(order)}',
+                       'q_tuple': result['query']['q_tuple']}
+    loaded = max(len(result['value'] or ()), ELEMENT_VISU_LIMIT)
+    result['value'] = ResultSet(result['columns'])
+    fetch_rows(result, loaded)
+    result['sorted_by'] = column
+
+
+def get_query_result(template: SqlTemplate, q_tuple: tuple, cols,
+                     attributes) -> Result:
+    if template.count_sql is not None:
+        return get_paginated_result(template, q_tuple, cols, attributes)
+    rows = execute_cached_sql(template.sql, q_tuple, template.tables)
+    return get_dictionary_result(template.sql, q_tuple, rows, cols,
+                                 attributes, template.tables)
+
+
+def _term_sql(term: Union[Field, str]) -> str:
+    if isinstance(term, str):
+        term = Field(term)
+    return term.get_sql(quote_char=QUOTE_CHAR, with_namespace=True)
+
+
+def compile_query(query: QueryBuilder, order_by: list,
+                  tables: typing.Iterable[str],
+                  columns: typing.Sequence[Field] = (),
+                  key: typing.Sequence[Field] = ()) -> SqlTemplate:
+    """
+    The SQL of the query sorted by ``order_by`` and then by ``key``, so that
+    the pages of the rows never overlap: paginated if ``QUERY_PAGINATED``,
+    otherwise limited to ``QUERY_LIMIT`` rows. The selected ``columns`` are
+    needed to sort the pages again by one of them in the database.
+    """
+    tables = tuple(sorted(tables))
+    order_by = list(order_by)
+    ordered = {_term_sql(x) for x in order_by}
+    order_by += [x for x in key if _term_sql(x) not in ordered]
+    if QUERY_PAGINATED:
+        count_query = Query.from_(query).select(functions.Count('*'))
+        sortable = SortableSql(query.get_sql(),
+                               tuple(map(_term_sql, columns)),
+                               tuple(map(_term_sql, key))) if columns else None
+        return SqlTemplate(_ensure_order(query.orderby(*order_by)).get_sql(),
+                           count_query.get_sql(), tables, sortable)
+    return SqlTemplate(_apply_limit(query.orderby(*order_by)).get_sql(),
+                       None, tables)
+
+
+def get_sql_template(shape: tuple,
+                     compile: Callable[[], SqlTemplate]) -> SqlTemplate:
+    """
+    The SQL of the queries with the given shape, compiled by ``compile`` the
+    first time, so that pypika is only used once per shape. Keyed by the
+    generation of the configuration, as the SQL depends on it.
+    """
+    generation = settings.get_config_snapshot().key
+    return sql_templates.get_or_compute((generation, DIALECT, *shape),
+                                        compile)
+
+
+def attribute_shape(attribute: dict) -> tuple:
+    """What the SQL depends on in a labeled attribute, i.e. all but its value."""
+    return (attribute['from_table'],
+            tuple(attribute['columns']),
+            attribute['operator'],
+            # the value of an "order by" is the column to sort by
+            attribute['value'] if attribute.get('order_by') else None,
+            tuple((rel['from_table_name'], rel['to_table_name'],
+                   tuple(rel['from_columns']), tuple(rel['to_columns']))
+                  for rel in attribute.get('by') or ()))
 
 
 def get_table_schema_from_name(table_name: str) -> Optional[TableSchema]:
-    return db_schema.get(table_name)  # may return None
+    # may return None
+    return settings.get_config_snapshot().schema.get(table_name)
 
 
 def get_table_view_from_name(table_name: str) -> Optional[TableView]:
-    return db_view.get(table_name)  # may return None
+    # may return None
+    return settings.get_config_snapshot().view.get(table_name)
 
 
 def get_references_from_name(table_name: str) -> list[Reference]:
-    return db_schema.get(table_name).references
+    return get_table_schema_from_name(table_name).references
+
 
+def _quote(name: str) -> str:
+    return f'{QUOTE_CHAR}{name}{QUOTE_CHAR}'
 
-def query_show_attributes_examples(table: str, columns: list[str]):
-    query = Query.from_(table).select(*columns).distinct().orderby(*columns)
-    rows = execute_query(query)
-    return [r[0] for r in rows]
+
+def _bounded_distinct_sql(table: str, columns: list[str], max_scan_rows: int,
+                          tablesample: bool = False) -> str:
+    """The distinct values of the columns in the first rows of the table."""
+    cols = ', '.join(map(_quote, columns))
+    n = int(max_scan_rows)
+    if DIALECT == Dialects.MSSQL:
+        # the sampled pages, instead of the first ones, are read
+        sample = f' TABLESAMPLE ({n} ROWS)' if tablesample else ''
+        scan = f'SELECT TOP ({n}) {cols} FROM {_quote(table)}{sample}'
+    elif DIALECT == Dialects.ORACLE:
+        scan = f'SELECT {cols} FROM {_quote(table)} FETCH FIRST {n} ROWS ONLY'
+    else:
+        scan = f'SELECT {cols} FROM {_quote(table)} LIMIT {n}'
+    return f'SELECT DISTINCT {cols} FROM ({scan}) scanned'
+
+
+def sample_distinct_sql(table: str, columns: list[str], k: int,
+                        seed: Optional[int], max_scan_rows: int
+                        ) -> Optional[str]:
+    """
+    The SQL choosing the random sample of :func:`sample_distinct` in the
+    database, None if the dialect cannot (deterministically, when seeded).
+    """
+    cols = ', '.join(map(_quote, columns))
+    k = int(k)
+    if DIALECT == Dialects.MYSQL:
+        scan = _bounded_distinct_sql(table, columns, max_scan_rows)
+        seed = '' if seed is None else int(seed)
+        return f'SELECT {cols} FROM ({scan}) d ORDER BY RAND({seed}) LIMIT {k}'
+    if seed is not None:
+        return None
+    if DIALECT == Dialects.MSSQL:
+        scan = _bounded_distinct_sql(table, columns, max_scan_rows,
+                                     tablesample=True)
+        return f'SELECT TOP ({k}) {cols} FROM ({scan}) d ORDER BY NEWID()'
+    if DIALECT in (Dialects.POSTGRESQL, Dialects.SQLLITE):
+        scan = _bounded_distinct_sql(table, columns, max_scan_rows)
+        return f'SELECT {cols} FROM ({scan}) d ORDER BY RANDOM() LIMIT {k}'
+    return None
+
+
+def count_distinct(table: str, columns: list[str],
+                   max_scan_rows: int) -> int:
+    """
+    The number of distinct values of the columns in the rows read by
+    :func:`sample_distinct`.
+    """
+    sql = _bounded_distinct_sql(table, columns, max_scan_rows)
+    return _execute_pooled(f'SELECT COUNT(*) FROM ({sql}) d')[0][0]
+
+
+def sample_distinct(table: str, columns: list[str], k: int,
+                    seed: Optional[int] = None,
+                    max_scan_rows: int = SAMPLE_MAX_SCAN_ROWS) -> list[tuple]:
+    """
+    Up to ``k`` random distinct combinations of the values of the columns,
+    reading at most ``max_scan_rows`` rows of the table. With a ``seed``,
+    the sample is the same as long as the table does not change.
+    """
+    sql = sample_distinct_sql(table, columns, k, seed, max_scan_rows)
+    if sql is not None:
+        rows = list(iter_query(sql))
+        # the pages sampled by MS SQL Server may have too few rows, unless
+        # the columns do not have more distinct values than that
+        if DIALECT != Dialects.MSSQL or len(rows) >= k or rows and \
+                len(rows) >= count_distinct(table, columns, max_scan_rows):
+            return rows
+    # Sampled while streaming the values, sorted so that the seed gives the
+    # same sample every time
+    sql = _bounded_distinct_sql(table, columns, max_scan_rows) + \
+        ' ORDER BY ' + ', '.join(map(_quote, columns))
+    with contextlib.closing(iter_query(sql)) as rows:
+        return commons.reservoir_sample(rows, k, random.Random(seed))
+
+
+def query_show_attributes_examples(
+        table: str, columns: list[str],
+        max_examples: int = EXAMPLES_SAMPLE_SIZE,
+        seed: Optional[int] = None) -> list:
+    """
+    Up to ``max_examples`` random distinct values of the first column,
+    skipping the empty ones.
+    """
+    return [r[0] for r in sample_distinct(table, columns, max_examples, seed)
+            if r[0]]
 
 
 def decipher_attributes(attributes: list[dict]) -> \
         list[tuple[Criterion, str]]:
-    flattened = [(Table(a["from_table"]).field(col), a['operator'],
-                  a.get('value')) for a in attributes for col in
-                 a["columns"]]
+    flattened = [(Table(a["from_table"]).field(col), a['operator'])
+                 for a in attributes for col in a["columns"]]
 
     def map_operators(field: Field, op: str) -> Criterion:
         if op == "LIKE":
@@ -229,9 +672,15 @@ def decipher_attributes(attributes: list[dict]) -> \
         elif op == "=":
             return field.eq(Parameter("?"))
 
-    return [(map_operators(field, op), (f"%{v}%" if op == "LIKE" else v))
-            for
-            field, op, v in flattened]
+    return [(map_operators(field, op), v) for (field, op), v in
+            zip(flattened, get_parameters(attributes))]
+
+
+def get_parameters(attributes: list[dict]) -> tuple:
+    """The values of the attributes, in the order of their "?"."""
+    return tuple(f"%{a.get('value')}%" if a['operator'] == "LIKE"
+                 else a.get('value')
+                 for a in attributes for _ in a["columns"])
 
 
 Columns = typing.TypedDict('Columns', {'column': str, 'table': str})
@@ -250,38 +699,37 @@ def get_columns(table_name: str) -> list[Columns]:
 
 
 def query_find(in_table_name, attributes):
-    columns = get_columns(in_table_name)
-
     attributes = [{'value': v, 'operator': o, **a.dict()} for v, o, a in attributes]
     attributes = label_attributes(attributes, in_table_name)
     for a in attributes:
         a.setdefault('operator', '=')
 
-    tables = get_sql_tables(attributes, in_table_name)
-    columns = get_sql_columns(columns)
-    order_by = get_order_by(attributes, in_table_name)
-    where_conditions = decipher_attributes(attributes)
-
-    query: QueryBuilder = (Query.from_(tables.base)
-                           .select(*columns)
-                           .orderby(*order_by)
-                           .where(Criterion.any([x[0]
-                                                 for x in where_conditions]))
-                           .distinct())
-    for x in tables.joins:
-        query = query.join(x.target).on(x.on)
-    tup = tuple(map(lambda x: x[1], where_conditions))
-    rows = execute_query(query, tup)
-
-    return get_dictionary_result(query.get_sql(), tup, rows,
-                                 get_table_schema_from_name(
-                                     in_table_name).column_list, attributes)
+    def compile() -> SqlTemplate:
+        tables = get_sql_tables(attributes, in_table_name)
+        columns = get_sql_columns(get_columns(in_table_name))
+        order_by = get_order_by(attributes, in_table_name)
+        where_conditions = decipher_attributes(attributes)
+
+        query: QueryBuilder = (Query.from_(tables.base)
+                               .select(*columns)
+                               .where(Criterion.any([x[0]
+                                                     for x in where_conditions]))
+                               .distinct())
+        for x in tables.joins:
+            query = query.join(x.target).on(x.on)
+        return compile_query(query, order_by, tables.names(), columns,
+                             get_key_order(in_table_name, columns))
+
+    template = get_sql_template(
+        ('find', in_table_name, *map(attribute_shape, attributes)), compile)
+    return get_query_result(template, get_parameters(attributes),
+                            get_table_schema_from_name(
+                                in_table_name).column_list, attributes)
 
 
 def query_join(element, relation):
     # the table is the last one of the last "by" in the relation
     to_table_name = relation.by[-1]['to_table_name']
-    to_columns = get_columns(to_table_name)
     relation = relation.dict()
 
     # the table is the one of the first "by" in the relation
@@ -299,24 +747,28 @@ def query_join(element, relation):
 
     relation = label_attributes([relation], from_table_name)[0]
 
-    tables = get_sql_tables([relation], to_table_name)
-    columns = get_sql_columns(to_columns)
-    where_conditions = [x[0] for x in decipher_attributes([relation])]
+    def compile() -> SqlTemplate:
+        tables = get_sql_tables([relation], to_table_name)
+        columns = get_sql_columns(get_columns(to_table_name))
+        where_conditions = [x[0] for x in decipher_attributes([relation])]
 
-    query: QueryBuilder = (Query.from_(tables.base)
-                           .select(*columns)
-                           .where(Criterion.all(where_conditions))
-                           .orderby(*get_order_by([], to_table_name))
-                           .distinct())
+        query: QueryBuilder = (Query.from_(tables.base)
+                               .select(*columns)
+                               .where(Criterion.all(where_conditions))
+                               .distinct())
 
-    for x in tables.joins:
-        query = query.join(x.target).on(x.on)
+        for x in tables.joins:
+            query = query.join(x.target).on(x.on)
+        return compile_query(query, get_order_by([], to_table_name),
+                             tables.names(), columns,
+                             get_key_order(to_table_name, columns))
 
+    template = get_sql_template(
+        ('join', to_table_name, attribute_shape(relation)), compile)
     tup = tuple(relation['join_values'])
-    rows = execute_query(query, tup)
-    return get_dictionary_result(query.get_sql(), tup, rows,
-                                 get_table_schema_from_name(to_table_name).column_list, [
-                                     relation])  # mocking the relation as attribute
+    return get_query_result(template, tup,
+                            get_table_schema_from_name(to_table_name).column_list,
+                            [relation])  # mocking the relation as attribute
 
 
 def get_reverse_relation(relation: dict):
@@ -333,39 +785,116 @@ def get_reverse_relation(relation: dict):
     return final
 
 
-def query_category(in_table_name, category) -> Result:
+def rank_categories(rows: typing.Iterable[tuple], top: int) -> list[tuple]:
+    """
+    Like :func:`top_categories_sql`, but in Python: the
+    first ``top`` (category, count) rows, each with the total of all the
+    counts.
+    """
+    rows = iter(rows)
+    ranked = list(itertools.islice(rows, top))
+    total = sum(count for _, count in ranked) + \
+        sum(count for _, count in rows)
+    return [(value, count, total) for value, count in ranked]
+
+
+# The dialects in which the top categories are computed by the database
+TOP_CATEGORIES_DIALECTS = (Dialects.MSSQL, Dialects.POSTGRESQL,
+                           Dialects.SQLLITE, Dialects.MYSQL)
+
+
+def top_categories_sql(query: QueryBuilder, top: int) -> str:
+    """
+    Wraps the query of the categories, selecting ``cat_value`` and
+    ``cat_count``, so that it returns the ``top`` most common ones, each with
+    the total of all the counts, in a single round-trip.
+    """
+    sql = query.get_sql()
+    if DIALECT == Dialects.MYSQL:
+        # No window functions before MySQL 8
+        return (f'SELECT cat_value, cat_count, cat_total FROM ('
+                f'SELECT cat_value, cat_count FROM ({sql}) cats '
+                f'ORDER BY cat_count DESC LIMIT {int(top)}) top_cats '
+                f'CROSS JOIN (SELECT SUM(cat_count) AS cat_total '
+                f'FROM ({sql}) all_cats) totals '
+                f'ORDER BY cat_count DESC')
+    return (f'SELECT cat_value, cat_count, cat_total FROM ('
+            f'SELECT cat_value, cat_count, '
+            f'ROW_NUMBER() OVER (ORDER BY cat_count DESC) AS cat_rank, '
+            f'SUM(cat_count) OVER () AS cat_total '
+            f'FROM ({sql}) cats) ranked '
+            f'WHERE cat_rank <= {int(top)} ORDER BY cat_rank')
+
+
+def query_category(in_table_name, category,
+                   top: Optional[int] = None) -> Result:
+    """
+    The number of rows of each value of the category, the most common first.
+    With ``top``, only that many categories are returned, and the result
+    also has the ``total`` of the counts and the ``other`` rows, i.e. those
+    not in the returned categories.
+    """
     columns = ("category", "count")
-    ref: Optional[Reference] = None
-
-    for fk in get_references_from_name(in_table_name):
-        if fk.from_attribute == category.column:
-            ref = fk
-
-    from_table = Table(in_table_name)
-    from_field = from_table.field(category.column)
-    query: QueryBuilder = Query.from_(from_table)
-    if ref:
-        to_table = Table(ref.to_table)
-        query = (query
-                 .left_join(to_table)
-                 .on(from_field == to_table.field(ref.to_attribute))
-                 .select(to_table.field(ref.show_attribute), functions.Count('*'))
-                 .groupby(from_field, to_table.field(ref.show_attribute))
-                 .orderby(functions.Count('*'), order=Order.desc))
+    in_database = top is not None and DIALECT in TOP_CATEGORIES_DIALECTS
+
+    def compile() -> SqlTemplate:
+        ref: Optional[Reference] = None
+
+        for fk in get_references_from_name(in_table_name):
+            if fk.from_attribute == category.column:
+                ref = fk
+
+        from_table = Table(in_table_name)
+        from_field = from_table.field(category.column)
+        count = functions.Count('*').as_('cat_count')
+        query: QueryBuilder = Query.from_(from_table)
+        if ref:
+            to_table = Table(ref.to_table)
+            query = (query
+                     .left_join(to_table)
+                     .on(from_field == to_table.field(ref.to_attribute))
+                     .select(to_table.field(ref.show_attribute).as_('cat_value'),
+                             count)
+                     .groupby(from_field, to_table.field(ref.show_attribute)))
+        else:
+            query = (query
+                     .select(from_field.as_('cat_value'), count)
+                     .groupby(from_field))
+        tables = [in_table_name] + ([ref.to_table] if ref else [])
+        sql = top_categories_sql(query, top) if in_database \
+            else query.orderby(count, order=Order.desc).get_sql()
+        return SqlTemplate(sql, None, tuple(sorted(tables)))
+
+    template = get_sql_template(
+        ('category', in_table_name, category.column,
+         top if in_database else None),
+        compile)
+    tup = None
+    if top is None:
+        rows = execute_cached_sql(template.sql, tup, template.tables)
+        return get_dictionary_result(template.sql, tup, rows, columns,
+                                     category, template.tables)
+
+    if in_database:
+        rows = execute_cached_sql(template.sql, tup, template.tables)
     else:
-        query = (query
-                 .select(from_field, functions.Count('*'))
-                 .groupby(from_field)
-                 .orderby(functions.Count('*'), order=Order.desc))
+        def fetch():
+            with contextlib.closing(iter_query(template.sql)) as rows:
+                return rank_categories(rows, top)
 
-    tup = None
-    rows = execute_query(query, tup, limit=False)
-    return get_dictionary_result(str(query), tup, rows, columns, category)
+        rows = execute_cached_sql(f'{template.sql} -- top {top}', tup,
+                                  template.tables, fetch)
+    total = int(rows[0][2]) if rows else 0
+    rows = [(value, count) for value, count, _ in rows]
+    result = get_dictionary_result(template.sql, tup, rows, columns, category,
+                                   template.tables)
+    result.update({'total': total,
+                   'other': total - sum(count for _, count in rows)})
+    return result
 
 
 def query_category_value(element_name, table_name, category_column: Category,
                          category_value):
-    columns = get_columns(table_name)
     attribute = resolver.get_attribute_by_name(element_name,
                                                category_column.keyword).dict()
     attribute['value'] = category_value
@@ -374,30 +903,38 @@ def query_category_value(element_name, table_name, category_column: Category,
     attributes = [attribute]
     attributes = label_attributes(attributes, table_name)
 
-    element = resolver.extract_element(element_name)
-    order_by = [a for a in element.attributes if a.order_by]
-
-    tables = get_sql_tables([], table_name)
-    where_category = get_WHERE_CATEGORY_query_string(table_name,
-                                                     category_column.column)
-    query: QueryBuilder = (Query.from_(tables.base)
-                           .select(*get_sql_columns(columns))
-                           .where(
-        Criterion.all([where_category,
-                       # get_WHERE_REFERENCE_query_string(table_name)
-                       ]))
-                           .orderby(*[Table(a.by[0].to_table_name).field(a.columns[0]) if a.by else a.columns[0] for a in order_by]))
-
-    for table in tables.joins:
-        query = query.left_join(table.target).on(table.on)
+    def compile() -> SqlTemplate:
+        element = resolver.extract_element(element_name)
+        order_by = [a for a in element.attributes if a.order_by]
+
+        tables = get_sql_tables([], table_name)
+        columns = get_sql_columns(get_columns(table_name))
+        where_category = get_WHERE_CATEGORY_query_string(table_name,
+                                                         category_column.column)
+        query: QueryBuilder = (Query.from_(tables.base)
+                               .select(*columns)
+                               .where(
+            Criterion.all([where_category,
+                           # get_WHERE_REFERENCE_query_string(table_name)
+                           ])))
+
+        for table in tables.joins:
+            query = query.left_join(table.target).on(table.on)
+
+        order_by = [Table(a.by[0].to_table_name).field(a.columns[0]) if a.by else a.columns[0] for a in order_by]
+        return compile_query(query, order_by, tables.names(), columns,
+                             get_key_order(table_name, columns))
+
+    template = get_sql_template(
+        ('category_value', element_name, table_name, category_column.column),
+        compile)
     val = str(category_value)
     val = '%' + val + '%'
     tup = tuple([val])
 
-    rows = execute_query(query, tup)
-    return get_dictionary_result(query.get_sql(), tup, rows,
-                                 get_table_schema_from_name(
-                                     table_name).column_list, attributes)
+    return get_query_result(template, tup,
+                            get_table_schema_from_name(
+                                table_name).column_list, attributes)
 
 
 def simulate_view(table_name: str) -> list[ColumnView]:
@@ -446,26 +983,31 @@ class FromTables:
     base: Optional[Table]
     joins: list[Join]
 
-
-def topological_sort(joins: list[Join]) -> list[Join]:
-    nodes = set(x.who.get_table_name() for x in joins) | set(
-        x.target.get_table_name() for x in joins)
-    dependencies: dict[str, str] = {
-        node: [x.target.get_table_name() for x in
-               filter(lambda x: x.who.get_table_name() == node, joins)] for
-        node in nodes
-    }
-
-    joins_by_starting: dict[str, Join] = {
-        node: [x for x in
-               filter(lambda x: x.who.get_table_name() == node, joins)] for
-        node in nodes
-    }
+    def names(self) -> set[str]:
+        names = {x.target.get_table_name() for x in self.joins}
+        if self.base:
+            names.add(self.base.get_table_name())
+        return names
+
+
+def topological_sort(joins: list[Join],
+                     start: Callable[[Any], str] = lambda x: x.who.get_table_name(),
+                     end: Callable[[Any], str] = lambda x: x.target.get_table_name()
+                     ) -> list[Join]:
+    """
+    Orders the joins so that every table is joined after the tables it is
+    joined from, in time linear in the number of joins.
+    """
+    dependencies: dict[str, list[str]] = collections.defaultdict(list)
+    joins_by_starting: dict[str, list[Join]] = collections.defaultdict(list)
+    nodes: dict[str, None] = {}  # ordered, so that the result is stable
+    for x in joins:
+        dependencies[start(x)].append(end(x))
+        joins_by_starting[start(x)].append(x)
+        nodes[start(x)] = nodes[end(x)] = None
 
     permanent = set()
     temporary = set()
-    none = set(nodes)
-
     final = []
 
     def visit(node):
@@ -474,37 +1016,33 @@ def topological_sort(joins: list[Join]) -> list[Join]:
         if node in temporary:
             raise ValueError("The graph has at least one cycle!")
 
-        none.remove(node)
         temporary.add(node)
         for child in dependencies[node]:
             visit(child)
 
         temporary.remove(node)
         permanent.add(node)
+        final.append(node)
 
-        nonlocal final
-        final = [node] + final
-
-    while len(none | temporary) > 0:
-        node = list(none)[0]
+    for node in nodes:
         visit(node)
-    return list(itertools.chain(*[joins_by_starting[x] for x in final]))
+    return [x for node in reversed(final) for x in joins_by_starting[node]]
 
 
-def get_sql_tables(attributes,
-                   table_name: Optional[str] = None) -> FromTables:
-    JoinDef = namedtuple('JoinDef', ['start', 'end', 'from_attr', 'to_attr'])
-    tab_string_list = []
-    if table_name:
-        tab_string_list.append(table_name)
-    joins: set[JoinDef] = set()
-    for a in attributes:
-        for rel in (a.get('by', None) or []):
-            for i in range(len(rel['from_columns'])):
-                joins.add(JoinDef(rel['from_table_name'],
-                                  rel['to_table_name'],
-                                  rel["from_columns"][i],
-                                  rel["to_columns"][i]))
+JoinDef = namedtuple('JoinDef', ['start', 'end', 'from_attr', 'to_attr'])
+# A join between two tables, on the pairs of (from, to) columns
+JoinStep = namedtuple('JoinStep', ['start', 'end', 'on'])
+
+
+@functools.lru_cache(maxsize=1024)
+def get_join_plan(table_name: str, paths: frozenset[JoinDef],
+                  generation: str) -> tuple[JoinStep, ...]:
+    """
+    The ordered joins needed to reach, from the table, its references and the
+    tables of the relation paths. They only depend on the configuration, so
+    they are computed once per ``generation`` of it (its snapshot key).
+    """
+    joins = set(paths)
     for fk in get_references_from_name(table_name):
         joins.add(JoinDef(table_name,
                           fk.to_table,
@@ -512,17 +1050,35 @@ def get_sql_tables(attributes,
                           fk.to_attribute))
     joins: list[JoinDef] = sorted(joins, key=lambda x: (x.start, x.end))
 
+    steps = [JoinStep(start, end, tuple((x.from_attr, x.to_attr) for x in b))
+             for (start, end), b in
+             itertools.groupby(joins, lambda x: (x.start, x.end))]
+    return tuple(topological_sort(steps, start=lambda x: x.start,
+                                  end=lambda x: x.end))
+
+
+def get_sql_tables(attributes,
+                   table_name: Optional[str] = None) -> FromTables:
+    paths = frozenset(JoinDef(rel['from_table_name'],
+                              rel['to_table_name'],
+                              rel["from_columns"][i],
+                              rel["to_columns"][i])
+                      for a in attributes
+                      for rel in (a.get('by', None) or [])
+                      for i in range(len(rel['from_columns'])))
+
     final_joins: list[Join] = []
-    for _, b in itertools.groupby(joins, lambda x: (x.start, x.end)):
-        b = list(b)
-        final_joins.append(Join(Table(b[0].start),
-                                Table(b[0].end),
-                                Criterion.all([
-                                    Table(x.start).field(x.from_attr) == Table(
-                                        x.end).field(x.to_attr) for x in b
-                                ])))
+    # the generation is read before the configuration, so a plan is never
+    # cached under a generation newer than the configuration it is built from
+    generation = settings.get_config_snapshot().key
+    for step in get_join_plan(table_name, paths, generation):
+        start, end = Table(step.start), Table(step.end)
+        final_joins.append(Join(start, end, Criterion.all([
+            start.field(from_attr) == end.field(to_attr)
+            for from_attr, to_attr in step.on
+        ])))
 
-    return FromTables(Table(table_name), topological_sort(final_joins))
+    return FromTables(Table(table_name), final_joins)
 
 
 def get_WHERE_JOIN_query_string(attributes) -> list[Criterion]:
@@ -643,6 +1199,25 @@ def get_order_by(attributes: list[dict[str, str]], table: str) -> list[Field]:
     return [Table(a['from_table']).field(a['value']) for a in order_attrs]
 
 
+def get_key_order(table_name: str, columns: list[Field]) -> list[Field]:
+    """
+    The selected ``columns`` (those of :func:`get_columns`) identifying the
+    rows of the table: its primary key, or all of them if a column of the key
+    is shown through a reference.
+    """
+    schema = get_table_schema_from_name(table_name)
+    if not schema.primary_key_list:
+        return list(columns)
+    key = []
+    for col in schema.primary_key_list:
+        i = schema.column_list.index(col)
+        if columns[i].name != col \
+                or columns[i].table.get_table_name() != table_name:
+            return list(columns)
+        key.append(columns[i])
+    return key
+
+
 if __name__ == '__main__':
     logger.setLevel(logging.INFO)
     test_connection()
@@ -0,0 +1,155 @@
+import dataclasses
+import logging
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from chatidea.config.concept import Category
+
+logger = logging.getLogger(__name__)
+
+# The element, the column of the category and the number of top categories
+Key = tuple[str, str, Optional[int]]
+
+
+@dataclasses.dataclass(frozen=True)
+class CategoryStats:
+    result: dict[str, Any]
+    refreshed_at: float  # time.time() of the end of the query
+    duration: float  # seconds taken by the query
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.refreshed_at
+
+
+class CategoryStatsCache:
+    """
+    The distributions of the categories of the elements, computed by ``load``
+    and served from memory.
+
+    They change slowly, so instead of being queried at every request they are
+    refreshed when older than ``refresh_interval`` seconds: in the background
+    once :meth:`start` has been called, otherwise when requested. Stale
+    distributions are served while being refreshed.
+    """
+
+    def __init__(self,
+                 load: Callable[[str, Category, Optional[int]], dict[str, Any]],
+                 refresh_interval: float):
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self._entries: dict[Key, CategoryStats] = {}
+        self._categories: dict[Key, Category] = {}
+        self._lock = threading.Lock()
+        # increased by invalidate, so that the distributions being computed
+        # meanwhile (maybe of the previous configuration) are not stored
+        self._generation = 0
+        self._refresher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def get(self, element_name: str, category: Category,
+            top: Optional[int] = None, force: bool = False) -> dict[str, Any]:
+        entry = self._entries.get((element_name, category.column, top))
+        if entry is None or force or (self._refresher is None
+                                      and entry.age > self.refresh_interval):
+            entry = self.refresh(element_name, category, top)
+        # a copy, as the callers add their own keys to the result
+        return dict(entry.result)
+
+    def refresh(self, element_name: str, category: Category,
+                top: Optional[int] = None) -> CategoryStats:
+        generation = self._generation
+        started = time.monotonic()
+        result = self.load(element_name, category, top)
+        entry = CategoryStats(result, time.time(), time.monotonic() - started)
+        key = (element_name, category.column, top)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = entry
+                self._categories[key] = category
+        return entry
+
+    def refresh_stale(self, max_age: Optional[float] = None,
+                      element_name: Optional[str] = None) -> int:
+        """
+        Refreshes the distributions older than ``max_age`` (by default the
+        refresh interval), only of ``element_name`` if given, returning how
+        many were refreshed.
+        """
+        max_age = self.refresh_interval if max_age is None else max_age
+        with self._lock:
+            stale = [(name, self._categories[k], top)
+                     for k, e in self._entries.items() if e.age >= max_age
+                     for name, _, top in [k]
+                     if element_name in (None, name)]
+        return self.warm(stale)
+
+    def warm(self, categories: Iterable[tuple[str, Category, Optional[int]]]
+             ) -> int:
+        """Computes the distributions of the given (element, category, top)."""
+        refreshed = 0
+        for element_name, category, top in categories:
+            if self._stop.is_set():
+                break
+            try:
+                self.refresh(element_name, category, top)
+                refreshed += 1
+            except Exception:
+                logger.exception('Cannot compute the categories %s of %s',
+                                 category.column, element_name)
+        return refreshed
+
+    def invalidate(self, element_name: Optional[str] = None) -> int:
+        """
+        Drops the distributions of the element (all of them if None),
+        returning how many were dropped.
+        """
+        with self._lock:
+            self._generation += 1
+            keys = [k for k in self._entries if element_name in (None, k[0])]
+            for key in keys:
+                del self._entries[key]
+                del self._categories[key]
+        return len(keys)
+
+    def info(self) -> list[dict[str, Any]]:
+        """When and how quickly each distribution has been computed."""
+        with self._lock:
+            entries = list(self._entries.items())
+        return [{'element': element_name, 'column': column, 'top': top,
+                 'refreshed_at': e.refreshed_at, 'age': e.age,
+                 'duration': e.duration,
+                 'stale': e.age > self.refresh_interval}
+                for (element_name, column, top), e in entries]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def start(self, warm: Iterable[tuple[str, Category, Optional[int]]] = ()):
+        """
+        Computes the given distributions, and then keeps all of them fresh,
+        in a background thread.
+        """
+        with self._lock:
+            if self._refresher is not None or not self.refresh_interval:
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop,
+                                               args=(list(warm),),
+                                               name='chatidea-categories',
+                                               daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self, warm):
+        if warm:
+            started = time.monotonic()
+            logger.info('Computed %d category distribution(s) in %.1f '
+                        'seconds', self.warm(warm), time.monotonic() - started)
+        while not self._stop.wait(self.refresh_interval / 2):
+            refreshed = self.refresh_stale()
+            if refreshed:
+                logger.info('Refreshed %d category distribution(s)',
+                            refreshed)
+
+    def close(self):
+        self._stop.set()
@@ -0,0 +1,93 @@
+import dataclasses
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# The element and the columns of the attribute
+Key = tuple[str, tuple[str, ...]]
+
+
+@dataclasses.dataclass(frozen=True)
+class _Sample:
+    values: tuple
+    loaded_at: float  # time.monotonic()
+
+
+class ExampleReservoir:
+    """
+    A bounded sample of the values of each attribute, read by ``load`` the
+    first time examples of the attribute are needed and then shared by all the
+    messages showing them.
+
+    A sample older than ``refresh_interval`` seconds is still served, while it
+    is read again in a background thread.
+    """
+
+    def __init__(self, load: Callable[[str, list[str]], list],
+                 refresh_interval: float):
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self._samples: dict[Key, _Sample] = {}
+        self._refreshing: set[Key] = set()
+        self._lock = threading.Lock()
+        # increased by invalidate, so that the samples being read meanwhile
+        # (maybe of the previous configuration) are not stored
+        self._generation = 0
+
+    def get(self, element_name: str, columns: list[str]) -> list:
+        """
+        The sampled values, in a new list that the caller can change.
+        """
+        key = (element_name, tuple(columns))
+        sample = self._samples.get(key)
+        if sample is None:
+            sample = self._refresh(key)
+        elif time.monotonic() - sample.loaded_at > self.refresh_interval:
+            self._refresh_in_background(key)
+        return list(sample.values)
+
+    def _refresh(self, key: Key) -> _Sample:
+        element_name, columns = key
+        generation = self._generation
+        sample = _Sample(tuple(self.load(element_name, list(columns))),
+                         time.monotonic())
+        with self._lock:
+            if generation == self._generation:
+                self._samples[key] = sample
+        return sample
+
+    def _refresh_in_background(self, key: Key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._refresh_logging_errors, args=(key,),
+                         name='chatidea-examples', daemon=True).start()
+
+    def _refresh_logging_errors(self, key: Key):
+        try:
+            self._refresh(key)
+        except Exception:
+            logger.exception('Cannot read the examples of %s', key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, element_name: Optional[str] = None) -> int:
+        """
+        Drops the samples of the element (all of them if None), returning how
+        many were dropped.
+        """
+        with self._lock:
+            self._generation += 1
+            keys = [k for k in self._samples
+                    if element_name in (None, k[0])]
+            for key in keys:
+                del self._samples[key]
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._samples)
@@ -0,0 +1,294 @@
+import collections
+import contextlib
+import dataclasses
+import logging
+import threading
+import time
+from typing import Callable, Optional, Iterator
+
+import pyodbc
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(RuntimeError):
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class StatementStats:
+    hits: int
+    misses: int
+    prepared: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class StatementCache:
+    """
+    Open cursors of a connection, one per SQL statement, the least recently
+    used being closed when there are more than ``max_size`` of them.
+
+    pyodbc keeps the statement prepared by a cursor until the cursor executes
+    a different SQL, so reusing the cursor of a statement reuses its prepared
+    handle instead of preparing it again on the server.
+    """
+
+    def __init__(self, connection: pyodbc.Connection, max_size: int):
+        self.connection = connection
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cursors: collections.OrderedDict[str, pyodbc.Cursor] = \
+            collections.OrderedDict()
+
+    def cursor(self, sql: str) -> pyodbc.Cursor:
+        cursor = self._cursors.get(sql)
+        if cursor is not None:
+            self.hits += 1
+            self._cursors.move_to_end(sql)
+            return cursor
+        self.misses += 1
+        cursor = self._cursors[sql] = self.connection.cursor()
+        while len(self._cursors) > self.max_size:
+            _, old = self._cursors.popitem(last=False)
+            old.close()
+        return cursor
+
+    def discard(self, sql: str):
+        """Closes the cursor of the statement, e.g. after it failed."""
+        cursor = self._cursors.pop(sql, None)
+        if cursor is not None:
+            try:
+                cursor.close()
+            except pyodbc.Error:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._cursors)
+
+    def close(self):
+        for cursor in self._cursors.values():
+            try:
+                cursor.close()
+            except pyodbc.Error:
+                pass
+        self._cursors.clear()
+
+
+@dataclasses.dataclass
+class PooledConnection:
+    connection: pyodbc.Connection
+    created_at: float = dataclasses.field(default_factory=time.monotonic)
+    last_used: float = dataclasses.field(default_factory=time.monotonic)
+    statements: Optional[StatementCache] = None
+
+    def close(self):
+        if self.statements is not None:
+            self.statements.close()
+        try:
+            self.connection.close()
+        except pyodbc.Error:
+            logger.debug('Error while closing a pooled connection',
+                         exc_info=True)
+
+
+class ConnectionPool:
+    """
+    A bounded pool of long-lived ODBC connections.
+
+    Connections are created through ``factory`` (usually the broker's
+    ``_connect``) up to ``max_size``. Idle connections are checked with a
+    cheap query before being handed out if they have not been used for
+    ``ping_interval`` seconds, and connections idle for longer than
+    ``idle_timeout`` are closed, keeping at least ``min_size`` of them open.
+    If ``statement_cache_size`` is positive, each connection keeps a
+    :class:`StatementCache` of that size.
+    """
+
+    def __init__(self, factory: Callable[[], pyodbc.Connection],
+                 min_size: int = 1,
+                 max_size: int = 10,
+                 idle_timeout: float = 5 * 60,
+                 checkout_timeout: float = 30,
+                 ping_interval: float = 30,
+                 health_check_query: str = 'SELECT 1',
+                 statement_cache_size: int = 0):
+        if max_size < 1:
+            raise ValueError('The pool must allow at least one connection')
+        self.factory = factory
+        self.min_size = min(max(min_size, 0), max_size)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.ping_interval = ping_interval
+        self.health_check_query = health_check_query
+        self.statement_cache_size = statement_cache_size
+        self._idle: collections.deque[PooledConnection] = collections.deque()
+        self._in_use: dict[int, PooledConnection] = {}
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._statement_hits = 0
+        self._statement_misses = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def statements(self, connection: pyodbc.Connection) -> \
+            Optional[StatementCache]:
+        """The statement cache of a borrowed connection, if enabled."""
+        pooled = self._in_use.get(id(connection))
+        return pooled.statements if pooled is not None else None
+
+    @property
+    def statement_stats(self) -> StatementStats:
+        with self._condition:
+            prepared = sum(len(p.statements) for p in self._idle
+                           if p.statements is not None)
+            return StatementStats(self._statement_hits,
+                                  self._statement_misses, prepared)
+
+    def open(self):
+        """Opens connections until ``min_size`` of them are available."""
+        while True:
+            with self._condition:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            self._release_new(self._create())
+
+    def acquire(self) -> pyodbc.Connection:
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            pooled = None
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError('The connection pool has been closed')
+                # evicting frees a place, so what it evicts is closed below
+                evicted = self._evict_idle()
+                if self._idle:
+                    pooled = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f'No database connection available after '
+                            f'{self.checkout_timeout} seconds')
+                    self._condition.wait(remaining)
+                    continue
+
+            # closed without holding the lock, as it may be slow
+            for old in evicted:
+                old.close()
+            if pooled is None:
+                pooled = self._create()
+            elif not self._is_healthy(pooled):
+                logger.info('Discarding a broken pooled connection and '
+                            'reconnecting...')
+                pooled.close()
+                pooled = self._create()
+
+            with self._condition:
+                self._in_use[id(pooled.connection)] = pooled
+            return pooled.connection
+
+    def release(self, connection: pyodbc.Connection, discard: bool = False):
+        with self._condition:
+            pooled = self._in_use.pop(id(connection), None)
+            if pooled is None:
+                logger.warning('Releasing a connection that does not belong '
+                               'to the pool')
+                return
+            if pooled.statements is not None:
+                self._statement_hits += pooled.statements.hits
+                self._statement_misses += pooled.statements.misses
+                pooled.statements.hits = pooled.statements.misses = 0
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+            self._condition.notify()
+        if discard or self._closed:
+            pooled.close()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[pyodbc.Connection]:
+        """
+        Borrows a connection for the duration of the block. If the block
+        raises, the connection is discarded as its state is unknown.
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        else:
+            self.release(connection)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for pooled in idle:
+            pooled.close()
+        logger.info('Connection pool closed.')
+
+    def _create(self) -> PooledConnection:
+        try:
+            connection = self.factory()
+            return PooledConnection(connection, statements=StatementCache(
+                connection, self.statement_cache_size)
+                if self.statement_cache_size > 0 else None)
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def _release_new(self, pooled: PooledConnection):
+        with self._condition:
+            self._idle.append(pooled)
+            self._condition.notify()
+
+    def _is_healthy(self, pooled: PooledConnection) -> bool:
+        if time.monotonic() - pooled.last_used < self.ping_interval:
+            return True
+        try:
+            cursor = pooled.connection.cursor()
+            cursor.execute(self.health_check_query)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def _evict_idle(self) -> list[PooledConnection]:
+        # Must be called while holding the condition's lock, and the returned
+        # connections closed after releasing it. The oldest connections are
+        # on the left of the deque.
+        now = time.monotonic()
+        evicted = []
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0].last_used > self.idle_timeout):
+            pooled = self._idle.popleft()
+            self._size -= 1
+            logger.debug('Closing a connection idle for %.0f seconds',
+                         now - pooled.last_used)
+            evicted.append(pooled)
+        return evicted
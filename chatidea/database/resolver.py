@@ -1,51 +1,47 @@
 import logging
 
-from chatidea.config import DatabaseConcepts
+from chatidea.config import ConceptIndex
 from chatidea.config.view import ColumnView
 from chatidea.database import broker
-from chatidea.settings import DB_CONCEPT, DB_CONCEPT_S
+from chatidea.database.category_stats import CategoryStatsCache
+from chatidea.database.examples import ExampleReservoir
+from chatidea import settings
+from chatidea.settings import CATEGORY_STATS_REFRESH_SECONDS, \
+    EXAMPLES_REFRESH_SECONDS
 
 logger = logging.getLogger(__name__)
 
-db_concept: DatabaseConcepts = []
-db_concept_s = []
-
-
 # Database properties
 
 
 def load_db_concept():
-    global db_concept
-    global db_concept_s
-    db_concept = DB_CONCEPT
-    db_concept_s = DB_CONCEPT_S
+    settings.get_config_snapshot()
+
+
+def get_concept_index() -> ConceptIndex:
+    # read at every use, so that a reloaded configuration is seen at once
+    return settings.get_config_snapshot().concept_index
+
+
+def __getattr__(name: str):
+    # db_concept and db_concept_s are those of the current configuration
+    if name == 'db_concept':
+        return settings.get_config_snapshot().concept
+    if name == 'db_concept_s':
+        return settings.get_config_snapshot().concept_s
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def extract_similar_values(word):
-    all_words = []
-    for e in db_concept_s:
-        for s in e.get('similars', []):
-            if word in s:
-                all_words = s
-    if len(all_words) == 0:
-        all_words = [word]
-    return all_words
+    return get_concept_index().similars.get(word, [word])
 
 
 def get_all_primary_element_names():
-    res = []
-    for e in db_concept:
-        if e.type == 'primary':
-            res.append(e.element_name)
-    return res
+    return list(get_concept_index().primary_element_names)
 
 
 def get_all_primary_element_names_and_aliases():
-    res = []
-    for e in db_concept:
-        if e.type == 'primary':
-            res.extend([e.element_name] + (e.aliases or []))
-    return res
+    return list(get_concept_index().primary_element_names_and_aliases)
 
 
 def get_element_aliases(element_name: str):
@@ -54,25 +50,15 @@ def get_element_aliases(element_name: str):
 
 
 def get_element_name_from_possible_alias(element_or_alias_name: str):
-    for e in db_concept:
-        if e.element_name == element_or_alias_name or element_or_alias_name in (
-                e.aliases or []):
-            return e.element_name
-    return None
+    return get_concept_index().element_name_from_alias(element_or_alias_name)
 
 
 def get_element_name_from_table_name(table_name: str):
-    for e in db_concept:
-        if e.table_name == table_name:
-            return e.element_name
-    return None
+    return get_concept_index().element_name_from_table(table_name)
 
 
 def extract_element(element_name: str):
-    for e in db_concept:
-        if e.element_name == element_name:
-            return e
-    return None
+    return get_concept_index().element(element_name)
 
 
 def extract_show_columns(element_name: str):
@@ -96,18 +82,11 @@ def extract_categories(element_name: str):
 
 
 def extract_category(element_name: str, column_name: str):
-    e = extract_element(element_name)
-    for c in e.category:
-        if c.column == column_name or c.alias == column_name:
-            return c
-    return None
+    return get_concept_index().category(element_name, column_name)
 
 
 def extract_attributes_with_keyword(element_name: str):
-    attributes = extract_all_attributes(element_name)
-    if attributes:
-        return [a for a in attributes if a.keyword]
-    return []
+    return list(get_concept_index().keyword_attributes.get(element_name, ()))
 
 
 def extract_attributes_alias(element_name: str):
@@ -118,29 +97,17 @@ def extract_attributes_alias(element_name: str):
 
 
 def get_attribute_by_name(element_name: str, attribute_name: str):
-    attributes = extract_attributes_with_keyword(element_name)
-    for a in attributes:
-        if a.keyword == attribute_name:
-            return a
-    return None
+    return get_concept_index().attribute(element_name, attribute_name)
 
 
 def get_attribute_without_keyword_by_type(element_name: str,
                                           attribute_type: str):
-    attributes = [a for a in extract_all_attributes(element_name)
-                  if a not in extract_attributes_with_keyword(element_name)]
-    for a in attributes:
-        if a.type == attribute_type:
-            return a
-    return None
+    return get_concept_index().attribute_without_keyword(element_name,
+                                                         attribute_type)
 
 
 def get_attribute_without_keyword(element_name):
-    attributes = [a for a in extract_all_attributes(element_name) if
-                  a not in extract_attributes_with_keyword(element_name)]
-    for a in attributes:
-        return a
-    return None
+    return get_concept_index().attribute_without_keyword(element_name)
 
 
 def get_element_show_string(element_name, element_value):
@@ -158,13 +125,24 @@ def query_find(element_name, attributes):
     return result_element
 
 
-def query_show_attributes_examples(element_name, attributes):
+def _query_show_attributes_examples(element_name, attributes):
     e = extract_element(element_name)
     table_name = e.table_name
-    result_element = broker.query_show_attributes_examples(table_name,
-                                                           attributes)
-    result_element = list(filter(None, result_element))
-    return result_element
+    return broker.query_show_attributes_examples(table_name, attributes)
+
+
+example_reservoir = ExampleReservoir(_query_show_attributes_examples,
+                                     EXAMPLES_REFRESH_SECONDS)
+
+
+def query_show_attributes_examples(element_name, attributes):
+    """
+    Values of the attributes to use as examples, served by
+    ``example_reservoir`` unless ``EXAMPLES_REFRESH_SECONDS`` is 0.
+    """
+    if not EXAMPLES_REFRESH_SECONDS:
+        return _query_show_attributes_examples(element_name, attributes)
+    return example_reservoir.get(element_name, attributes)
 
 
 def query_join(element, relation_name):
@@ -179,14 +157,37 @@ def query_join(element, relation_name):
     return result_element
 
 
-def query_category(element_name, category):
+def _query_category(element_name, category, top=None):
     e = extract_element(element_name)
     table_name = e.table_name
-    result_element = broker.query_category(table_name, category)
+    result_element = broker.query_category(table_name, category, top)
     result_element['element_name'] = element_name
     return result_element
 
 
+category_stats = CategoryStatsCache(_query_category,
+                                    CATEGORY_STATS_REFRESH_SECONDS)
+
+
+def query_category(element_name, category, top=None, force=False):
+    """
+    The distribution of the category, served by ``category_stats`` unless
+    ``CATEGORY_STATS_REFRESH_SECONDS`` is 0. With ``force`` it is queried
+    again anyway.
+    """
+    if not CATEGORY_STATS_REFRESH_SECONDS:
+        return _query_category(element_name, category, top)
+    return category_stats.get(element_name, category, top, force)
+
+
+def start_category_stats():
+    """
+    Keeps fresh in the background the distributions of the categories, which
+    are first computed by the warm-up.
+    """
+    category_stats.start()
+
+
 def query_category_value(element_name, category_column, category_value):
     e = extract_element(element_name)
     table_name = e.table_name
@@ -198,6 +199,25 @@ def query_category_value(element_name, category_column, category_value):
     return result_element
 
 
+def load_rows(element, stop):
+    """Loads the rows of the element up to position ``stop``, if paginated."""
+    broker.fetch_rows(element, stop)
+
+
+def reload_rows(element, stop):
+    """Fetches again the rows of the element, if they have been released."""
+    broker.reload_rows(element, stop)
+
+
+def sort_rows(element, column):
+    broker.sort_rows(element, column)
+
+
+def has_view(element_name) -> bool:
+    e = extract_element(element_name)
+    return broker.get_table_view_from_name(e.table_name) is not None
+
+
 def simulate_view(element_name) -> list[ColumnView]:
     e = extract_element(element_name)
     table_name = e.table_name
@@ -0,0 +1,116 @@
+import typing
+from collections.abc import Mapping
+from typing import Any, Callable, Iterator, Optional, Sequence, Union
+
+
+class Row(Mapping):
+    """
+    A read-only view of a row of a result set, accessed by column name like a
+    dictionary. The column positions are shared by all the rows of the result.
+    """
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index: dict[str, int], values: tuple):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, column: str) -> Any:
+        return self._values[self._index[column]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, column) -> bool:
+        return column in self._index
+
+    def __getstate__(self):
+        return self._index, self._values
+
+    def __setstate__(self, state):
+        self._index, self._values = state
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
+
+class ResultSet(Sequence[Row]):
+    """
+    The rows of a query, stored as tuples sharing one column header.
+
+    A result set is never modified, so it can be shared by all the context
+    elements showing it: adding rows, slicing or sorting return a new result
+    set sharing the same row tuples.
+    """
+    __slots__ = ('columns', 'index', 'rows')
+
+    def __init__(self, columns: Sequence[str],
+                 rows: typing.Iterable[Sequence] = (),
+                 index: Optional[dict[str, int]] = None):
+        self.columns = tuple(columns)
+        self.index = index if index is not None \
+            else {c: i for i, c in enumerate(self.columns)}
+        self.rows = tuple(tuple(r) for r in rows)
+
+    @typing.overload
+    def __getitem__(self, item: int) -> Row: ...
+
+    @typing.overload
+    def __getitem__(self, item: slice) -> 'ResultSet': ...
+
+    def __getitem__(self, item: Union[int, slice]):
+        if isinstance(item, slice):
+            return self._derive(self.rows[item])
+        return Row(self.index, self.rows[item])
+
+    def __iter__(self) -> Iterator[Row]:
+        for row in self.rows:
+            yield Row(self.index, row)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __bool__(self) -> bool:
+        return bool(self.rows)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ResultSet) and self.columns == other.columns \
+            and self.rows == other.rows
+
+    def __getstate__(self):
+        return self.columns, self.rows
+
+    def __setstate__(self, state):
+        self.columns, self.rows = state
+        self.index = {c: i for i, c in enumerate(self.columns)}
+
+    def __repr__(self) -> str:
+        return f'ResultSet(columns={self.columns!r}, rows={len(self.rows)})'
+
+    def _derive(self, rows: tuple) -> 'ResultSet':
+        result = ResultSet.__new__(ResultSet)
+        result.columns, result.index, result.rows = \
+            self.columns, self.index, rows
+        return result
+
+    def column(self, column: str) -> tuple:
+        """All the values of a column."""
+        i = self.index[column]
+        return tuple(r[i] for r in self.rows)
+
+    def extend(self, rows: typing.Iterable[Sequence]) -> 'ResultSet':
+        return self._derive(self.rows + tuple(tuple(r) for r in rows))
+
+    def sorted_by(self, column: str,
+                  key: Optional[Callable[[Any], Any]] = None,
+                  reverse: bool = False) -> 'ResultSet':
+        """
+        Sorts the rows by the values of a column, transformed by ``key`` if
+        given.
+        """
+        i = self.index[column]
+        return self._derive(tuple(sorted(
+            self.rows, reverse=reverse,
+            key=(lambda r: key(r[i])) if key else (lambda r: r[i]))))
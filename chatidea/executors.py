@@ -0,0 +1,109 @@
+import asyncio
+import atexit
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import logging
+import multiprocessing
+import threading
+from typing import Callable, Optional, TypeVar, AsyncIterator, Hashable
+
+from chatidea.settings import WEBCHAT_WORKERS, PLOT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+_thread_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_process_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_thread_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Pool used for blocking I/O: database queries and NLU requests."""
+    global _thread_pool
+    with _lock:
+        if _thread_pool is None:
+            _thread_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=WEBCHAT_WORKERS,
+                thread_name_prefix='chatidea-worker')
+        return _thread_pool
+
+
+def get_process_pool() -> Optional[concurrent.futures.ProcessPoolExecutor]:
+    """
+    Pool used for CPU-bound work (i.e., plotting). Returns None if
+    ``PLOT_WORKERS`` is 0, meaning the work is done in the calling thread.
+    """
+    global _process_pool
+    if not PLOT_WORKERS:
+        return None
+    with _lock:
+        if _process_pool is None:
+            # The workers are spawned instead of forked: the parent process
+            # has several threads running, and forking them is not safe
+            _process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=PLOT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_thread_pool(),
+                                      functools.partial(func, *args, **kwargs))
+
+
+def run_cpu_bound(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs ``func`` in the process pool and waits for its result. ``func`` and
+    its arguments must be picklable.
+    """
+    pool = get_process_pool()
+    if pool is None:
+        return func(*args, **kwargs)
+    return pool.submit(func, *args, **kwargs).result()
+
+
+class SessionSerializer:
+    """
+    Hands out one asyncio lock per session, so that the messages of a session
+    are handled one at a time (and their replies are sent in order) while
+    different sessions proceed concurrently. Locks are dropped as soon as no
+    message of their session is waiting.
+    """
+
+    def __init__(self):
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self._waiting: collections.Counter = collections.Counter()
+
+    @contextlib.asynccontextmanager
+    async def hold(self, session: Hashable) -> AsyncIterator[None]:
+        lock = self._locks.setdefault(session, asyncio.Lock())
+        self._waiting[session] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiting[session] -= 1
+            if not self._waiting[session]:
+                del self._waiting[session]
+                del self._locks[session]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+def shutdown():
+    global _thread_pool, _process_pool
+    with _lock:
+        if _thread_pool is not None:
+            _thread_pool.shutdown(wait=False)
+            _thread_pool = None
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False)
+            _process_pool = None
+
+
+atexit.register(shutdown)
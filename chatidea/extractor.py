@@ -1,11 +1,22 @@
+import asyncio
+import atexit
 import dataclasses
 import logging
+import random
 import re
+import threading
+import time
 import urllib.parse
+import weakref
+from typing import Any, Optional
 
-import requests
+import aiohttp
 
-from chatidea.settings import NLU_API_ENDPOINT
+from chatidea.cache import LRUCache
+from chatidea.settings import NLU_API_ENDPOINT, NLU_TIMEOUT_SECONDS, \
+    NLU_CONNECT_TIMEOUT_SECONDS, NLU_MAX_RETRIES, NLU_RETRY_BACKOFF_SECONDS, \
+    NLU_CONNECTION_LIMIT, NLU_CACHE_SIZE, NLU_CACHE_TTL_SECONDS, \
+    NLU_STATUS_CHECK_SECONDS
 
 logger = logging.getLogger(__name__)
 
@@ -31,11 +42,166 @@ class ParsedMessage:
     entities: list[Entity]
 
 
+class NLUError(RuntimeError):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class NLUClient:
+    """
+    Asynchronous client of the NLU REST APIs. Requests share a keep-alive
+    ``aiohttp.ClientSession`` (one for each event loop using the client),
+    have a timeout and are retried with an exponential, jittered backoff
+    when the NLU server cannot be reached or answers with a server error.
+    """
+
+    def __init__(self, endpoint: str,
+                 timeout: float = 10,
+                 connect_timeout: float = 3,
+                 max_retries: int = 2,
+                 retry_backoff: float = 0.2,
+                 connection_limit: int = 32):
+        self.endpoint = endpoint
+        self.timeout = aiohttp.ClientTimeout(total=timeout,
+                                             sock_connect=connect_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.connection_limit = connection_limit
+        self._sessions: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, aiohttp.ClientSession] = \
+            weakref.WeakKeyDictionary()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit,
+                                             keepalive_timeout=60)
+            session = aiohttp.ClientSession(connector=connector,
+                                            timeout=self.timeout)
+            self._sessions[loop] = session
+        return session
+
+    async def request(self, method: str, path: str,
+                      json: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+        url = urllib.parse.urljoin(self.endpoint, path)
+        attempt = 0
+        while True:
+            try:
+                async with self._get_session().request(method, url,
+                                                       json=json) as res:
+                    if res.status != 200:
+                        raise NLUError(f'{method} {url} responded '
+                                       f'{res.status}: {await res.text()}',
+                                       res.status)
+                    return await res.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, NLUError) as e:
+                # Client errors are not going to be fixed by retrying
+                if isinstance(e, NLUError) and e.status < 500:
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+                attempt += 1
+                logger.warning('NLU request failed (%s), retry %d/%d in '
+                               '%.2f seconds', e, attempt, self.max_retries,
+                               delay)
+                await asyncio.sleep(delay)
+
+    async def status(self) -> dict[str, Any]:
+        return await self.request('GET', '/status')
+
+    async def parse(self, text: str) -> dict[str, Any]:
+        return await self.request('POST', '/model/parse', json={'text': text})
+
+    async def close(self):
+        """Closes the session of the running event loop."""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+client = NLUClient(NLU_API_ENDPOINT,
+                   timeout=NLU_TIMEOUT_SECONDS,
+                   connect_timeout=NLU_CONNECT_TIMEOUT_SECONDS,
+                   max_retries=NLU_MAX_RETRIES,
+                   retry_backoff=NLU_RETRY_BACKOFF_SECONDS,
+                   connection_limit=NLU_CONNECTION_LIMIT)
+
+# Parse results of the NLU model, keyed on the model fingerprint and the
+# normalized text
+parse_cache: LRUCache[tuple[Optional[str], str], dict[str, Any]] = LRUCache(
+    max_entries=NLU_CACHE_SIZE, ttl=NLU_CACHE_TTL_SECONDS)
+
+_model_fingerprint: Optional[str] = None
+_model_checked_at: Optional[float] = None
+
+# Event loop (running in a daemon thread) used by the synchronous API, so
+# that the console and Telegram connectors share a single keep-alive session
+_sync_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_loop_lock = threading.Lock()
+
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            _sync_loop = asyncio.new_event_loop()
+            threading.Thread(target=_sync_loop.run_forever,
+                             name='chatidea-nlu', daemon=True).start()
+            atexit.register(_close_sync_loop)
+        return _sync_loop
+
+
+def _close_sync_loop():
+    if _sync_loop is not None and _sync_loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.close(),
+                                         _sync_loop).result(timeout=5)
+        _sync_loop.call_soon_threadsafe(_sync_loop.stop)
+
+
+def _run_sync(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine,
+                                            _get_sync_loop()).result()
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+def _update_model_fingerprint(status: dict[str, Any]):
+    global _model_fingerprint, _model_checked_at
+    fingerprint = status.get('model_id') or status.get('model_file')
+    _model_checked_at = time.monotonic()
+    if fingerprint != _model_fingerprint:
+        if _model_fingerprint is not None:
+            logger.info('The NLU model changed (%s -> %s): clearing the '
+                        'parse cache', _model_fingerprint, fingerprint)
+        parse_cache.clear()
+        _model_fingerprint = fingerprint
+
+
+async def get_model_fingerprint() -> Optional[str]:
+    """
+    Returns the fingerprint of the model served by the NLU, checking its
+    status at most once every ``NLU_STATUS_CHECK_SECONDS`` seconds.
+    """
+    if _model_checked_at is None or \
+            time.monotonic() - _model_checked_at >= NLU_STATUS_CHECK_SECONDS:
+        try:
+            _update_model_fingerprint(await client.status())
+        except (aiohttp.ClientError, asyncio.TimeoutError, NLUError):
+            logger.warning('Unable to check the status of the NLU model',
+                           exc_info=True)
+    return _model_fingerprint
+
+
 def test_connection():
-    res = requests.get(urllib.parse.urljoin(NLU_API_ENDPOINT, '/status'))
-    if res.status_code != 200:
-        raise RuntimeError(
-            f"Model is unreachable! Status request responded {res.status_code}")
+    try:
+        _update_model_fingerprint(_run_sync(client.status()))
+    except (aiohttp.ClientError, asyncio.TimeoutError, NLUError) as e:
+        raise RuntimeError(f"Model is unreachable! Status request failed: {e}")
 
 
 def load_model():
@@ -55,6 +221,14 @@ def parse(message: str) -> ParsedMessage:
     :param message: the message to be converted
     :return: the dictionary representing the interpretation
     """
+    return _run_sync(parse_async(message))
+
+
+async def parse_async(message: str) -> ParsedMessage:
+    """
+    Asynchronous version of :func:`parse`, to be awaited directly by the
+    asynchronous connectors.
+    """
 
     logger.info('Message to parse: "{}"'.format(message))
 
@@ -67,8 +241,8 @@ def parse(message: str) -> ParsedMessage:
             for el in split_message:
                 splitted_el = el.split(':', 1)
                 if len(splitted_el) > 1:
-                    return (parse(
-                        splitted_el[1].replace('"', "").replace('}', "")))
+                    return await parse_async(
+                        splitted_el[1].replace('"', "").replace('}', ""))
         entities = []
         if len(split_message) > 1:  # if there are entities
             entity_list = split_message[1].split(';')
@@ -85,26 +259,31 @@ def parse(message: str) -> ParsedMessage:
                                            confidence=1),
                              entities=entities)
     else:
-        message = message.lower()
-        res = requests.post(
-            urllib.parse.urljoin(NLU_API_ENDPOINT, '/model/parse'),
-            json={'text': message.lower()})
-        parsed_message = res.json()
-
-        # parsed_message = inter.parse(message)
-        for intent in parsed_message['intent_ranking']:
-            if intent['confidence'] > 0.3:
-                logger.debug("Message: '%s', Intent: %s, Confidence: %f",
-                             message, intent['name'], intent['confidence'])
-        for e in parsed_message.get('entities'):
-            # del e['start']
-            e.pop('end', None)
-            e.pop('confidence', None)
-            e.pop('extractor', None)
-            e.pop('processors', None)
-            e['confidence'] = e.pop('confidence_entity', 1)
+        # only the key is normalized: the NLU gets the text as typed, as the
+        # values of the entities are matched to the database
+        key = (await get_model_fingerprint(), normalize_text(message))
+        parsed_message = parse_cache.get(key)
+        if parsed_message is None:
+            parsed_message = await client.parse(message)
+
+            # parsed_message = inter.parse(message)
+            for intent in parsed_message['intent_ranking']:
+                if intent['confidence'] > 0.3:
+                    logger.debug("Message: '%s', Intent: %s, Confidence: %f",
+                                 message, intent['name'], intent['confidence'])
+            for e in parsed_message.get('entities'):
+                # del e['start']
+                e.pop('end', None)
+                e.pop('confidence', None)
+                e.pop('extractor', None)
+                e.pop('processors', None)
+                e['confidence'] = e.pop('confidence_entity', 1)
+            parse_cache.put(key, parsed_message)
+        else:
+            logger.debug('Parse cache hit for: "%s"', message)
 
         logger.info('Parsed message: {}'.format(parsed_message))
+        # New objects are built at each call, as actions edit the entities
         return ParsedMessage(original_message=message,
                              intent=Intent(**parsed_message['intent']),
                              entities=[Entity(**e) for e in
@@ -3,6 +3,7 @@ import typing
 
 from chatidea.database import resolver
 from chatidea.patterns import nlu
+from chatidea.settings import CATEGORY_VISU_LIMIT
 
 
 class Button(typing.TypedDict):
@@ -33,9 +34,10 @@ def get_button_history() -> Button:
 
 def get_buttons_select_element(element) -> list[Button]:
     buttons: list[Button] = []
-    for i in range(element['show']['from'], element['show']['to']):
-        title = resolver.get_element_show_string(element['element_name'],
-                                                 element['value'][i])
+    start = element['show']['from']
+    for i, row in enumerate(element['value'][start:element['show']['to']],
+                            start):
+        title = resolver.get_element_show_string(element['element_name'], row)
         cleanr = re.compile('<.*?>|"|;')
         title = re.sub(cleanr, '', title)
         cleanr = re.compile("'")
@@ -187,7 +189,7 @@ def get_buttons_help() -> list[Button]:
 
 def get_buttons_select_category(element, category_column, categories) -> list[Button]:
     buttons: list[Button] = []
-    displayed_categories = categories[:5]
+    displayed_categories = categories[:CATEGORY_VISU_LIMIT]
     for c in displayed_categories:
         title = c['category']
         payload = extract_payload(nlu.INTENT_FIND_ELEMENT_BY_CATEGORY,
@@ -52,9 +52,11 @@ def element_attributes(element):
 
 def element_list(element):
     msg = ''
-    for i in range(element['show']['from'], element['show']['to']):
+    start = element['show']['from']
+    for i, row in enumerate(element['value'][start:element['show']['to']],
+                            start):
         msg += '{}. {}\n'.format(i + 1, resolver.get_element_show_string(
-            element['element_name'], element['value'][i]))
+            element['element_name'], row))
     return msg
 
 
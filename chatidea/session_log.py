@@ -0,0 +1,91 @@
+"""
+The log of the conversations: a single file, rotated by size, shared by all
+the sessions. The records are handed to a background thread through a queue,
+so that the actions never wait for the disk.
+"""
+import atexit
+import logging
+import queue
+import threading
+from logging import handlers
+from typing import Hashable, Optional, Union
+
+from chatidea.settings import LOG_DIR_PATH_AND_SEP, SESSION_LOG_MAX_BYTES, \
+    SESSION_LOG_BACKUP_COUNT, SESSION_LOG_LEVEL
+
+logger = logging.getLogger('chatidea.session')
+logger.propagate = False
+logger.setLevel(logging.DEBUG)  # the levels are checked by SessionFilter
+
+_listener: Optional[handlers.QueueListener] = None
+_lock = threading.Lock()
+_levels: dict[Hashable, int] = {}
+
+
+class SessionFilter(logging.Filter):
+    """Drops the records below the level of their session."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= get_level(getattr(record, 'session', None))
+
+
+def get_level(session: Hashable) -> int:
+    return _levels.get(session, SESSION_LOG_LEVEL)
+
+
+def set_level(session: Hashable, level: Union[int, str, None]):
+    """
+    Changes the verbosity of the log of a session; None restores the default
+    one.
+    """
+    if level is None:
+        _levels.pop(session, None)
+    else:
+        _levels[session] = logging.getLevelName(level) \
+            if isinstance(level, str) else level
+
+
+def is_enabled(session: Hashable, level: int = logging.INFO) -> bool:
+    return level >= get_level(session)
+
+
+def start():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        LOG_DIR_PATH_AND_SEP.mkdir(parents=True, exist_ok=True)
+        file_handler = handlers.RotatingFileHandler(
+            LOG_DIR_PATH_AND_SEP / 'sessions.log',
+            maxBytes=SESSION_LOG_MAX_BYTES,
+            backupCount=SESSION_LOG_BACKUP_COUNT, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter(
+            '--> %(asctime)s [%(session)s] %(levelname)s:\n%(message)s\n'))
+        records = queue.SimpleQueue()
+        queue_handler = handlers.QueueHandler(records)
+        queue_handler.addFilter(SessionFilter())
+        logger.addHandler(queue_handler)
+        _listener = handlers.QueueListener(records, file_handler)
+        _listener.start()
+
+
+def stop():
+    """Writes the pending records and closes the log file."""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def get_logger(session: Hashable) -> logging.LoggerAdapter:
+    start()
+    return logging.LoggerAdapter(logger, {'session': session})
+
+
+atexit.register(stop)
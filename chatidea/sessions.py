@@ -0,0 +1,166 @@
+import collections
+import contextlib
+import dataclasses
+import logging
+import pickle
+import threading
+import time
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+from chatidea.conversation import Context
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class SessionStats:
+    sessions: int
+    bytes: int
+    expired: int
+    evicted: int
+
+
+@dataclasses.dataclass
+class _Session:
+    context: Context
+    last_access: float
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+
+class SessionStore:
+    """
+    The conversation contexts of the active chats.
+
+    A context is dropped when its chat has been idle for ``ttl`` seconds, or
+    when there are more than ``max_sessions`` of them, starting from the
+    least recently used. Contexts that are in use by an action are never
+    dropped. Each chat has its own lock, so that only the messages of the same
+    chat wait for each other.
+    """
+
+    def __init__(self, ttl: float, max_sessions: int,
+                 sweep_interval: float = 60,
+                 factory: Callable[[Hashable], Context] = Context,
+                 on_sweep: Optional[Callable[[], Any]] = None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self.factory = factory
+        self.on_sweep = on_sweep
+        self._sessions: collections.OrderedDict[Hashable, _Session] = \
+            collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._expired = 0
+        self._evicted = 0
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def get(self, chat_id: Hashable) -> Context:
+        return self._get_session(chat_id).context
+
+    @contextlib.contextmanager
+    def hold(self, chat_id: Hashable) -> Iterator[Context]:
+        """Yields the context of the chat, locked for the whole block."""
+        while True:
+            session = self._get_session(chat_id)
+            with session.lock:
+                # It may have been dropped before being locked
+                if self._sessions.get(chat_id) is session:
+                    yield session.context
+                    return
+
+    def _get_session(self, chat_id: Hashable) -> _Session:
+        self._start_sweeper()
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is None:
+                session = _Session(self.factory(chat_id), time.monotonic())
+                self._sessions[chat_id] = session
+                self._evict()
+            else:
+                session.last_access = time.monotonic()
+                self._sessions.move_to_end(chat_id)
+            return session
+
+    def sweep(self) -> int:
+        """Drops the expired sessions, returning how many were dropped."""
+        deadline = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [k for k, s in self._sessions.items()
+                       if s.last_access < deadline]
+            dropped = sum(self._drop(k) for k in expired)
+            self._expired += dropped
+        if dropped:
+            logger.info('Dropped %d expired session(s), %d left',
+                        dropped, len(self._sessions))
+        if self.on_sweep is not None:
+            self.on_sweep()
+        return dropped
+
+    def _evict(self):
+        excess = len(self._sessions) - self.max_sessions
+        for chat_id in list(self._sessions)[:-1]:
+            if excess <= 0:
+                break
+            if self._drop(chat_id):
+                excess -= 1
+                self._evicted += 1
+
+    def _drop(self, chat_id: Hashable) -> bool:
+        session = self._sessions[chat_id]
+        if not session.lock.acquire(blocking=False):
+            return False  # in use
+        try:
+            del self._sessions[chat_id]
+            session.context.close()
+        finally:
+            session.lock.release()
+        return True
+
+    @property
+    def stats(self) -> SessionStats:
+        """
+        The number of sessions and the approximate size of their contexts,
+        measured by pickling them (so it is not meant to be called often).
+        """
+        with self._lock:
+            contexts = [s.context for s in self._sessions.values()]
+            expired, evicted = self._expired, self._evicted
+        size = 0
+        for context in contexts:
+            try:
+                size += len(pickle.dumps(context.context_list))
+            except Exception:
+                logger.debug('Cannot measure the context of %s',
+                             context.session, exc_info=True)
+        return SessionStats(len(contexts), size, expired, evicted)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, chat_id: Hashable) -> bool:
+        return chat_id in self._sessions
+
+    def _start_sweeper(self):
+        if self._sweeper is not None or not self.sweep_interval:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop,
+                                                 name='chatidea-sessions',
+                                                 daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception('Session sweep failed')
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            for chat_id in list(self._sessions):
+                self._drop(chat_id)
+
@@ -1,9 +1,9 @@
-import distutils.util
 import json
 import logging
 import os
 import pathlib
-from typing import Literal, Union, Any, Type
+import typing
+from typing import Literal, Union, Any, Type, Optional
 
 import dotenv
 import yaml
@@ -13,6 +13,7 @@ from pypika import Query, MSSQLQuery, MySQLQuery, SQLLiteQuery, PostgreSQLQuery,
 from pypika.enums import Dialects
 
 from .config import *
+from .config.snapshot import ConfigSnapshot, get_snapshot, read_config
 
 env = dotenv.dotenv_values(dotenv.find_dotenv(usecwd=True))
 file_path = pathlib.Path(__file__).resolve().parent.parent
@@ -20,6 +21,16 @@ logger = logging.getLogger(__name__)
 CONFIG_TYPES = Literal["concept", "concept_s", "view", "schema"]
 
 
+def strtobool(value: str) -> bool:
+    """Like the ``distutils.util.strtobool`` removed in Python 3.12."""
+    value = value.lower()
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return True
+    if value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return False
+    raise ValueError(f'Invalid truth value: {value}')
+
+
 def get_db_dialect() -> Type[Query]:
     dialect = [e for e in Dialects if e.value == env.get("DB_DIALECT", "mysql")]
     if not dialect:
@@ -37,22 +48,54 @@ def get_db_dialect() -> Type[Query]:
     return dialect_to_obj.get(dialect[0], Query)
 
 
-def get_db_config(config_type: CONFIG_TYPES) -> \
-        Union[dict[str, Any], list[dict[str, Any]]]:
+def get_db_config_path(config_type: CONFIG_TYPES) -> pathlib.Path:
     DB_RESOURCES_PATH = pathlib.Path(
         file_path / env.get("DB_RESOURCES_PATH")) or file_path / 'resources' / 'db'
     file_name = env.get(f'DB_{config_type.upper()}_PATH',
                         f'db_{config_type}_{DB_NAME}.json')
-    path = DB_RESOURCES_PATH / file_name
+    return DB_RESOURCES_PATH / file_name
+
+
+def get_db_config_paths() -> dict[str, pathlib.Path]:
+    return {t: get_db_config_path(t) for t in typing.get_args(CONFIG_TYPES)}
+
+
+def get_db_config(config_type: CONFIG_TYPES) -> \
+        Union[dict[str, Any], list[dict[str, Any]]]:
+    path = get_db_config_path(config_type)
     logger.info('Database %s file: %s', config_type, path)
     logger.info('Loading database %s file...', config_type)
-    with path.open("r") as f:
-        config = json.load(f) if path.suffix == ".json" else yaml.safe_load(f)
+    config = read_config(path)
     logger.info('Database %s file has been loaded!', config_type)
     return config
 
 
-IS_DEBUG = distutils.util.strtobool(env.get("DEBUG", "False"))
+def get_config_snapshot() -> ConfigSnapshot:
+    """
+    The current generation of the validated configuration files, read from
+    the snapshot in ``CONFIG_SNAPSHOT_PATH`` when it is up to date.
+    """
+    global _config_snapshot
+    if _config_snapshot is None:
+        _config_snapshot = get_snapshot(get_db_config_paths(),
+                                        get_config_snapshot_path())
+    return _config_snapshot
+
+
+def set_config_snapshot(snapshot: ConfigSnapshot):
+    """
+    Replaces the configuration with a new generation. The configuration is
+    always read through :func:`get_config_snapshot`, so the swap is atomic.
+    """
+    global _config_snapshot
+    _config_snapshot = snapshot
+
+
+def get_config_snapshot_path() -> Optional[pathlib.Path]:
+    return file_path / CONFIG_SNAPSHOT_PATH if CONFIG_SNAPSHOT_PATH else None
+
+
+IS_DEBUG = strtobool(env.get("DEBUG", "False"))
 # selector
 
 DB_DRIVER = env['DB_DRIVER']
@@ -65,27 +108,61 @@ DB_TRUST_CERTIFICATE = env.get('DB_TRUST_CERTIFICATE')
 DialectQuery: Type[Query] = get_db_dialect()
 
 NLU_API_ENDPOINT = env.get("NLU_API_ENDPOINT", "http://localhost:5005")
+NLU_TIMEOUT_SECONDS = float(env.get("NLU_TIMEOUT_SECONDS", 10))
+NLU_CONNECT_TIMEOUT_SECONDS = float(env.get("NLU_CONNECT_TIMEOUT_SECONDS", 3))
+NLU_MAX_RETRIES = int(env.get("NLU_MAX_RETRIES", 2))
+NLU_RETRY_BACKOFF_SECONDS = float(env.get("NLU_RETRY_BACKOFF_SECONDS", 0.2))
+NLU_CONNECTION_LIMIT = int(env.get("NLU_CONNECTION_LIMIT", 32))
+NLU_CACHE_SIZE = int(env.get("NLU_CACHE_SIZE", 1024))
+NLU_CACHE_TTL_SECONDS = float(env.get("NLU_CACHE_TTL_SECONDS", 10 * 60))
+NLU_STATUS_CHECK_SECONDS = float(env.get("NLU_STATUS_CHECK_SECONDS", 30))
 # files
 
 LOG_DIR_PATH_AND_SEP = file_path / 'logs'
+# Served by the web chat under /static
+STATIC_DIR = pathlib.Path(env.get('STATIC_DIR', file_path / 'chatidea' / 'static'))
+CHART_CACHE_MAX_BYTES = int(env.get('CHART_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CHART_CACHE_MEMORY_BYTES = int(env.get('CHART_CACHE_MEMORY_BYTES', 8 * 1024 * 1024))
+# The URL the web chat is reached at (e.g. https://chatidea.example.org), which
+# the URLs of the charts sent to the clients start with. If empty, they are
+# relative to the page embedding the chat, that must then be served by it
+WEBCHAT_PUBLIC_URL = env.get('WEBCHAT_PUBLIC_URL', '').rstrip('/')
+SESSION_LOG_MAX_BYTES = int(env.get('SESSION_LOG_MAX_BYTES', 10 * 1024 * 1024))
+SESSION_LOG_BACKUP_COUNT = int(env.get('SESSION_LOG_BACKUP_COUNT', 5))
+SESSION_LOG_LEVEL = logging.getLevelName(
+    env.get('SESSION_LOG_LEVEL', 'INFO').upper())
 NLU_DATA_PATH = file_path / 'writer' / 'rasa_dataset_training.json'
 NLU_MODEL_PATH = file_path / 'models' / 'nlu_model.tar.gz'
 NLU_MODEL_DIR_PATH = NLU_MODEL_PATH.parent
+# The validated configuration files, compiled again when they change (empty
+# to parse them at every start); relative to the project directory
+CONFIG_SNAPSHOT_PATH = env.get('CONFIG_SNAPSHOT_PATH',
+                               f'cache/config_{DB_NAME}.pickle')
+_config_snapshot: Optional[ConfigSnapshot] = None
+
 
-DB_VIEW = parse_obj_as(DatabaseView, get_db_config('view'))
-DB_CONCEPT = parse_obj_as(DatabaseConcepts, get_db_config('concept'))
-DB_CONCEPT_S = get_db_config("concept_s")
-DB_SCHEMA = parse_obj_as(DatabaseSchema, get_db_config("schema"))
-
-if "EXTRA_CONFIG_PATH" in env:
-    extra_config_path =pathlib.Path(file_path / env.get("EXTRA_CONFIG_PATH"))
-    if extra_config_path.exists():
-        with extra_config_path.open("r") as f:
-            EXTRA_CONFIG = parse_obj_as(ExtraConfiguration, json.load(f) if extra_config_path.suffix == ".json" else yaml.safe_load(f))
-    else:
-        EXTRA_CONFIG = ExtraConfiguration()
-else:
-    EXTRA_CONFIG = ExtraConfiguration()
+def get_extra_config() -> ExtraConfiguration:
+    if "EXTRA_CONFIG_PATH" in env:
+        extra_config_path =pathlib.Path(file_path / env.get("EXTRA_CONFIG_PATH"))
+        if extra_config_path.exists():
+            with extra_config_path.open("r") as f:
+                return parse_obj_as(ExtraConfiguration, json.load(f) if extra_config_path.suffix == ".json" else yaml.safe_load(f))
+    return ExtraConfiguration()
+
+
+# The configuration files are only parsed the first time they are used (see
+# __getattr__), so that importing the settings is cheap. Those of the database
+# are those of the current generation, as they can be reloaded
+_LAZY_CONFIGS = {
+    'EXTRA_CONFIG': get_extra_config,
+}
+_SNAPSHOT_CONFIGS = {
+    'DB_VIEW': 'view',
+    'DB_CONCEPT': 'concept',
+    'DB_CONCEPT_S': 'concept_s',
+    'DB_SCHEMA': 'schema',
+    'CONCEPT_INDEX': 'concept_index',
+}
 
 CHATITO_TEMPLATE_PATH = file_path / 'writer' / 'chatito_template.chatito'
 CHATITO_MODEL_PATH = file_path / 'writer' / 'chatito_model.chatito'
@@ -93,16 +170,73 @@ CHATITO_MODEL_PATH = file_path / 'writer' / 'chatito_model.chatito'
 # settings
 
 TOKEN_TELEGRAM = env['TELEGRAM_TOKEN']
+ADMIN_TOKEN = env.get('ADMIN_TOKEN')  # enables the administration endpoints
 
 INTENT_CONFIDENCE_THRESHOLD = 0.4
 ELEMENT_SIMILARITY_DISTANCE_THRESHOLD = 3  # 5 o 3?
 ELEMENT_VISU_LIMIT = 5
 CONTEXT_VISU_LIMIT = 4
+CATEGORY_VISU_LIMIT = 5  # the others are summed as "Other" in the pie charts
 
-CONTEXT_PERSISTENCE_SECONDS = 5 * 60
+CONTEXT_PERSISTENCE_SECONDS = int(env.get('CONTEXT_PERSISTENCE_SECONDS',
+                                          5 * 60))
+CONTEXT_MAX_SESSIONS = int(env.get('CONTEXT_MAX_SESSIONS', 1000))
+CONTEXT_SWEEP_SECONDS = int(env.get('CONTEXT_SWEEP_SECONDS', 60))
+# "memory" keeps the contexts in the process, "sqlite" in CONTEXT_STORE_PATH so
+# that they can be shared by the processes of a host, "database" in two tables
+# of the database (created if missing) so that they are shared by the replicas
+CONTEXT_STORE = env.get('CONTEXT_STORE', 'memory')
+CONTEXT_STORE_PATH = env.get('CONTEXT_STORE_PATH',
+                             str(file_path / 'contexts.sqlite3'))
+# CONTEXT_STORE_PATH must be on a local disk. WAL lets the readers go on while
+# writing, DELETE works where WAL is not supported
+CONTEXT_STORE_JOURNAL_MODE = env.get('CONTEXT_STORE_JOURNAL_MODE', 'WAL')
 CONTEXT_MAX_LENGTH = 16
+# Number of the most recent context elements whose rows are kept in memory
+CONTEXT_RESIDENT_RESULTS = int(env.get('CONTEXT_RESIDENT_RESULTS', 4))
 
 QUERY_LIMIT = int(env.get('QUERY_LIMIT', 100))  # 0 for no limit
+# Fetch the results one page (of ELEMENT_VISU_LIMIT rows) at a time, counting
+# the total separately, instead of fetching up to QUERY_LIMIT rows at once
+QUERY_PAGINATED = strtobool(env.get('QUERY_PAGINATED', 'True'))
+
+DB_POOL_MIN_SIZE = int(env.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(env.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_IDLE_SECONDS = int(env.get('DB_POOL_IDLE_SECONDS', 5 * 60))
+DB_POOL_TIMEOUT_SECONDS = int(env.get('DB_POOL_TIMEOUT_SECONDS', 30))
+DB_POOL_PING_SECONDS = int(env.get('DB_POOL_PING_SECONDS', 30))
+# Keep the cursors of the most used statements open on each connection, so
+# that the database does not prepare them again
+DB_PREPARED_STATEMENTS = strtobool(env.get('DB_PREPARED_STATEMENTS', 'False'))
+DB_STATEMENT_CACHE_SIZE = int(env.get('DB_STATEMENT_CACHE_SIZE', 32))
+
+RESULT_CACHE_SIZE = int(env.get('RESULT_CACHE_SIZE', 512))  # 0 to disable
+RESULT_CACHE_TTL_SECONDS = float(env.get('RESULT_CACHE_TTL_SECONDS', 5 * 60))
+RESULT_CACHE_MAX_BYTES = int(env.get('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+SQL_TEMPLATE_CACHE_SIZE = int(env.get('SQL_TEMPLATE_CACHE_SIZE', 1024))
+# Age after which the distributions of the categories are computed again,
+# 0 to compute them at every request
+CATEGORY_STATS_REFRESH_SECONDS = float(env.get('CATEGORY_STATS_REFRESH_SECONDS', 60 * 60))
+# Rows fetched at a time by the streamed queries
+FETCH_BATCH_SIZE = int(env.get('FETCH_BATCH_SIZE', 500))
+# Distinct values read to pick the examples of an attribute from, and age
+# after which they are read again (0 to read them at every request)
+EXAMPLES_SAMPLE_SIZE = int(env.get('EXAMPLES_SAMPLE_SIZE', 100))
+EXAMPLES_REFRESH_SECONDS = float(env.get('EXAMPLES_REFRESH_SECONDS', 60 * 60))
+# Rows of a table read at most when sampling its values
+SAMPLE_MAX_SCAN_ROWS = int(env.get('SAMPLE_MAX_SCAN_ROWS', 10000))
+
+# Threads computing the examples, the category distributions and the indexes
+# of all the concepts at startup, and seconds after which the bot starts anyway
+WARMUP_WORKERS = int(env.get('WARMUP_WORKERS', 4))
+WARMUP_SECONDS = float(env.get('WARMUP_SECONDS', 60))
+
+# Seconds between the checks for changes of the database configuration files,
+# which are then reloaded without restarting (0 to never check)
+CONFIG_RELOAD_SECONDS = float(env.get('CONFIG_RELOAD_SECONDS', 5))
+
+WEBCHAT_WORKERS = int(env.get('WEBCHAT_WORKERS', 8))
+PLOT_WORKERS = int(env.get('PLOT_WORKERS', 2))  # 0 to plot in the same process
 
 # db
 
@@ -112,3 +246,12 @@ remote = True if os.environ.get('PYTHONANYWHERE_SITE') else False
 
 NLU_CONFIG_PIPELINE = "supervised_embeddings"  # "spacy_sklearn"
 NLU_CONFIG_LANGUAGE = "en"
+
+
+def __getattr__(name: str) -> Any:
+    if name in _SNAPSHOT_CONFIGS:
+        return getattr(get_config_snapshot(), _SNAPSHOT_CONFIGS[name])
+    if name in _LAZY_CONFIGS:
+        value = globals()[name] = _LAZY_CONFIGS[name]()
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
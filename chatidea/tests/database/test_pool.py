@@ -0,0 +1,174 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+import pyodbc
+from pypika.dialects import Dialects
+
+from chatidea.database import broker
+from chatidea.database.pool import ConnectionPool, PoolTimeoutError, \
+    StatementCache
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.closed = False
+
+    def execute(self, sql, *parameters):
+        if self.connection.error is not None:
+            raise self.connection.error
+        self.connection.executed.append(sql)
+
+    def fetchall(self):
+        return [(self.connection.number,)]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.error = None  # raised by the cursors when set
+        self.executed = []
+        self.cursors = []
+        self.closed = False
+        self.pool = None  # to check that it is closed without its lock
+        self.closed_unlocked = None
+
+    def cursor(self):
+        cursor = FakeCursor(self)
+        self.cursors.append(cursor)
+        return cursor
+
+    def close(self):
+        if self.pool is not None:
+            # another thread would wait for the lock if it were held
+            locked = threading.Thread(target=self.check_unlocked)
+            locked.start()
+            locked.join()
+        self.closed = True
+
+    def check_unlocked(self):
+        self.closed_unlocked = self.pool._condition.acquire(blocking=False)
+        if self.closed_unlocked:
+            self.pool._condition.release()
+
+
+class TestConnectionPool(TestCase):
+    def setUp(self):
+        self.connections = []
+
+        def connect():
+            self.connections.append(FakeConnection(len(self.connections)))
+            return self.connections[-1]
+
+        self.connect = connect
+
+    def pool(self, **kwargs):
+        pool = ConnectionPool(self.connect, **{'min_size': 0, **kwargs})
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_checkout_and_checkin(self):
+        pool = self.pool(max_size=2)
+        with pool.connection() as first:
+            self.assertEqual((pool.size, pool.idle), (1, 0))
+        self.assertEqual((pool.size, pool.idle), (1, 1))
+        with pool.connection() as second:
+            self.assertIs(second, first)
+        self.assertEqual(len(self.connections), 1)
+
+    def test_checkout_timeout(self):
+        pool = self.pool(max_size=1, checkout_timeout=0.05)
+        connection = pool.acquire()
+        with self.assertRaises(PoolTimeoutError):
+            pool.acquire()
+        threading.Timer(0.01, pool.release, [connection]).start()
+        pool.checkout_timeout = 1
+        self.assertIs(pool.acquire(), connection)
+
+    def test_idle_eviction(self):
+        pool = self.pool(min_size=1, max_size=3, idle_timeout=0.01)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        first.pool = pool
+        time.sleep(0.02)
+        # the oldest idle connection is closed, the minimum is kept
+        self.assertIs(pool.acquire(), second)
+        self.assertTrue(first.closed)
+        self.assertTrue(first.closed_unlocked)
+        self.assertEqual(pool.size, 1)
+
+    def test_broken_connection_is_discarded(self):
+        pool = self.pool(ping_interval=0)
+        with pool.connection() as connection:
+            pass
+        connection.error = pyodbc.Error('gone away')
+        with pool.connection() as other:
+            self.assertIsNot(other, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_failed_block_discards_the_connection(self):
+        pool = self.pool()
+        with self.assertRaises(ValueError):
+            with pool.connection() as connection:
+                raise ValueError()
+        self.assertTrue(connection.closed)
+        self.assertEqual((pool.size, pool.idle), (0, 0))
+
+    def test_execute_pooled_reconnects(self):
+        pool = self.pool(ping_interval=60)
+        with pool.connection() as connection:
+            pass
+        connection.error = pyodbc.OperationalError('gone away')
+        with mock.patch.object(broker, '_pool', pool):
+            self.assertEqual(broker._execute_pooled('SELECT 1'), [(1,)])
+        self.assertTrue(connection.closed)
+        self.assertEqual(self.connections[1].executed, ['SELECT 1'])
+
+    def test_health_check_query_of_the_dialect(self):
+        for dialect, query in ((Dialects.ORACLE, 'SELECT 1 FROM DUAL'),
+                               (Dialects.MYSQL, 'SELECT 1')):
+            with mock.patch.object(broker, 'DIALECT', dialect), \
+                    mock.patch.object(broker, '_pool', None):
+                pool = broker.get_pool()
+                self.addCleanup(pool.close)
+                self.assertEqual(pool.health_check_query, query)
+
+
+class TestStatementCache(TestCase):
+    def setUp(self):
+        self.connection = FakeConnection(0)
+        self.statements = StatementCache(self.connection, max_size=2)
+
+    def test_least_recently_used_is_closed(self):
+        first = self.statements.cursor('SELECT 1')
+        second = self.statements.cursor('SELECT 2')
+        self.assertIs(self.statements.cursor('SELECT 1'), first)
+        self.statements.cursor('SELECT 3')
+        self.assertTrue(second.closed)
+        self.assertFalse(first.closed)
+        self.assertEqual(len(self.statements), 2)
+        self.assertEqual((self.statements.hits, self.statements.misses),
+                         (1, 3))
+
+    def test_close(self):
+        cursors = [self.statements.cursor('SELECT 1'),
+                   self.statements.cursor('SELECT 2')]
+        self.statements.close()
+        self.assertTrue(all(c.closed for c in cursors))
+        self.assertEqual(len(self.statements), 0)
+
+    def test_failed_cursor_is_evicted(self):
+        cursor = self.statements.cursor('SELECT 1')
+        self.connection.error = pyodbc.ProgrammingError('syntax error')
+        with self.assertRaises(pyodbc.Error):
+            broker._fetch_all(self.connection, 'SELECT 1',
+                              statements=self.statements)
+        self.assertTrue(cursor.closed)
+        self.connection.error = None
+        self.assertIsNot(self.statements.cursor('SELECT 1'), cursor)
@@ -0,0 +1,47 @@
+from unittest import TestCase, mock
+
+from chatidea.cache import LRUCache
+from chatidea.database import broker
+
+
+class TestResultCache(TestCase):
+    def setUp(self):
+        self.cache = LRUCache(max_entries=10, max_size=1024,
+                              sizeof=broker._rows_size)
+        patcher = mock.patch.object(broker, 'result_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fetches = []
+
+    def execute(self, sql, tables, rows=((1, 'a'), (2, 'b'))):
+        def fetch():
+            self.fetches.append(sql)
+            return rows
+
+        return broker.execute_cached_sql(sql, ('x',), tables, fetch)
+
+    def test_hit(self):
+        self.assertEqual(self.execute('SELECT 1', ['person']),
+                         ((1, 'a'), (2, 'b')))
+        self.assertEqual(self.execute('SELECT 1', ['person']),
+                         ((1, 'a'), (2, 'b')))
+        self.assertEqual(self.fetches, ['SELECT 1'])
+        self.assertEqual(self.cache.stats.hits, 1)
+
+    def test_byte_budget(self):
+        self.execute('SELECT 1', ['person'])
+        self.execute('SELECT 2', ['person'], rows=[(i,) for i in range(100)])
+        self.assertEqual(len(self.cache), 1)
+        self.assertLessEqual(self.cache.stats.size, 1024)
+        self.execute('SELECT 1', ['person'])
+        self.assertEqual(self.fetches, ['SELECT 1', 'SELECT 2'])
+
+    def test_invalidate_table(self):
+        self.execute('SELECT 1', ['person'])
+        self.execute('SELECT 2', ['person', 'book'])
+        self.execute('SELECT 3', ['book'])
+        self.assertEqual(broker.invalidate_table('person'), 2)
+        self.execute('SELECT 3', ['book'])
+        self.execute('SELECT 1', ['person'])
+        self.assertEqual(self.fetches, ['SELECT 1', 'SELECT 2', 'SELECT 3',
+                                        'SELECT 1'])
@@ -0,0 +1,37 @@
+import pickle
+from unittest import TestCase
+
+from chatidea.database.results import ResultSet
+
+
+class TestResultSet(TestCase):
+    def setUp(self):
+        self.result = ResultSet(['id', 'name'], [(1, 'a'), (2, 'b')])
+
+    def test_rows_as_dicts(self):
+        self.assertEqual(self.result[1], {'id': 2, 'name': 'b'})
+        self.assertEqual([r['name'] for r in self.result], ['a', 'b'])
+
+    def test_extend_does_not_modify_shared_rows(self):
+        extended = self.result.extend([(3, 'c')])
+        self.assertEqual(len(self.result), 2)
+        self.assertEqual(len(extended), 3)
+        self.assertIs(extended.rows[0], self.result.rows[0])
+
+    def test_pickle(self):
+        self.assertEqual(pickle.loads(pickle.dumps(self.result)), self.result)
+
+    def test_row_views(self):
+        row = self.result[0]
+        self.assertEqual(row['name'], 'a')
+        self.assertEqual(dict(row.items()), {'id': 1, 'name': 'a'})
+        self.assertEqual(row, {'id': 1, 'name': 'a'})
+        with self.assertRaises(KeyError):
+            row['missing']
+
+    def test_slice_and_sort(self):
+        window = self.result[1:]
+        self.assertEqual(window.column('name'), ('b',))
+        self.assertIs(window.index, self.result.index)
+        self.assertEqual(self.result.sorted_by('id', reverse=True).column('id'),
+                         (2, 1))
@@ -0,0 +1,49 @@
+import time
+from unittest import TestCase
+
+from chatidea.cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.stats.evictions, 1)
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=0.01)
+        cache.put('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_size_cap(self):
+        cache = LRUCache(max_size=10, sizeof=len)
+        cache.put('a', 'x' * 6)
+        cache.put('b', 'x' * 6)
+        self.assertNotIn('a', cache)
+        cache.put('c', 'x' * 11)
+        self.assertNotIn('c', cache)
+        self.assertEqual(cache.stats.size, 6)
+
+    def test_hit_and_miss_counters(self):
+        cache = LRUCache()
+        cache.put('a', 1)
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (1, 1))
+        self.assertEqual(cache.stats.hit_rate, 0.5)
+
+    def test_invalidate_tag(self):
+        cache = LRUCache()
+        cache.put('a', 1, tags=['customers'])
+        cache.put('b', 2, tags=['customers', 'orders'])
+        cache.put('c', 3, tags=['orders'])
+        self.assertEqual(cache.invalidate_tag('customers'), 2)
+        self.assertEqual(list(cache._entries), ['c'])
+        self.assertEqual(cache.invalidate_tag('customers'), 0)
@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from chatidea.config.concept import Category
+from chatidea.database.category_stats import CategoryStatsCache
+
+
+class TestCategoryStatsCache(TestCase):
+    def setUp(self):
+        self.loads = []
+
+        def load(element_name, category, top):
+            self.loads.append((element_name, category.column, top))
+            return {'value': len(self.loads)}
+
+        self.cache = CategoryStatsCache(load, refresh_interval=60)
+        self.category = Category(column='area', alias='research area',
+                                 keyword='in')
+
+    def test_served_from_memory(self):
+        self.assertEqual(self.cache.get('person', self.category, 5),
+                         {'value': 1})
+        self.assertEqual(self.cache.get('person', self.category, 5),
+                         {'value': 1})
+        self.assertEqual(self.loads, [('person', 'area', 5)])
+
+    def test_forced_refresh(self):
+        self.cache.get('person', self.category)
+        self.assertEqual(self.cache.get('person', self.category, force=True),
+                         {'value': 2})
+
+    def test_refresh_stale(self):
+        self.cache.get('person', self.category)
+        self.cache.get('book', self.category)
+        self.assertEqual(self.cache.refresh_stale(), 0)
+        self.assertEqual(self.cache.refresh_stale(0, 'book'), 1)
+        self.assertEqual(self.loads[-1], ('book', 'area', None))
+        self.assertEqual([i['stale'] for i in self.cache.info()],
+                         [False, False])
+
+    def test_invalidate(self):
+        self.cache.get('person', self.category)
+        self.cache.get('book', self.category)
+        self.assertEqual(self.cache.invalidate('book'), 1)
+        self.assertEqual(len(self.cache), 1)
+        self.cache.get('book', self.category)
+        self.assertEqual(self.loads[-1], ('book', 'area', None))
+
+    def test_invalidated_while_computing(self):
+        def load(element_name, category, top):
+            self.cache.invalidate(element_name)
+            return {'value': 'previous configuration'}
+
+        self.cache.load = load
+        self.cache.get('person', self.category)
+        self.assertEqual(len(self.cache), 0)
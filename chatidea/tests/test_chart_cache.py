@@ -0,0 +1,40 @@
+import pathlib
+import tempfile
+from unittest import TestCase
+
+from chatidea.chart_cache import ChartCache, chart_name
+
+
+class TestChartCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ChartCache(pathlib.Path(self.directory.name), '/charts',
+                                max_bytes=10, memory_bytes=100)
+        self.rendered = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def render(self, content: bytes):
+        def render(path):
+            self.rendered.append(content)
+            pathlib.Path(path).write_bytes(content)
+        return render
+
+    def test_rendered_once(self):
+        name = chart_name('pie', 'AREA', ['a', 'b'], [1, 2])
+        self.assertEqual(name, chart_name('pie', 'AREA', ['a', 'b'], [1, 2]))
+        path = self.cache.get_or_render(name, self.render(b'chart'))
+        self.assertEqual(self.cache.get_or_render(name, self.render(b'chart')),
+                         path)
+        self.assertEqual(self.rendered, [b'chart'])
+        self.assertEqual(self.cache.read(name), b'chart')
+        self.assertEqual(self.cache.url(str(path)), f'/charts/{name}')
+
+    def test_least_recently_used_deleted(self):
+        first = self.cache.get_or_render('a.png', self.render(b'123456'))
+        self.cache.get_or_render('b.png', self.render(b'123456'))
+        self.assertFalse(first.exists())
+        self.assertIsNone(self.cache.read('a.png'))
+        self.assertIsNone(self.cache.read('../a.png'))
+        self.assertEqual(self.cache.read('b.png'), b'123456')
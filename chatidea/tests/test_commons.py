@@ -0,0 +1,28 @@
+import random
+from unittest import TestCase
+
+from chatidea import commons
+
+
+class TestExtractSimilarValue(TestCase):
+    def test_bounded_edit_distance(self):
+        self.assertEqual(commons.bounded_edit_distance('kitten', 'sitting', 5), 3)
+        self.assertEqual(commons.bounded_edit_distance('kitten', 'sitting', 3), 3)
+        self.assertEqual(commons.bounded_edit_distance('a', 'abcdef', 2), 2)
+
+    def test_first_closest_below_threshold(self):
+        candidates = ['person', 'persons', 'parson']
+        self.assertEqual(commons.extract_similar_value('persom', candidates), 'person')
+        self.assertEqual(commons.extract_similar_value('parsons', candidates), 'persons')
+        self.assertIsNone(commons.extract_similar_value('book', candidates, 3))
+
+
+class TestReservoirSample(TestCase):
+    def test_bounded_and_deterministic(self):
+        sample = commons.reservoir_sample(range(1000), 5, random.Random(42))
+        self.assertEqual(len(sample), 5)
+        self.assertEqual(len(set(sample)), 5)
+        self.assertEqual(
+            commons.reservoir_sample(range(1000), 5, random.Random(42)),
+            sample)
+        self.assertEqual(commons.reservoir_sample(range(3), 5), [0, 1, 2])
@@ -0,0 +1,54 @@
+import json
+import pathlib
+import shutil
+import tempfile
+from unittest import TestCase
+
+from chatidea.config.snapshot import compile_snapshot
+from chatidea.config_reload import ConfigWatcher, diff
+
+RESOURCES = pathlib.Path(__file__).resolve().parents[2] / 'resources' / 'db'
+
+
+class TestConfigReload(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.paths = {}
+        for config_type in ('concept', 'concept_s', 'schema', 'view'):
+            path = pathlib.Path(directory) / f'db_{config_type}_deib.json'
+            shutil.copy(RESOURCES / path.name, path)
+            self.paths[config_type] = path
+
+    def edit(self, config_type, change):
+        config = json.loads(self.paths[config_type].read_text())
+        change(config)
+        self.paths[config_type].write_text(json.dumps(config))
+
+    def test_watcher(self):
+        changes = []
+        watcher = ConfigWatcher(lambda: list(self.paths.values()),
+                                lambda: changes.append(1), interval=60)
+        self.assertFalse(watcher.check())  # the first check only records
+        self.assertFalse(watcher.check())
+        self.edit('view', lambda view: view.popitem())
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check())
+        self.assertEqual(changes, [1])
+
+    def test_diff(self):
+        old = compile_snapshot(self.paths)
+        concept = old.concept[0]
+
+        def rename_alias(concepts):
+            concepts[0]['aliases'] = ['renamed']
+
+        self.edit('concept', rename_alias)
+        self.edit('schema', lambda schema: schema[concept.table_name]
+                  ['column_list'].append('new_column'))
+        changes = diff(old, compile_snapshot(self.paths))
+        self.assertEqual(changes.tables, {concept.table_name})
+        self.assertIn(concept.element_name, changes.elements)
+        self.assertIn(concept.table_name, changes.element_tables)
+        self.assertFalse(changes.view)
+        self.assertEqual(diff(old, old).elements, frozenset())
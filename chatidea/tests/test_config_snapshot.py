@@ -0,0 +1,46 @@
+import json
+import pathlib
+import shutil
+import tempfile
+from unittest import TestCase
+
+from chatidea.config.snapshot import get_snapshot, load_snapshot, \
+    snapshot_key
+
+RESOURCES = pathlib.Path(__file__).resolve().parents[2] / 'resources' / 'db'
+
+
+class TestConfigSnapshot(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.directory = pathlib.Path(directory)
+        self.paths = {}
+        for config_type in ('concept', 'concept_s', 'schema', 'view'):
+            path = self.directory / f'db_{config_type}_deib.json'
+            shutil.copy(RESOURCES / path.name, path)
+            self.paths[config_type] = path
+        self.snapshot_path = self.directory / 'cache' / 'config.pickle'
+
+    def test_saved_and_loaded(self):
+        compiled = get_snapshot(self.paths, self.snapshot_path)
+        loaded = load_snapshot(self.snapshot_path, compiled.key)
+        self.assertIsNot(loaded, compiled)
+        self.assertEqual(loaded.concept, compiled.concept)
+        self.assertEqual(loaded.schema, compiled.schema)
+        self.assertEqual(loaded.view, compiled.view)
+        self.assertEqual(loaded.concept_index.aliases,
+                         compiled.concept_index.aliases)
+
+    def test_stale_when_a_file_changes(self):
+        compiled = get_snapshot(self.paths, self.snapshot_path)
+        view = json.loads(self.paths['view'].read_text())
+        view.popitem()
+        self.paths['view'].write_text(json.dumps(view))
+
+        key = snapshot_key(self.paths)
+        self.assertNotEqual(key, compiled.key)
+        self.assertIsNone(load_snapshot(self.snapshot_path, key))
+        recompiled = get_snapshot(self.paths, self.snapshot_path)
+        self.assertEqual(len(recompiled.view.root), len(view))
+        self.assertEqual(load_snapshot(self.snapshot_path, key).key, key)
@@ -0,0 +1,105 @@
+import contextlib
+import pathlib
+import sqlite3
+import tempfile
+from unittest import TestCase, mock
+
+from chatidea.context_store import SQLiteContextStore, \
+    DatabaseContextStore, dump_element, load_element
+
+
+class ContextStoreTests:
+    """The tests of every persistent store, in ``self.store``."""
+
+    def elements(self, chat_id):
+        return [load_element(e)['n'] for e in self.store.load(chat_id)[1]]
+
+    def test_unknown_context(self):
+        self.assertIsNone(self.store.load('a'))
+        self.assertEqual(self.store.version('a'), 0)
+
+    def test_incremental_changes(self):
+        for n in range(4):
+            self.store.append('a', dump_element({'n': n}))
+        self.store.append('b', dump_element({'n': 9}))
+        self.store.keep_last('a', 3)
+        self.assertEqual(self.elements('a'), [1, 2, 3])
+        self.store.keep_first('a', 2)
+        version = self.store.replace_last('a', dump_element({'n': 5}))
+        self.assertEqual(self.elements('a'), [1, 5])
+        self.assertEqual(self.store.version('a'), version)
+        self.assertEqual(self.elements('b'), [9])
+
+    def test_purge(self):
+        self.store.append('a', dump_element({'n': 0}))
+        self.assertEqual(self.store.purge(60), 0)
+        self.assertEqual(self.store.purge(-1), 1)
+        self.assertIsNone(self.store.load('a'))
+
+
+class TestSQLiteContextStore(ContextStoreTests, TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = SQLiteContextStore(
+            str(pathlib.Path(directory.name) / 'contexts.sqlite3'))
+        self.addCleanup(self.store.close)
+
+    def test_journal_mode(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = SQLiteContextStore(
+            str(pathlib.Path(directory.name) / 'contexts.sqlite3'),
+            journal_mode='delete')
+        self.addCleanup(store.close)
+        store.append('a', dump_element({'n': 0}))
+        self.assertEqual(store._connect().execute(
+            'PRAGMA journal_mode').fetchone()[0], 'delete')
+        with self.assertRaises(ValueError):
+            SQLiteContextStore(':memory:', journal_mode='wal; DROP TABLE x')
+
+
+class TestDatabaseContextStore(ContextStoreTests, TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = pathlib.Path(directory.name) / 'database.sqlite3'
+        self.connect = lambda: contextlib.closing(sqlite3.connect(path))
+        self.store = DatabaseContextStore(self.connect)
+
+    def replica(self):
+        """The sessions of a replica, sharing the database with the others."""
+        from chatidea.conversation import Context
+        from chatidea.sessions import SessionStore
+
+        store = DatabaseContextStore(self.connect)
+        sessions = SessionStore(60, 10, sweep_interval=0,
+                                factory=lambda chat_id: Context(chat_id,
+                                                                store))
+        self.addCleanup(sessions.close)
+        return sessions
+
+    def test_replicas_share_the_contexts(self):
+        from chatidea import caller
+
+        first, second = self.replica(), self.replica()
+        with mock.patch.object(caller, 'sessions', first):
+            caller.get_context('a').append_element(
+                {'element_name': 'person', 'real_value_length': 1})
+        with mock.patch.object(caller, 'sessions', second):
+            context = caller.get_context('a')
+            self.assertEqual([e['element_name']
+                              for e in context.context_list], ['person'])
+            context.append_element(
+                {'element_name': 'book', 'real_value_length': 1})
+        with mock.patch.object(caller, 'sessions', first):
+            context = caller.get_context('a')
+            context.sync()
+            self.assertEqual([e['element_name']
+                              for e in context.context_list],
+                             ['person', 'book'])
+            context.go_back_to_position(1)
+        with mock.patch.object(caller, 'sessions', second):
+            context = caller.get_context('a')
+            context.sync()
+            self.assertEqual(len(context.context_list), 1)
@@ -0,0 +1,38 @@
+import time
+from unittest import TestCase
+
+from chatidea.database.examples import ExampleReservoir
+
+
+class TestExampleReservoir(TestCase):
+    def setUp(self):
+        self.loads = []
+
+        def load(element_name, columns):
+            self.loads.append((element_name, columns))
+            return ['rossi', 'bianchi']
+
+        self.reservoir = ExampleReservoir(load, refresh_interval=60)
+
+    def test_loaded_once(self):
+        examples = self.reservoir.get('person', ['surname'])
+        examples.remove('rossi')
+        self.assertEqual(self.reservoir.get('person', ['surname']),
+                         ['rossi', 'bianchi'])
+        self.assertEqual(self.loads, [('person', ['surname'])])
+
+    def test_stale_refreshed_in_background(self):
+        self.reservoir.refresh_interval = 0
+        self.reservoir.get('person', ['surname'])
+        self.assertEqual(self.reservoir.get('person', ['surname']),
+                         ['rossi', 'bianchi'])
+        deadline = time.monotonic() + 5
+        while len(self.loads) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.loads), 2)
+
+    def test_invalidate(self):
+        self.reservoir.get('person', ['surname'])
+        self.reservoir.get('book', ['title'])
+        self.assertEqual(self.reservoir.invalidate('book'), 1)
+        self.assertEqual(len(self.reservoir), 1)
@@ -0,0 +1,37 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from chatidea.executors import SessionSerializer
+
+
+class TestSessionSerializer(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.sessions = SessionSerializer()
+        self.events = []
+
+    async def handle(self, session, message):
+        async with self.sessions.hold(session):
+            self.events.append(('start', message))
+            await asyncio.sleep(0.01)
+            self.events.append(('end', message))
+
+    async def test_same_session_in_order(self):
+        await asyncio.gather(*(self.handle('a', n) for n in range(3)))
+        self.assertEqual(self.events, [(e, n) for n in range(3)
+                                       for e in ('start', 'end')])
+        self.assertEqual(len(self.sessions), 0)
+
+    async def test_sessions_run_concurrently(self):
+        answered = asyncio.Event()
+
+        async def wait_for_b():
+            async with self.sessions.hold('a'):
+                await asyncio.wait_for(answered.wait(), timeout=1)
+
+        async def answer():
+            async with self.sessions.hold('b'):
+                answered.set()
+
+        # if "b" waited for "a", "a" would time out
+        await asyncio.gather(wait_for_b(), answer())
+        self.assertEqual(len(self.sessions), 0)
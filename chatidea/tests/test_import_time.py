@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+# Seconds taken by "import chatidea.caller" (about 0.5 when this was set),
+# generous so that only a regression fails, and overridable on slow machines
+IMPORT_BUDGET_SECONDS = float(os.environ.get('CHATIDEA_IMPORT_BUDGET_SECONDS',
+                                             2.0))
+
+
+def import_seconds(statement: str) -> float:
+    """
+    The seconds taken by the imports of the statement, summing the cumulative
+    times reported by -X importtime for the top-level imports.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             statement],
+                            capture_output=True, text=True, check=True)
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        # the nested imports are indented, and included in their parent's
+        if not module[1:].startswith(' '):
+            total += int(cumulative)
+    return total / 1e6
+
+
+def imported_modules(statement: str) -> set[str]:
+    """The modules in sys.modules after running the statement."""
+    result = subprocess.run(
+        [sys.executable, '-c',
+         f'import sys; {statement}; print(*sorted(sys.modules))'],
+        capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+class TestImportTime(TestCase):
+    def test_bot_import_budget(self):
+        # the best of a few runs, the first one may find the caches cold
+        seconds = min(import_seconds('import chatidea.caller')
+                      for _ in range(3))
+        self.assertLess(seconds, IMPORT_BUDGET_SECONDS)
+
+    def test_bot_does_not_import_matplotlib(self):
+        modules = imported_modules('import chatidea.caller')
+        self.assertIn('chatidea.caller', modules)
+        self.assertNotIn('matplotlib', modules)
+        self.assertNotIn('distutils.util', modules)
+
+    def test_chart_workers_only_import_charts(self):
+        modules = imported_modules('import chatidea.charts')
+        self.assertNotIn('matplotlib', modules)
+        self.assertNotIn('chatidea.settings', modules)
+
+    def test_configs_are_parsed_when_used(self):
+        result = subprocess.run(
+            [sys.executable, '-c', 'import chatidea.settings as s; '
+                                   'print(s._config_snapshot is not None); '
+                                   's.DB_CONCEPT; '
+                                   'print(s._config_snapshot is not None)'],
+            capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split(), ['False', 'True'])
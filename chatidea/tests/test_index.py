@@ -0,0 +1,42 @@
+from unittest import TestCase
+
+from chatidea.config import DatabaseConcepts, ConceptIndex
+
+
+def concept(name, table, aliases=(), attributes=(), category=()):
+    return {'element_name': name, 'aliases': list(aliases), 'type': 'primary',
+            'table_name': table, 'attributes': list(attributes),
+            'category': list(category)}
+
+
+class TestConceptIndex(TestCase):
+    def setUp(self):
+        self.index = ConceptIndex(DatabaseConcepts.model_validate([
+            concept('person', 'people', ['teacher'],
+                    [{'keyword': '', 'type': 'word', 'columns': ['surname']},
+                     {'keyword': 'with email', 'type': 'word',
+                      'columns': ['email']}],
+                    [{'column': 'area', 'alias': 'research area',
+                      'keyword': 'in'}]),
+            concept('teacher', 'teachers', ['lecturer']),
+        ]), [{'similars': [['1_1', '2_1'], ['2_1', '3_1']]}])
+
+    def test_first_match_wins(self):
+        self.assertEqual(self.index.element_name_from_alias('teacher'),
+                         'person')
+        self.assertEqual(self.index.element_name_from_alias('lecturer'),
+                         'teacher')
+        self.assertIsNone(self.index.element_name_from_alias('book'))
+
+    def test_attributes_and_categories(self):
+        self.assertEqual(self.index.attribute('person', 'with email').columns,
+                         ['email'])
+        self.assertIsNone(self.index.attribute('person', ''))
+        self.assertEqual(
+            self.index.attribute_without_keyword('person', 'word').columns,
+            ['surname'])
+        self.assertIs(self.index.category('person', 'area'),
+                      self.index.category('person', 'research area'))
+
+    def test_last_similar_group_wins(self):
+        self.assertEqual(self.index.similars['2_1'], ['2_1', '3_1'])
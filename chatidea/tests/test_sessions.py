@@ -0,0 +1,52 @@
+import time
+from unittest import TestCase
+
+from chatidea.sessions import SessionStore
+
+
+class FakeContext:
+    def __init__(self, chat_id):
+        self.session = chat_id
+        self.context_list = []
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestSessionStore(TestCase):
+    def store(self, ttl=60, max_sessions=10):
+        return SessionStore(ttl, max_sessions, sweep_interval=0,
+                            factory=FakeContext)
+
+    def test_same_context_for_same_chat(self):
+        store = self.store()
+        self.assertIs(store.get('a'), store.get('a'))
+        self.assertIsNot(store.get('a'), store.get('b'))
+
+    def test_expired_sessions_are_swept(self):
+        store = self.store(ttl=0.01)
+        context = store.get('a')
+        time.sleep(0.02)
+        store.get('b')
+        self.assertEqual(store.sweep(), 1)
+        self.assertNotIn('a', store)
+        self.assertTrue(context.closed)
+
+    def test_least_recently_used_is_evicted(self):
+        store = self.store(max_sessions=2)
+        store.get('a')
+        store.get('b')
+        store.get('a')
+        store.get('c')
+        self.assertEqual(set(store._sessions), {'a', 'c'})
+        self.assertEqual(store.stats.evicted, 1)
+
+    def test_held_sessions_are_not_dropped(self):
+        store = self.store(ttl=0, max_sessions=1)
+        with store.hold('a'):
+            store.get('b')
+            self.assertEqual(store.sweep(), 1)
+            self.assertIn('a', store)
+        self.assertEqual(store.sweep(), 1)
+        self.assertEqual(len(store), 0)
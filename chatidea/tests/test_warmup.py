@@ -0,0 +1,35 @@
+import threading
+from unittest import TestCase
+
+from chatidea import warmup
+from chatidea.warmup import Task
+
+
+class TestWarmup(TestCase):
+    def test_all_tasks_are_run(self):
+        done = []
+        tasks = [Task('examples', str(i), lambda i=i: done.append(i))
+                 for i in range(10)]
+        report = warmup.run(tasks, workers=3, seconds=10)
+        self.assertEqual(sorted(done), list(range(10)))
+        self.assertEqual((report.tasks, report.done, report.timed_out),
+                         (10, 10, 0))
+        self.assertEqual(list(report.timings), ['examples'])
+        self.assertIs(warmup.last_report, report)
+
+    def test_failures_are_counted(self):
+        report = warmup.run([Task('joins', 'a', lambda: 1 / 0),
+                             Task('joins', 'b', lambda: None)],
+                            workers=1, seconds=10)
+        self.assertEqual((report.done, report.failed), (1, 1))
+
+    def test_deadline(self):
+        release = threading.Event()
+        tasks = [Task('categories', str(i), lambda: release.wait(10))
+                 for i in range(3)]
+        try:
+            report = warmup.run(tasks, workers=1, seconds=0.05)
+        finally:
+            release.set()
+        self.assertEqual((report.done, report.timed_out), (0, 3))
+        self.assertLess(report.seconds, 5)
@@ -0,0 +1,154 @@
+"""
+The warm-up of the bot: the artifacts of all the concepts are computed before
+the first message is served, so that the first users do not wait for them.
+"""
+import concurrent.futures
+import dataclasses
+import logging
+import time
+from collections import namedtuple
+from typing import Iterable, Iterator, Optional
+
+from chatidea import commons
+from chatidea.actions import actions
+from chatidea.config import DatabaseConcepts
+from chatidea.database import broker, resolver
+from chatidea.settings import WARMUP_WORKERS, WARMUP_SECONDS, \
+    CATEGORY_VISU_LIMIT, CATEGORY_STATS_REFRESH_SECONDS, \
+    EXAMPLES_REFRESH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# The kind of artifact (i.e., "examples"), what it is about and the function
+# computing it
+Task = namedtuple('Task', ['kind', 'name', 'run'])
+
+PROGRESS_SECONDS = 5
+
+
+@dataclasses.dataclass
+class WarmupReport:
+    tasks: int = 0
+    done: int = 0
+    failed: int = 0
+    timed_out: int = 0  # not completed before the deadline
+    seconds: float = 0.
+    # seconds spent computing each kind of artifact, summed over the workers
+    timings: dict[str, float] = dataclasses.field(default_factory=dict)
+
+
+last_report: Optional[WarmupReport] = None
+
+
+def get_tasks(concepts: DatabaseConcepts) -> Iterator[Task]:
+    """
+    The artifacts needed to answer about the concepts: the examples of their
+    attributes, the distributions of their categories, the joins of their
+    queries and the similarity indexes of their keywords.
+    """
+    examples = set()
+    for c in concepts:
+        element_name, table_name = c.element_name, c.table_name
+        yield Task('joins', element_name,
+                   lambda t=table_name: broker.get_sql_tables([], t))
+
+        for a in c.attributes:
+            examples_of = element_name
+            if a.by:
+                examples_of = resolver.get_element_name_from_table_name(
+                    a.by[-1].to_table_name)
+                yield Task('joins', f'{element_name} {a.keyword}',
+                           lambda a=a, t=table_name: broker.get_sql_tables(
+                               broker.label_attributes([a.dict()], t), t))
+            if EXAMPLES_REFRESH_SECONDS and examples_of \
+                    and (examples_of, tuple(a.columns)) not in examples:
+                examples.add((examples_of, tuple(a.columns)))
+                yield Task('examples', f'{examples_of} {a.columns}',
+                           lambda e=examples_of, a=a:
+                           resolver.query_show_attributes_examples(e,
+                                                                   a.columns))
+
+        for r in c.relations:
+            # the relation is joined backwards, from its last table
+            yield Task('joins', f'{element_name} {r.keyword}',
+                       lambda r=r: broker.get_sql_tables(
+                           [broker.get_reverse_relation(r.dict())],
+                           r.by[-1].to_table_name))
+
+        if CATEGORY_STATS_REFRESH_SECONDS:
+            for category in c.category:
+                yield Task('categories', f'{element_name} {category.column}',
+                           lambda e=element_name, cat=category:
+                           resolver.query_category(e, cat,
+                                                   CATEGORY_VISU_LIMIT))
+
+        yield Task('similarity', element_name,
+                   lambda e=element_name: [
+                       commons.get_similarity_index(tuple(keywords))
+                       for keywords in
+                       actions.get_similarity_keyword_lists(e)])
+
+
+def _timed(task: Task) -> float:
+    started = time.monotonic()
+    task.run()
+    return time.monotonic() - started
+
+
+def run(tasks: Optional[Iterable[Task]] = None,
+        workers: int = WARMUP_WORKERS,
+        seconds: float = WARMUP_SECONDS) -> WarmupReport:
+    """
+    Computes the artifacts of the tasks (by default those of all the loaded
+    concepts) in ``workers`` threads, giving up on the ones not completed
+    within ``seconds``.
+    """
+    global last_report
+    started = time.monotonic()
+    tasks = list(get_tasks(resolver.db_concept) if tasks is None else tasks)
+    report = last_report = WarmupReport(tasks=len(tasks))
+    if not tasks or not workers:
+        return report
+
+    logger.info('Warming up %d artifact(s)...', len(tasks))
+    deadline = started + seconds
+    pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix='chatidea-warmup')
+    futures = {pool.submit(_timed, t): t for t in tasks}
+    pending = set(futures)
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            finished, pending = concurrent.futures.wait(
+                pending, timeout=min(remaining, PROGRESS_SECONDS))
+            for future in finished:
+                task = futures[future]
+                try:
+                    duration = future.result()
+                except Exception:
+                    report.failed += 1
+                    logger.exception('Cannot warm up the %s of %s',
+                                     task.kind, task.name)
+                else:
+                    report.done += 1
+                    report.timings[task.kind] = \
+                        report.timings.get(task.kind, 0.) + duration
+            logger.info('...warmed up %d of %d artifact(s)',
+                        report.done + report.failed, report.tasks)
+    finally:
+        # the running tasks are left to complete in the background
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    report.timed_out = len(pending)
+    report.seconds = time.monotonic() - started
+    if pending:
+        logger.warning('Warm-up deadline of %.0f seconds passed, %d '
+                       'artifact(s) will be computed when needed',
+                       seconds, len(pending))
+    logger.info('Warm-up completed in %.1f seconds (%s)', report.seconds,
+                ', '.join(f'{kind}: {t:.1f}s'
+                          for kind, t in sorted(report.timings.items()))
+                or 'nothing computed')
+    return report